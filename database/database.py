@@ -4,13 +4,15 @@ Módulo para la gestión de la base de datos SQLite
 import sqlite3
 import os
 import threading
+from contextlib import contextmanager
 from datetime import datetime
 
 class Database:
     def __init__(self, db_name="papasoft.db"):
         self.db_name = db_name
         self.connection = None
-        self._lock = threading.Lock()  # <-- para acceso concurrente seguro
+        self._lock = threading.RLock()  # <-- para acceso concurrente seguro (reentrante para transacciones)
+        self._tx_depth = 0  # > 0 mientras haya una transacción abierta con transaction()
         self.init_db()
         
     def connect(self):
@@ -147,15 +149,81 @@ class Database:
                 else:
                     cursor.execute(query)
                     
-                if query.strip().upper().startswith('SELECT'):
+                # cualquier sentencia que devuelva filas (SELECT, WITH ... SELECT, PRAGMA)
+                if cursor.description is not None:
                     return cursor.fetchall()
                 else:
-                    conn.commit()
+                    # dentro de transaction() el commit lo hace el bloque externo
+                    if self._tx_depth == 0:
+                        conn.commit()
                     return cursor.lastrowid
             except sqlite3.Error as e:
-                conn.rollback()
+                if self._tx_depth == 0:
+                    conn.rollback()
                 raise e
+
+    @contextmanager
+    def transaction(self):
+        """
+        Agrupa varias operaciones en una sola transacción.
+        Mientras el bloque esté abierto, execute_query no hace commit; al salir
+        se hace commit (o rollback si hubo excepción). Los bloques anidados se
+        integran en la transacción externa.
+        """
+        with self._lock:
+            conn = self.connect()
+            self._tx_depth += 1
+            try:
+                yield conn.cursor()
+            except Exception:
+                self._tx_depth -= 1
+                if self._tx_depth == 0:
+                    conn.rollback()
+                raise
+            else:
+                self._tx_depth -= 1
+                if self._tx_depth == 0:
+                    conn.commit()
             
+    def stream_query(self, query, params=None, chunk_size=500):
+        """
+        Ejecuta un SELECT y devuelve los resultados por bloques (listas de dict)
+        de hasta chunk_size filas. Usa una conexión propia de solo lectura para
+        poder recorrerse desde un hilo de trabajo sin bloquear la conexión
+        compartida mientras dura la lectura.
+        """
+        conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, params or ())
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [dict(r) for r in rows]
+        finally:
+            conn.close()
+
+    def run_once(self, name, fn):
+        """
+        Migración de datos que se ejecuta una sola vez por base: fn() y su registro en
+        schema_migrations van en la misma transacción. Devuelve True si se ejecutó ahora.
+        """
+        with self.transaction() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    name TEXT PRIMARY KEY,
+                    applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cur.execute("SELECT 1 FROM schema_migrations WHERE name = ?", (name,))
+            if cur.fetchone():
+                return False
+            fn()
+            cur.execute("INSERT INTO schema_migrations (name) VALUES (?)", (name,))
+        return True
+
     def get_cursor(self):
         """Obtener un cursor para operaciones más complejas"""
         return self.connect().cursor()
@@ -4,6 +4,7 @@ Punto de entrada principal para la aplicación PapaSoft
 """
 import sys
 import os
+import multiprocessing
 
 # Agregar las rutas de los módulos al path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'database'))
@@ -42,5 +43,7 @@ class PapaSoftApp:
         sys.exit(0)
 
 if __name__ == "__main__":
+    # ejecutable congelado (cx_Freeze): los procesos del pool de recibos no deben abrir la app
+    multiprocessing.freeze_support()
     app = PapaSoftApp()
     app.run()
\ No newline at end of file
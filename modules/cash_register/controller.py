@@ -1,30 +1,558 @@
 """
 Controlador para el módulo de caja
+- Libro de saldos diarios por método de pago (cash_daily_balances), mantenido por triggers,
+  para obtener saldos de apertura, cierre y de período con búsquedas indexadas
+- Cierres de caja (arqueos) en cash_closures: efectivo contado, saldo del sistema y diferencia por día
+- Categorías normalizadas (cash_categories) con id entero en cash_register.category_id
 """
 from datetime import datetime, timedelta
 from database.models import CashTransaction
+from utils.export import export_rows
+
+# Categorías conocidas: código -> (nombre, alias usados históricamente en el texto libre)
+DEFAULT_CATEGORIES = {
+    "venta": ("Venta", ("ventas",)),
+    "venta_credito": ("Abono venta a crédito", ()),
+    "compra_inventario": ("Compra de inventario", ("compra", "compras")),
+    "empaque": ("Empaque (costales)", ("costales",)),
+    "prestamo_empleado": ("Préstamo a empleado", ("préstamo", "prestamo", "pago préstamo empleado")),
+    "nomina_pago": ("Nómina - pago de salario", ("nómina", "nomina", "pago salario")),
+    "nomina_deduccion_prestamo": ("Nómina - deducción de préstamo",
+                                  ("pago préstamo empleado (nómina)", "deducción nómina")),
+}
+
 
 class CashRegisterController:
     def __init__(self, database, auth_manager):
         self.db = database
         self.auth_manager = auth_manager
+        self._ensure_schema()
+
+    def _ensure_schema(self):
+        """
+        cash_daily_balances: una fila por (método de pago, día) con lo movido ese día, la
+        cantidad de ingresos/egresos y los acumulados hasta ese día inclusive. Los triggers
+        la mantienen ante altas, ediciones y borrados (incluidos movimientos con fecha pasada)
+        y suben cash_ledger_version, que la UI consulta para refrescarse en vivo.
+        """
+        created = not self.db.execute_query(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='cash_daily_balances'"
+        )
+        self.db.execute_query("""
+            CREATE TABLE IF NOT EXISTS cash_daily_balances (
+                payment_method TEXT NOT NULL,
+                date TEXT NOT NULL,
+                income REAL NOT NULL DEFAULT 0,
+                expense REAL NOT NULL DEFAULT 0,
+                cum_income REAL NOT NULL DEFAULT 0,
+                cum_expense REAL NOT NULL DEFAULT 0,
+                income_count INTEGER NOT NULL DEFAULT 0,
+                expense_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (payment_method, date)
+            )
+        """)
+        self.db.execute_query("CREATE INDEX IF NOT EXISTS idx_cdb_date ON cash_daily_balances(date)")
+        # orden (date DESC, id DESC) del listado paginado sin ordenar en memoria
+        self.db.execute_query("CREATE INDEX IF NOT EXISTS idx_cash_date ON cash_register(date)")
+        self.db.execute_query("""
+            CREATE TABLE IF NOT EXISTS cash_ledger_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self.db.execute_query("INSERT OR IGNORE INTO cash_ledger_version (id, version) VALUES (1, 0)")
+        # métodos de pago presentes en el libro (los completa el trigger de alta): _cumulative
+        # recorre esta tabla chica en vez de un DISTINCT sobre todo cash_daily_balances
+        methods_created = not self.db.execute_query(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='cash_payment_methods'"
+        )
+        self.db.execute_query(
+            "CREATE TABLE IF NOT EXISTS cash_payment_methods (payment_method TEXT PRIMARY KEY)"
+        )
+        if methods_created:
+            for name in self._ledger_triggers():
+                self.db.execute_query(f"DROP TRIGGER IF EXISTS {name}")
+            self.db.execute_query("""
+                INSERT OR IGNORE INTO cash_payment_methods (payment_method)
+                SELECT DISTINCT payment_method FROM cash_daily_balances
+            """)
+
+        # libros creados antes de los contadores: agregar columnas y regenerar triggers
+        try:
+            self.db.execute_query(
+                "ALTER TABLE cash_daily_balances ADD COLUMN income_count INTEGER NOT NULL DEFAULT 0")
+            self.db.execute_query(
+                "ALTER TABLE cash_daily_balances ADD COLUMN expense_count INTEGER NOT NULL DEFAULT 0")
+            for name in self._ledger_triggers():
+                self.db.execute_query(f"DROP TRIGGER IF EXISTS {name}")
+            created = True
+        except Exception:
+            pass  # columnas ya existen
+
+        for name, sql in self._ledger_triggers().items():
+            self.db.execute_query(f"CREATE TRIGGER IF NOT EXISTS {name} {sql}")
+
+        if created:
+            self.rebuild_daily_balances()
+
+        # Arqueos: uno por día; el índice único de date sirve también para "¿ya se cerró hoy?"
+        closures_created = not self.db.execute_query(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='cash_closures'"
+        )
+        self.db.execute_query("""
+            CREATE TABLE IF NOT EXISTS cash_closures (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TEXT NOT NULL UNIQUE,
+                opening_balance REAL NOT NULL DEFAULT 0,
+                cash_income REAL NOT NULL DEFAULT 0,
+                cash_expense REAL NOT NULL DEFAULT 0,
+                system_balance REAL NOT NULL,
+                counted_cash REAL NOT NULL,
+                difference REAL NOT NULL,
+                notes TEXT,
+                user_id INTEGER,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        """)
+        if closures_created:
+            self._migrate_legacy_closures()
+
+        # Categorías: tabla de dimensión + alias (texto libre normalizado con lower/trim -> id)
+        self.db.execute_query("""
+            CREATE TABLE IF NOT EXISTS cash_categories (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                code TEXT NOT NULL UNIQUE,
+                name TEXT NOT NULL
+            )
+        """)
+        self.db.execute_query("""
+            CREATE TABLE IF NOT EXISTS cash_category_aliases (
+                alias TEXT PRIMARY KEY,
+                category_id INTEGER NOT NULL,
+                FOREIGN KEY (category_id) REFERENCES cash_categories (id)
+            )
+        """)
+        try:
+            self.db.execute_query("ALTER TABLE cash_register ADD COLUMN category_id INTEGER REFERENCES cash_categories(id)")
+            category_added = True
+        except Exception:
+            category_added = False  # columna ya existe
+        self.db.execute_query(
+            "CREATE INDEX IF NOT EXISTS idx_cash_category_date ON cash_register(category_id, date)"
+        )
+        self._category_cache = {}
+        if category_added:
+            self.migrate_categories()
+
+        # Empleado del movimiento (nómina / préstamos): los reportes agrupan por id, no por descripción
+        try:
+            self.db.execute_query("ALTER TABLE cash_register ADD COLUMN employee_id INTEGER")
+            employee_added = True
+        except Exception:
+            employee_added = False  # columna ya existe
+        self.db.execute_query(
+            "CREATE INDEX IF NOT EXISTS idx_cash_employee_date ON cash_register(employee_id, date)"
+        )
+        if employee_added:
+            self.migrate_employee_ids()
+
+    def migrate_categories(self):
+        """
+        Carga las categorías conocidas con sus alias, crea una categoría por cada texto
+        libre restante y completa cash_register.category_id (operaciones por conjunto).
+        """
+        with self.db.transaction() as cur:
+            for code, (name, aliases) in DEFAULT_CATEGORIES.items():
+                cur.execute("INSERT OR IGNORE INTO cash_categories (code, name) VALUES (?, ?)", (code, name))
+                for alias in (code, name) + tuple(aliases):
+                    cur.execute("""
+                        INSERT OR IGNORE INTO cash_category_aliases (alias, category_id)
+                        SELECT LOWER(TRIM(?)), id FROM cash_categories WHERE code = ?
+                    """, (alias, code))
+            # textos libres sin alias: categoría propia (code = texto normalizado)
+            cur.execute("""
+                INSERT OR IGNORE INTO cash_categories (code, name)
+                SELECT LOWER(TRIM(category)), MIN(TRIM(category))
+                  FROM cash_register
+                 WHERE TRIM(COALESCE(category, '')) <> ''
+                   AND LOWER(TRIM(category)) NOT IN (SELECT alias FROM cash_category_aliases)
+                 GROUP BY LOWER(TRIM(category))
+            """)
+            cur.execute("""
+                INSERT OR IGNORE INTO cash_category_aliases (alias, category_id)
+                SELECT code, id FROM cash_categories
+            """)
+            cur.execute("""
+                UPDATE cash_register
+                   SET category_id = (SELECT a.category_id FROM cash_category_aliases a
+                                       WHERE a.alias = LOWER(TRIM(cash_register.category)))
+                 WHERE TRIM(COALESCE(category, '')) <> ''
+            """)
+        self._category_cache = {}
+
+    def migrate_employee_ids(self):
+        """
+        Completa cash_register.employee_id de los movimientos de nómina anteriores a la columna,
+        reconociendo el nombre del empleado en la descripción (formatos actual y antiguo).
+        Una sola sentencia por conjunto; si aún no existe la tabla employees no hay nada que asignar.
+        """
+        if not self.db.execute_query("SELECT 1 FROM sqlite_master WHERE type='table' AND name='employees'"):
+            return
+        name = "TRIM(e.first_name || ' ' || e.last_name)"
+        desc = "TRIM(cash_register.description)"
+        try:
+            self.db.execute_query(f"""
+                UPDATE cash_register
+                   SET employee_id = (
+                       SELECT e.id FROM employees e
+                        WHERE {desc} IN ('Pago de salario: ' || {name},
+                                         'Deducción préstamo vía nómina: ' || {name})
+                           OR SUBSTR({desc}, 1, LENGTH('Pago salario - ' || {name})) = 'Pago salario - ' || {name}
+                           OR SUBSTR({desc}, 1, LENGTH('Deducción nómina - ' || {name})) = 'Deducción nómina - ' || {name}
+                        ORDER BY e.id LIMIT 1)
+                 WHERE employee_id IS NULL
+                   AND category_id IN (SELECT category_id FROM cash_category_aliases
+                                        WHERE alias IN ('nomina_pago', 'nomina_deduccion_prestamo'))
+            """)
+        except Exception as e:
+            print(f"[CashRegister] Movimientos de nómina sin empleado asignado: {e}")
+
+    def get_category_id(self, category):
+        """id de la categoría para un texto (crea la categoría si es nueva); None si está vacío"""
+        key = (category or "").strip()
+        if not key:
+            return None
+        hit = self._category_cache.get(key)
+        if hit is not None:
+            return hit
+        rows = self.db.execute_query(
+            "SELECT category_id FROM cash_category_aliases WHERE alias = LOWER(TRIM(?))", (key,)
+        )
+        if rows:
+            cat_id = rows[0]["category_id"]
+            self._category_cache[key] = cat_id
+        else:
+            with self.db.transaction() as cur:
+                cur.execute("INSERT OR IGNORE INTO cash_categories (code, name) VALUES (LOWER(TRIM(?)), TRIM(?))",
+                            (key, key))
+                cur.execute("SELECT id FROM cash_categories WHERE code = LOWER(TRIM(?))", (key,))
+                cat_id = cur.fetchone()["id"]
+                cur.execute("INSERT OR IGNORE INTO cash_category_aliases (alias, category_id) VALUES (LOWER(TRIM(?)), ?)",
+                            (key, cat_id))
+            # no se guarda en caché: si la transacción externa se revierte, la categoría no existirá
+        return cat_id
+
+    def get_categories(self):
+        rows = self.db.execute_query("SELECT id, code, name FROM cash_categories ORDER BY name")
+        return [dict(r) for r in rows] if rows else []
+
+    def get_category_breakdown(self, start_date, end_date, type_filter=None):
+        """Ingresos/egresos y cantidad de movimientos por categoría en el rango"""
+        query = """
+            SELECT cr.category_id, COALESCE(cc.code, '') AS code,
+                   COALESCE(cc.name, 'Sin categoría') AS name,
+                   COUNT(*) AS count,
+                   COALESCE(SUM(CASE WHEN cr.type='income'  THEN cr.amount END), 0) AS income,
+                   COALESCE(SUM(CASE WHEN cr.type='expense' THEN cr.amount END), 0) AS expense
+              FROM cash_register cr
+              LEFT JOIN cash_categories cc ON cc.id = cr.category_id
+             WHERE cr.date BETWEEN ? AND ?
+        """
+        params = [start_date, end_date]
+        if type_filter:
+            query += " AND cr.type = ?"
+            params.append(type_filter)
+        query += " GROUP BY cr.category_id ORDER BY (income + expense) DESC"
+        results = self.db.execute_query(query, params)
+        out = []
+        for r in results or []:
+            d = dict(r)
+            d["balance"] = d["income"] - d["expense"]
+            out.append(d)
+        return out
+
+    def sum_by_category(self, code, start_date, end_date, type_filter=None, group_by_description=False):
+        """
+        Total de una categoría en el rango usando el índice (category_id, date).
+        Con group_by_description devuelve {descripción: total}.
+        """
+        rows = self.db.execute_query("SELECT category_id FROM cash_category_aliases WHERE alias = LOWER(TRIM(?))",
+                                     (code,))
+        if not rows:
+            return {} if group_by_description else 0.0
+        query = "SELECT {cols} FROM cash_register WHERE category_id = ? AND date BETWEEN ? AND ?"
+        params = [rows[0]["category_id"], start_date, end_date]
+        if type_filter:
+            query += " AND type = ?"
+            params.append(type_filter)
+        if group_by_description:
+            res = self.db.execute_query(query.format(cols="description, SUM(amount) AS s") + " GROUP BY description",
+                                        params)
+            return {r["description"]: float(r["s"] or 0) for r in res or []}
+        res = self.db.execute_query(query.format(cols="COALESCE(SUM(amount), 0) AS s"), params)
+        return float(res[0]["s"] or 0) if res else 0.0
+
+    def _migrate_legacy_closures(self):
+        """
+        Antes los cierres se marcaban con un movimiento cuya descripción contenía
+        'CIERRE DE CAJA'. Se registran como arqueos sin diferencia (no se guardó lo contado).
+        """
+        rows = self.db.execute_query(
+            "SELECT DISTINCT date FROM cash_register WHERE description LIKE '%CIERRE DE CAJA%' ORDER BY date"
+        )
+        for r in rows or []:
+            day = self.get_day_summary(r["date"])
+            self.db.execute_query("""
+                INSERT OR IGNORE INTO cash_closures
+                    (date, opening_balance, cash_income, cash_expense, system_balance,
+                     counted_cash, difference, notes)
+                VALUES (?, ?, ?, ?, ?, ?, 0, 'Migrado de movimiento CIERRE DE CAJA')
+            """, (r["date"], day["opening_balance"], day["cash_income"], day["cash_expense"],
+                  day["system_balance"], day["system_balance"]))
+
+    @staticmethod
+    def _ledger_triggers():
+        def add(row, sign):
+            # asegura la fila del día (heredando el acumulado anterior) y suma/resta el movimiento
+            inc = f"(CASE WHEN {row}.type='income' THEN {sign}{row}.amount ELSE 0 END)"
+            exp = f"(CASE WHEN {row}.type='expense' THEN {sign}{row}.amount ELSE 0 END)"
+            n_inc = f"(CASE WHEN {row}.type='income' THEN {sign}1 ELSE 0 END)"
+            n_exp = f"(CASE WHEN {row}.type='expense' THEN {sign}1 ELSE 0 END)"
+            return f"""
+                INSERT OR IGNORE INTO cash_payment_methods (payment_method) VALUES ({row}.payment_method);
+                INSERT OR IGNORE INTO cash_daily_balances (payment_method, date, income, expense, cum_income, cum_expense)
+                VALUES ({row}.payment_method, {row}.date, 0, 0,
+                    COALESCE((SELECT cum_income FROM cash_daily_balances
+                               WHERE payment_method={row}.payment_method AND date<{row}.date
+                               ORDER BY date DESC LIMIT 1), 0),
+                    COALESCE((SELECT cum_expense FROM cash_daily_balances
+                               WHERE payment_method={row}.payment_method AND date<{row}.date
+                               ORDER BY date DESC LIMIT 1), 0));
+                UPDATE cash_daily_balances
+                   SET income = income + {inc}, expense = expense + {exp},
+                       income_count = income_count + {n_inc}, expense_count = expense_count + {n_exp}
+                 WHERE payment_method={row}.payment_method AND date={row}.date;
+                UPDATE cash_daily_balances
+                   SET cum_income = cum_income + {inc}, cum_expense = cum_expense + {exp}
+                 WHERE payment_method={row}.payment_method AND date>={row}.date;
+            """
+        bump = "UPDATE cash_ledger_version SET version = version + 1 WHERE id = 1;"
+        return {
+            "trg_cash_ledger_ai": f"AFTER INSERT ON cash_register BEGIN {add('NEW', '')} {bump} END",
+            "trg_cash_ledger_ad": f"AFTER DELETE ON cash_register BEGIN {add('OLD', '-')} {bump} END",
+            "trg_cash_ledger_au": (
+                "AFTER UPDATE OF date, type, amount, payment_method ON cash_register "
+                f"BEGIN {add('OLD', '-')} {add('NEW', '')} {bump} END"
+            ),
+        }
+
+    def rebuild_daily_balances(self):
+        """Recalcula todo el libro de saldos desde cash_register (migración o verificación)."""
+        with self.db.transaction() as cur:
+            cur.execute("DELETE FROM cash_daily_balances")
+            cur.execute("""
+                INSERT INTO cash_daily_balances (payment_method, date, income, expense, cum_income, cum_expense,
+                                                 income_count, expense_count)
+                SELECT payment_method, date, income, expense,
+                       SUM(income)  OVER (PARTITION BY payment_method ORDER BY date),
+                       SUM(expense) OVER (PARTITION BY payment_method ORDER BY date),
+                       income_count, expense_count
+                  FROM (
+                    SELECT payment_method, date,
+                           SUM(CASE WHEN type='income'  THEN amount ELSE 0 END) AS income,
+                           SUM(CASE WHEN type='expense' THEN amount ELSE 0 END) AS expense,
+                           SUM(CASE WHEN type='income'  THEN 1 ELSE 0 END) AS income_count,
+                           SUM(CASE WHEN type='expense' THEN 1 ELSE 0 END) AS expense_count
+                      FROM cash_register
+                     GROUP BY payment_method, date
+                  )
+            """)
+            cur.execute("""
+                INSERT OR IGNORE INTO cash_payment_methods (payment_method)
+                SELECT DISTINCT payment_method FROM cash_daily_balances
+            """)
+            cur.execute("UPDATE cash_ledger_version SET version = version + 1 WHERE id = 1")
+
+    def _cumulative(self, date, inclusive=True, payment_method=None):
+        """
+        Acumulado de ingresos/egresos hasta una fecha (inclusive o no), sumando los métodos
+        de pago (tabla cash_payment_methods). Una búsqueda por índice (payment_method, date)
+        por cada método.
+        """
+        op = "<=" if inclusive else "<"
+        query = f"""
+            SELECT
+              COALESCE(SUM((SELECT b.cum_income FROM cash_daily_balances b
+                              WHERE b.payment_method = m.payment_method AND b.date {op} ?
+                              ORDER BY b.date DESC LIMIT 1)), 0) AS income,
+              COALESCE(SUM((SELECT b.cum_expense FROM cash_daily_balances b
+                              WHERE b.payment_method = m.payment_method AND b.date {op} ?
+                              ORDER BY b.date DESC LIMIT 1)), 0) AS expense
+            FROM cash_payment_methods m
+        """
+        params = [date, date]
+        if payment_method:
+            query += " WHERE m.payment_method = ?"
+            params.append(payment_method)
+        row = self.db.execute_query(query, tuple(params))
+        inc = float(row[0]["income"] or 0) if row else 0.0
+        exp = float(row[0]["expense"] or 0) if row else 0.0
+        return inc, exp
+
+    def get_opening_balance(self, date, payment_method=None):
+        """Saldo al inicio del día (todo lo anterior a la fecha)."""
+        inc, exp = self._cumulative(date, inclusive=False, payment_method=payment_method)
+        return inc - exp
+
+    def get_closing_balance(self, date, payment_method=None):
+        """Saldo al cierre del día (todo hasta la fecha inclusive)."""
+        inc, exp = self._cumulative(date, inclusive=True, payment_method=payment_method)
+        return inc - exp
     
-    def add_transaction(self, date, type, description, amount, payment_method, category):
-        """Agregar una nueva transacción de caja"""
+    # ------------------------------------------------------------------
+    # Cierre de caja (arqueo)
+    # ------------------------------------------------------------------
+    def get_last_closure(self, before_date=None):
+        """Último arqueo (anterior a before_date si se indica) o None"""
+        if before_date:
+            rows = self.db.execute_query(
+                "SELECT * FROM cash_closures WHERE date < ? ORDER BY date DESC LIMIT 1", (before_date,)
+            )
+        else:
+            rows = self.db.execute_query("SELECT * FROM cash_closures ORDER BY date DESC LIMIT 1")
+        return dict(rows[0]) if rows else None
+
+    def get_closure(self, date):
+        rows = self.db.execute_query("SELECT * FROM cash_closures WHERE date = ?", (date,))
+        return dict(rows[0]) if rows else None
+
+    def is_day_closed(self, date):
+        """Búsqueda por el índice único de cash_closures.date"""
+        return bool(self.db.execute_query("SELECT 1 FROM cash_closures WHERE date = ? LIMIT 1", (date,)))
+
+    def get_closures(self, start_date=None, end_date=None, limit=None):
+        """Arqueos registrados (más recientes primero)"""
+        where, params = ["1=1"], []
+        if start_date:
+            where.append("c.date >= ?")
+            params.append(start_date)
+        if end_date:
+            where.append("c.date <= ?")
+            params.append(end_date)
+        query = f"""
+            SELECT c.*, u.username
+              FROM cash_closures c
+              LEFT JOIN users u ON c.user_id = u.id
+             WHERE {' AND '.join(where)}
+             ORDER BY c.date DESC
+        """
+        if limit:
+            query += " LIMIT ?"
+            params.append(int(limit))
+        results = self.db.execute_query(query, params)
+        return [dict(row) for row in results] if results else []
+
+    def get_day_opening(self, date):
+        """
+        Saldo de efectivo al abrir el día. Si hay un arqueo anterior se parte de lo
+        contado en ese cierre y se suman los movimientos en efectivo de los días
+        intermedios; si no hay ninguno, se usa el libro de saldos.
+        """
+        last = self.get_last_closure(before_date=date)
+        if not last:
+            return {'opening_balance': self.get_opening_balance(date, 'cash'), 'closure_date': None}
+        since_closure = (self.get_opening_balance(date, 'cash')
+                         - self.get_closing_balance(last['date'], 'cash'))
+        return {
+            'opening_balance': round(float(last['counted_cash']) + since_closure, 2),
+            'closure_date': last['date'],
+        }
+
+    def get_day_summary(self, date):
+        """Apertura, movimientos en efectivo del día y saldo esperado por el sistema"""
+        opening = self.get_day_opening(date)
+        row = self.db.execute_query(
+            "SELECT income, expense FROM cash_daily_balances WHERE payment_method = 'cash' AND date = ?",
+            (date,)
+        )
+        cash_income = float(row[0]["income"] or 0) if row else 0.0
+        cash_expense = float(row[0]["expense"] or 0) if row else 0.0
+        return {
+            'date': date,
+            'opening_balance': opening['opening_balance'],
+            'opening_from_closure': opening['closure_date'],
+            'cash_income': cash_income,
+            'cash_expense': cash_expense,
+            'system_balance': round(opening['opening_balance'] + cash_income - cash_expense, 2),
+        }
+
+    def close_day(self, date, counted_cash, notes=""):
+        """Registrar el arqueo del día: efectivo contado vs. saldo del sistema"""
+        if not self.auth_manager.current_user:
+            raise Exception("Usuario no autenticado")
+        counted_cash = float(counted_cash)
+        if counted_cash < 0:
+            raise ValueError("El efectivo contado no puede ser negativo")
+        if self.is_day_closed(date):
+            raise Exception(f"La caja del {date} ya fue cerrada")
+
+        day = self.get_day_summary(date)
+        difference = round(counted_cash - day['system_balance'], 2)
+        closure_id = self.db.execute_query("""
+            INSERT INTO cash_closures
+                (date, opening_balance, cash_income, cash_expense, system_balance,
+                 counted_cash, difference, notes, user_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (date, day['opening_balance'], day['cash_income'], day['cash_expense'],
+              day['system_balance'], counted_cash, difference, notes,
+              self.auth_manager.current_user))
+        return dict(day, id=closure_id, counted_cash=counted_cash, difference=difference)
+
+    def delete_closure(self, date):
+        """Reabrir un día (solo administradores)"""
+        if not self.auth_manager.has_permission('admin'):
+            raise Exception("Solo los administradores pueden reabrir un cierre de caja")
+        self.db.execute_query("DELETE FROM cash_closures WHERE date = ?", (date,))
+        return True
+
+    def add_transaction(self, date, type, description, amount, payment_method, category, employee_id=None):
+        """Agregar una nueva transacción de caja (employee_id: empleado de nómina / préstamos, si aplica)"""
         if not self.auth_manager.current_user:
             raise Exception("Usuario no autenticado")
         
         query = """
-            INSERT INTO cash_register (date, type, description, amount, payment_method, category, user_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO cash_register (date, type, description, amount, payment_method, category, category_id,
+                                       user_id, employee_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
         """
         
         transaction_id = self.db.execute_query(
-            query, (date, type, description, amount, payment_method, category, self.auth_manager.current_user)
+            query, (date, type, description, amount, payment_method, category,
+                    self.get_category_id(category), self.auth_manager.current_user, employee_id)
         )
         
         return transaction_id
     
+    def add_transactions(self, rows):
+        """
+        Agrega varios movimientos con un solo executemany (se integra en la transacción abierta).
+        rows: tuplas (date, type, description, amount, payment_method, category, employee_id).
+        """
+        if not self.auth_manager.current_user:
+            raise Exception("Usuario no autenticado")
+        rows = list(rows)
+        if not rows:
+            return 0
+        with self.db.transaction() as cur:
+            cur.executemany("""
+                INSERT INTO cash_register (date, type, description, amount, payment_method, category, category_id,
+                                           user_id, employee_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(d, t, desc, amount, method, cat, self.get_category_id(cat), self.auth_manager.current_user, emp)
+                  for d, t, desc, amount, method, cat, emp in rows])
+        return len(rows)
+
     def update_transaction(self, transaction_id, date, type, description, amount, payment_method, category):
         """Actualizar una transacción existente"""
         # Verificar permisos (solo admin puede editar)
@@ -33,12 +561,13 @@ class CashRegisterController:
         
         query = """
             UPDATE cash_register 
-            SET date=?, type=?, description=?, amount=?, payment_method=?, category=?
+            SET date=?, type=?, description=?, amount=?, payment_method=?, category=?, category_id=?
             WHERE id=?
         """
         
         self.db.execute_query(
-            query, (date, type, description, amount, payment_method, category, transaction_id)
+            query, (date, type, description, amount, payment_method, category,
+                    self.get_category_id(category), transaction_id)
         )
         
         return True
@@ -53,56 +582,158 @@ class CashRegisterController:
         self.db.execute_query(query, (transaction_id,))
         return True
     
+    @staticmethod
+    def _transactions_where(start_date=None, end_date=None, type_filter=None, payment_method_filter=None):
+        where, params = ["1=1"], []
+        if start_date:
+            where.append("cr.date >= ?")
+            params.append(start_date)
+        if end_date:
+            where.append("cr.date <= ?")
+            params.append(end_date)
+        if type_filter:
+            where.append("cr.type = ?")
+            params.append(type_filter)
+        if payment_method_filter:
+            where.append("cr.payment_method = ?")
+            params.append(payment_method_filter)
+        return " AND ".join(where), params
+
     def get_transactions(self, start_date=None, end_date=None, type_filter=None, payment_method_filter=None):
         """Obtener transacciones con filtros opcionales"""
-        query = """
+        where, params = self._transactions_where(start_date, end_date, type_filter, payment_method_filter)
+        query = f"""
             SELECT cr.*, u.username 
             FROM cash_register cr 
             LEFT JOIN users u ON cr.user_id = u.id
-            WHERE 1=1
+            WHERE {where}
+            ORDER BY cr.date DESC, cr.created_at DESC
         """
-        params = []
-        
+        results = self.db.execute_query(query, params)
+        return [dict(row) for row in results] if results else []
+
+    def iter_transactions(self, start_date=None, end_date=None, type_filter=None,
+                          payment_method_filter=None, chunk_size=1000):
+        """Mismo filtro que get_transactions, leído por bloques desde SQL (para exportaciones)"""
+        where, params = self._transactions_where(start_date, end_date, type_filter, payment_method_filter)
+        query = f"""
+            SELECT cr.id, cr.date, cr.type, cr.description, cr.amount, cr.payment_method,
+                   cr.category, u.username
+              FROM cash_register cr
+              LEFT JOIN users u ON cr.user_id = u.id
+             WHERE {where}
+             ORDER BY cr.date, cr.id
+        """
+        return self.db.stream_query(query, params, chunk_size)
+
+    def export_transactions(self, path, start_date=None, end_date=None, type_filter=None,
+                            payment_method_filter=None, progress=None, cancel_event=None):
+        """Movimientos del filtro a CSV / CSV.GZ / XLSX (según la extensión de path)"""
+        total = self.get_transactions_summary(start_date, end_date, type_filter, payment_method_filter)["count"]
+        return export_rows(
+            path,
+            ["ID", "Fecha", "Tipo", "Descripción", "Monto", "Método de pago", "Categoría", "Usuario"],
+            self.iter_transactions(start_date, end_date, type_filter, payment_method_filter),
+            row_mapper=lambda r: [r["id"], r["date"], r["type"], r["description"], float(r["amount"]),
+                                  r["payment_method"], r["category"] or "", r["username"] or ""],
+            sheet_title="Movimientos de caja",
+            total_rows=total, progress=progress, cancel_event=cancel_event,
+        )
+
+    def get_transactions_page(self, start_date=None, end_date=None, type_filter=None,
+                              payment_method_filter=None, after=None, offset=0, limit=200):
+        """
+        Una página del listado ordenado por (date DESC, id DESC).
+        after=(date, id) de la última fila ya leída -> continúa por keyset (sin OFFSET);
+        si no, usa offset (saltos a cualquier posición).
+        """
+        where, params = self._transactions_where(start_date, end_date, type_filter, payment_method_filter)
+        if after:
+            where += " AND (cr.date, cr.id) < (?, ?)"
+            params += [after[0], after[1]]
+        query = f"""
+            SELECT cr.*, u.username, cc.name AS category_name
+              FROM cash_register cr
+              LEFT JOIN users u ON cr.user_id = u.id
+              LEFT JOIN cash_categories cc ON cc.id = cr.category_id
+             WHERE {where}
+             ORDER BY cr.date DESC, cr.id DESC
+             LIMIT ?
+        """
+        params.append(int(limit))
+        if not after and offset:
+            query += " OFFSET ?"
+            params.append(int(offset))
+        results = self.db.execute_query(query, params)
+        return [dict(row) for row in results] if results else []
+
+    def get_transactions_summary(self, start_date=None, end_date=None, type_filter=None, payment_method_filter=None):
+        """
+        Cantidad de movimientos y totales del filtro leídos de los contadores del libro diario
+        (una fila por día y método, no por movimiento)
+        """
+        where, params = ["1=1"], []
         if start_date:
-            query += " AND cr.date >= ?"
+            where.append("date >= ?")
             params.append(start_date)
-        
         if end_date:
-            query += " AND cr.date <= ?"
+            where.append("date <= ?")
             params.append(end_date)
-        
-        if type_filter:
-            query += " AND cr.type = ?"
-            params.append(type_filter)
-        
         if payment_method_filter:
-            query += " AND cr.payment_method = ?"
+            where.append("payment_method = ?")
             params.append(payment_method_filter)
-        
-        query += " ORDER BY cr.date DESC, cr.created_at DESC"
-        
-        results = self.db.execute_query(query, params)
-        return [dict(row) for row in results] if results else []
-    
-    def get_daily_balance(self, date):
-        """Obtener el balance diario para una fecha específica"""
-        query_income = """
-            SELECT COALESCE(SUM(amount), 0) as total_income 
-            FROM cash_register 
-            WHERE date = ? AND type = 'income'
+        row = self.db.execute_query(f"""
+            SELECT COALESCE(SUM(income_count), 0) AS n_inc, COALESCE(SUM(expense_count), 0) AS n_exp,
+                   COALESCE(SUM(income), 0) AS income, COALESCE(SUM(expense), 0) AS expense
+              FROM cash_daily_balances
+             WHERE {' AND '.join(where)}
+        """, params)
+        r = dict(row[0]) if row else {"n_inc": 0, "n_exp": 0, "income": 0, "expense": 0}
+        income, expense = round(float(r["income"] or 0), 2), round(float(r["expense"] or 0), 2)
+        n_inc, n_exp = int(r["n_inc"] or 0), int(r["n_exp"] or 0)
+        if type_filter == 'income':
+            return {"count": n_inc, "income": income, "expense": 0.0}
+        if type_filter == 'expense':
+            return {"count": n_exp, "income": 0.0, "expense": expense}
+        return {"count": n_inc + n_exp, "income": income, "expense": expense}
+
+    def get_ledger_version(self):
+        """Número que cambia con cada alta, edición o borrado en cash_register"""
+        rows = self.db.execute_query("SELECT version FROM cash_ledger_version WHERE id = 1")
+        return int(rows[0]["version"]) if rows else 0
+
+    def get_live_counters(self, date=None):
         """
-        query_expense = """
-            SELECT COALESCE(SUM(amount), 0) as total_expense 
-            FROM cash_register 
-            WHERE date = ? AND type = 'expense'
+        Totales del día por método de pago desde los contadores (búsqueda por clave primaria),
+        junto con la versión del libro para saber si hubo cambios.
         """
-        
-        income_result = self.db.execute_query(query_income, (date,))
-        expense_result = self.db.execute_query(query_expense, (date,))
-        
-        total_income = income_result[0][0] if income_result else 0
-        total_expense = expense_result[0][0] if expense_result else 0
-        
+        date = date or datetime.now().strftime('%Y-%m-%d')
+        rows = self.db.execute_query("""
+            SELECT payment_method, income, expense, income_count + expense_count AS n
+              FROM cash_daily_balances
+             WHERE date = ?
+        """, (date,))
+        out = {'date': date, 'income': 0.0, 'expense': 0.0, 'count': 0,
+               'cash': 0.0, 'transfer': 0.0, 'version': self.get_ledger_version()}
+        for r in rows or []:
+            inc, exp = float(r["income"] or 0), float(r["expense"] or 0)
+            out['income'] += inc
+            out['expense'] += exp
+            out['count'] += int(r["n"] or 0)
+            out[r["payment_method"]] = out.get(r["payment_method"], 0.0) + inc - exp
+        out['balance'] = out['income'] - out['expense']
+        return out
+
+    def get_daily_balance(self, date):
+        """Obtener el balance diario para una fecha específica"""
+        row = self.db.execute_query(
+            "SELECT COALESCE(SUM(income),0) AS inc, COALESCE(SUM(expense),0) AS exp "
+            "FROM cash_daily_balances WHERE date = ?",
+            (date,)
+        )
+        total_income = row[0]["inc"] if row else 0
+        total_expense = row[0]["exp"] if row else 0
+
         return {
             'date': date,
             'income': total_income,
@@ -111,73 +742,139 @@ class CashRegisterController:
         }
     
     def get_period_balance(self, start_date, end_date):
-        """Obtener el balance para un período específico"""
-        query_income = """
-            SELECT COALESCE(SUM(amount), 0) as total_income 
-            FROM cash_register 
-            WHERE date BETWEEN ? AND ? AND type = 'income'
-        """
-        query_expense = """
-            SELECT COALESCE(SUM(amount), 0) as total_expense 
-            FROM cash_register 
-            WHERE date BETWEEN ? AND ? AND type = 'expense'
-        """
-        
-        income_result = self.db.execute_query(query_income, (start_date, end_date))
-        expense_result = self.db.execute_query(query_expense, (start_date, end_date))
-        
-        total_income = income_result[0][0] if income_result else 0
-        total_expense = expense_result[0][0] if expense_result else 0
-        
+        """Obtener el balance para un período específico (acumulado al cierre - acumulado previo)"""
+        inc_end, exp_end = self._cumulative(end_date, inclusive=True)
+        inc_start, exp_start = self._cumulative(start_date, inclusive=False)
+
+        total_income = round(inc_end - inc_start, 2)
+        total_expense = round(exp_end - exp_start, 2)
+
         return {
             'start_date': start_date,
             'end_date': end_date,
             'income': total_income,
             'expense': total_expense,
-            'balance': total_income - total_expense
+            'balance': total_income - total_expense,
+            'opening_balance': inc_start - exp_start,
+            'closing_balance': inc_end - exp_end,
         }
     
-    def get_cash_flow_report(self, start_date, end_date, group_by='day'):
-        """Generar reporte de flujo de caja"""
-        if group_by == 'day':
-            group_clause = "GROUP BY date ORDER BY date"
-        elif group_by == 'week':
-            group_clause = "GROUP BY strftime('%Y-%W', date) ORDER BY date"
+    # ------------------------------------------------------------------
+    # Saldos por períodos (una sola consulta)
+    # ------------------------------------------------------------------
+    @staticmethod
+    def build_periods(start_date, end_date, group_by='day'):
+        """
+        Períodos de calendario contiguos entre dos fechas: lista de (inicio, fin, etiqueta).
+        day -> 'YYYY-MM-DD', week (lunes a domingo) -> 'YYYY-Www', month -> 'YYYY-MM'.
+        """
+        start = datetime.strptime(start_date, '%Y-%m-%d').date()
+        end = datetime.strptime(end_date, '%Y-%m-%d').date()
+        periods = []
+        if group_by == 'week':
+            cur = start - timedelta(days=start.weekday())
+            while cur <= end:
+                nxt = cur + timedelta(days=7)
+                iso = cur.isocalendar()
+                periods.append((max(cur, start), min(nxt - timedelta(days=1), end), f"{iso[0]}-W{iso[1]:02d}"))
+                cur = nxt
         elif group_by == 'month':
-            group_clause = "GROUP BY strftime('%Y-%m', date) ORDER BY date"
+            cur = start.replace(day=1)
+            while cur <= end:
+                nxt = (cur.replace(day=28) + timedelta(days=4)).replace(day=1)
+                periods.append((max(cur, start), min(nxt - timedelta(days=1), end), cur.strftime('%Y-%m')))
+                cur = nxt
         else:
-            group_clause = "GROUP BY date ORDER BY date"
-        
+            cur = start
+            while cur <= end:
+                periods.append((cur, cur, cur.strftime('%Y-%m-%d')))
+                cur += timedelta(days=1)
+        return [(a.strftime('%Y-%m-%d'), b.strftime('%Y-%m-%d'), label) for a, b, label in periods]
+
+    def get_balances(self, periods, group_by='day'):
+        """
+        Ingresos, egresos, separación efectivo/transferencia y balance para muchos períodos
+        en UNA consulta de agregación condicional sobre el libro diario.
+
+        periods: (inicio, fin) -> se generan los períodos de calendario según group_by
+                 o una lista de (inicio, fin) / (inicio, fin, etiqueta) arbitrarios.
+        Los períodos sin movimientos se devuelven en cero (relleno de calendario).
+        """
+        if isinstance(periods, tuple) and len(periods) == 2 and isinstance(periods[0], str):
+            periods = self.build_periods(periods[0], periods[1], group_by)
+        norm = [(p[0], p[1], p[2] if len(p) > 2 else f"{p[0]} a {p[1]}") for p in periods]
+        if not norm:
+            return []
+
+        values = ", ".join("(?, ?, ?)" for _ in norm)
+        params = [v for i, (a, b, _l) in enumerate(norm) for v in (i, a, b)]
         query = f"""
-            SELECT 
-                date,
-                SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) as income,
-                SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) as expense,
-                SUM(CASE WHEN type = 'income' THEN amount ELSE -amount END) as balance
-            FROM cash_register 
-            WHERE date BETWEEN ? AND ?
-            {group_clause}
+            WITH periods(idx, start_date, end_date) AS (VALUES {values})
+            SELECT p.idx,
+                   COALESCE(SUM(b.income), 0) AS income,
+                   COALESCE(SUM(b.expense), 0) AS expense,
+                   COALESCE(SUM(CASE WHEN b.payment_method='cash' THEN b.income END), 0) AS cash_income,
+                   COALESCE(SUM(CASE WHEN b.payment_method='cash' THEN b.expense END), 0) AS cash_expense,
+                   COALESCE(SUM(CASE WHEN b.payment_method='transfer' THEN b.income END), 0) AS transfer_income,
+                   COALESCE(SUM(CASE WHEN b.payment_method='transfer' THEN b.expense END), 0) AS transfer_expense
+              FROM periods p
+              LEFT JOIN cash_daily_balances b
+                     ON b.date BETWEEN p.start_date AND p.end_date
+             GROUP BY p.idx
         """
-        
-        results = self.db.execute_query(query, (start_date, end_date))
-        return [dict(row) for row in results] if results else []
-    
+        rows = self.db.execute_query(query, tuple(params))
+        by_idx = {r["idx"]: dict(r) for r in rows or []}
+
+        result = []
+        for i, (a, b, label) in enumerate(norm):
+            r = by_idx.get(i, {})
+            inc, exp = float(r.get("income") or 0), float(r.get("expense") or 0)
+            ci, ce = float(r.get("cash_income") or 0), float(r.get("cash_expense") or 0)
+            ti, te = float(r.get("transfer_income") or 0), float(r.get("transfer_expense") or 0)
+            result.append({
+                'start_date': a, 'end_date': b, 'label': label,
+                'income': inc, 'expense': exp, 'balance': inc - exp,
+                'cash_income': ci, 'cash_expense': ce, 'cash_balance': ci - ce,
+                'transfer_income': ti, 'transfer_expense': te, 'transfer_balance': ti - te,
+            })
+        return result
+
+    def get_cash_flow_report(self, start_date, end_date, group_by='day'):
+        """Generar reporte de flujo de caja (períodos de calendario, incluidos los vacíos)"""
+        return [dict(p, date=p['label']) for p in self.get_balances((start_date, end_date), group_by)]
+
+    def iter_cash_flow_report(self, start_date, end_date, group_by='day', chunk_size=500):
+        """Mismo resultado que get_cash_flow_report, entregado por bloques"""
+        data = self.get_cash_flow_report(start_date, end_date, group_by)
+        for i in range(0, len(data), chunk_size):
+            yield data[i:i + chunk_size]
+
+    def export_cash_flow(self, path, start_date, end_date, group_by='day', progress=None, cancel_event=None):
+        """Flujo de caja por período a CSV / CSV.GZ / XLSX con valores numéricos"""
+        return export_rows(
+            path,
+            ["Período", "Desde", "Hasta", "Ingresos", "Egresos", "Balance",
+             "Ingresos efectivo", "Egresos efectivo", "Ingresos transferencia", "Egresos transferencia"],
+            self.iter_cash_flow_report(start_date, end_date, group_by),
+            row_mapper=lambda r: [r["label"], r["start_date"], r["end_date"],
+                                  round(r["income"], 2), round(r["expense"], 2), round(r["balance"], 2),
+                                  round(r["cash_income"], 2), round(r["cash_expense"], 2),
+                                  round(r["transfer_income"], 2), round(r["transfer_expense"], 2)],
+            sheet_title="Flujo de caja",
+            total_rows=self.count_cash_flow_rows(start_date, end_date, group_by),
+            progress=progress, cancel_event=cancel_event,
+        )
+
+    def count_cash_flow_rows(self, start_date, end_date, group_by='day'):
+        """Cantidad de filas (períodos) que tendrá el reporte de flujo de caja"""
+        return len(self.build_periods(start_date, end_date, group_by))
+
     def get_monthly_summary(self, year=None):
-        """Obtener resumen mensual para gráficos"""
+        """Obtener resumen mensual para gráficos (los 12 meses del año)"""
         if not year:
             year = datetime.now().year
-        
-        query = """
-            SELECT 
-                strftime('%Y-%m', date) as month,
-                SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) as income,
-                SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) as expense,
-                SUM(CASE WHEN type = 'income' THEN amount ELSE -amount END) as balance
-            FROM cash_register 
-            WHERE strftime('%Y', date) = ?
-            GROUP BY strftime('%Y-%m', date)
-            ORDER BY month
-        """
-        
-        results = self.db.execute_query(query, (str(year),))
-        return [dict(row) for row in results] if results else []
\ No newline at end of file
+
+        return [
+            {'month': p['label'], 'income': p['income'], 'expense': p['expense'], 'balance': p['balance']}
+            for p in self.get_balances((f"{year}-01-01", f"{year}-12-31"), 'month')
+        ]
\ No newline at end of file
@@ -0,0 +1,373 @@
+# modules/cash_register/reconciliation.py
+"""
+Conciliación bancaria de movimientos por transferencia
+- Importa extractos bancarios (CSV o XLSX) a bank_statement_lines, sin duplicar líneas ya importadas
+- Cruza en una sola pasada las líneas del extracto con los movimientos de Caja con
+  payment_method='transfer': tabla hash por monto (en centavos) + ventana de fechas,
+  y desempate por similitud de descripción (difflib + palabras en común)
+- Guarda los pares en bank_reconciliations e informa lo que queda sin conciliar en ambos lados
+Signo de los montos: positivo = entra al banco (ingreso en Caja), negativo = sale (egreso).
+"""
+
+import hashlib
+import re
+import time
+import unicodedata
+from collections import defaultdict
+from datetime import datetime, timedelta
+from difflib import SequenceMatcher
+
+from modules.inventory.importer import read_chunks
+from utils.numbers import parse_amount
+from utils.report_export import ExportCancelled
+
+# encabezado normalizado -> campo
+COLUMN_ALIASES = {
+    "fecha": "date", "date": "date", "fecha movimiento": "date", "fecha operacion": "date",
+    "descripcion": "description", "concepto": "description", "detalle": "description",
+    "description": "description", "movimiento": "description",
+    "monto": "amount", "valor": "amount", "importe": "amount", "amount": "amount",
+    "debito": "debit", "cargo": "debit", "retiro": "debit", "debit": "debit",
+    "credito": "credit", "abono": "credit", "deposito": "credit", "credit": "credit",
+    "referencia": "reference", "documento": "reference", "reference": "reference", "ref": "reference",
+}
+
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%Y/%m/%d", "%d/%m/%y")
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _strip_accents(text):
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+def _normalize(text):
+    """Texto en minúsculas, sin tildes ni signos, para comparar descripciones."""
+    return " ".join(_WORD_RE.findall(_strip_accents(str(text or "")).lower()))
+
+
+def _parse_date(raw):
+    if isinstance(raw, datetime):
+        return raw.strftime("%Y-%m-%d")
+    txt = str(raw or "").strip()[:10]
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(txt, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+class BankReconciler:
+    def __init__(self, database, auth_manager):
+        self.db = database
+        self.auth = auth_manager
+        self._ensure_schema()
+
+    def _ensure_schema(self):
+        self.db.execute_query("""
+            CREATE TABLE IF NOT EXISTS bank_statement_lines (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TEXT NOT NULL,
+                description TEXT,
+                amount REAL NOT NULL,
+                reference TEXT,
+                line_hash TEXT NOT NULL UNIQUE,
+                source_file TEXT,
+                user_id INTEGER,
+                imported_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self.db.execute_query("CREATE INDEX IF NOT EXISTS idx_bsl_date ON bank_statement_lines(date)")
+        self.db.execute_query("""
+            CREATE TABLE IF NOT EXISTS bank_reconciliations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                statement_line_id INTEGER NOT NULL UNIQUE,
+                cash_register_id INTEGER NOT NULL UNIQUE,
+                score REAL,
+                date_diff INTEGER,
+                method TEXT NOT NULL DEFAULT 'auto',
+                user_id INTEGER,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (statement_line_id) REFERENCES bank_statement_lines (id),
+                FOREIGN KEY (cash_register_id) REFERENCES cash_register (id)
+            )
+        """)
+        # los movimientos por transferencia se buscan por método y fecha
+        self.db.execute_query(
+            "CREATE INDEX IF NOT EXISTS idx_cash_method_date ON cash_register(payment_method, date)"
+        )
+
+    # ------------------------------
+    # Importación del extracto
+    # ------------------------------
+    @staticmethod
+    def _map_header(header):
+        idx = {}
+        for i, name in enumerate(header):
+            field = COLUMN_ALIASES.get(_strip_accents(str(name or "")).strip().lower())
+            if field and field not in idx:
+                idx[field] = i
+        if "date" not in idx or not ("amount" in idx or "debit" in idx or "credit" in idx):
+            raise ValueError("El extracto debe tener columnas de fecha y monto (o débito/crédito)")
+        return idx
+
+    def import_statement(self, path, progress=None, cancel_event=None):
+        """
+        Importa un extracto. Las líneas ya importadas (misma fecha, monto, descripción,
+        referencia y número de aparición) se ignoran. Devuelve un resumen.
+        """
+        if not self.auth.current_user:
+            raise Exception("Usuario no autenticado")
+
+        params, rejected, read = [], [], 0
+        seen = defaultdict(int)
+        for header, chunk in read_chunks(path):
+            if cancel_event is not None and cancel_event.is_set():
+                raise ExportCancelled()
+            idx = self._map_header(header)
+
+            def cell(row, field):
+                i = idx.get(field)
+                return row[i] if i is not None and i < len(row) else None
+
+            for line_no, row in chunk:
+                read += 1
+                date = _parse_date(cell(row, "date"))
+                if "amount" in idx:
+                    amount = parse_amount(cell(row, "amount"))
+                else:
+                    credit = parse_amount(cell(row, "credit")) or 0.0
+                    debit = parse_amount(cell(row, "debit")) or 0.0
+                    amount = credit - abs(debit) if (credit or debit) else None
+                if not date or amount is None or round(amount, 2) == 0:
+                    rejected.append(line_no)
+                    continue
+                desc = str(cell(row, "description") or "").strip()
+                ref = str(cell(row, "reference") or "").strip()
+                base = f"{date}|{amount:.2f}|{_normalize(desc)}|{ref}"
+                seen[base] += 1  # líneas idénticas el mismo día son movimientos distintos
+                line_hash = hashlib.sha1(f"{base}|{seen[base]}".encode("utf-8")).hexdigest()
+                params.append((date, desc, round(amount, 2), ref, line_hash, path, self.auth.current_user))
+            if progress:
+                progress(read, None)
+
+        before = self._count_lines()
+        with self.db.transaction() as cur:
+            cur.executemany("""
+                INSERT OR IGNORE INTO bank_statement_lines
+                    (date, description, amount, reference, line_hash, source_file, user_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, params)
+        imported = self._count_lines() - before
+        return {
+            "read": read,
+            "imported": imported,
+            "duplicates": len(params) - imported,
+            "rejected_lines": rejected,
+            "start_date": min((p[0] for p in params), default=None),
+            "end_date": max((p[0] for p in params), default=None),
+        }
+
+    def _count_lines(self):
+        rows = self.db.execute_query("SELECT COUNT(*) FROM bank_statement_lines")
+        return int(rows[0][0]) if rows else 0
+
+    # ------------------------------
+    # Conciliación
+    # ------------------------------
+    def _unmatched_bank(self, start_date=None, end_date=None):
+        q = """
+            SELECT b.* FROM bank_statement_lines b
+             WHERE NOT EXISTS (SELECT 1 FROM bank_reconciliations r WHERE r.statement_line_id = b.id)
+        """
+        p = []
+        if start_date:
+            q += " AND b.date >= ?"; p.append(start_date)
+        if end_date:
+            q += " AND b.date <= ?"; p.append(end_date)
+        q += " ORDER BY b.date, b.id"
+        return [dict(r) for r in self.db.execute_query(q, p) or []]
+
+    def _unmatched_cash(self, start_date=None, end_date=None):
+        q = """
+            SELECT cr.id, cr.date, cr.type, cr.description, cr.amount, cr.category,
+                   CASE WHEN cr.type = 'expense' THEN -cr.amount ELSE cr.amount END AS signed_amount
+              FROM cash_register cr
+             WHERE cr.payment_method = 'transfer'
+               AND NOT EXISTS (SELECT 1 FROM bank_reconciliations r WHERE r.cash_register_id = cr.id)
+        """
+        p = []
+        if start_date:
+            q += " AND cr.date >= ?"; p.append(start_date)
+        if end_date:
+            q += " AND cr.date <= ?"; p.append(end_date)
+        q += " ORDER BY cr.date, cr.id"
+        return [dict(r) for r in self.db.execute_query(q, p) or []]
+
+    @staticmethod
+    def _similarity(a, b):
+        """Parecido de dos descripciones normalizadas: secuencia (difflib) + palabras en común."""
+        if not a or not b:
+            return 0.0
+        wa, wb = set(a.split()), set(b.split())
+        common = len(wa & wb) / float(len(wa | wb))
+        return 0.5 * SequenceMatcher(None, a, b).ratio() + 0.5 * common
+
+    def _score(self, bank, cash, days, window_days):
+        """0..1: parecido de descripciones (60%) y cercanía de fechas (40%)."""
+        closeness = 1.0 - (days / float(window_days + 1))
+        similarity = self._similarity(bank["_norm"], cash["_norm"])
+        return round(0.6 * similarity + 0.4 * closeness, 4)
+
+    def find_matches(self, window_days=3, start_date=None, end_date=None, progress=None, cancel_event=None,
+                     batch_size=1000):
+        """
+        Propone pares (línea de extracto, movimiento de Caja) sin escribir nada.
+        Hash join por monto exacto en centavos; los candidatos deben estar a no más de
+        window_days días. Entre varios candidatos gana el de mayor puntaje (asignación voraz
+        global, cada lado se usa una sola vez). progress(hechas, total) y cancel_event se
+        revisan cada batch_size líneas del extracto.
+        """
+        window_days = max(0, int(window_days))
+        bank_lines = self._unmatched_bank(start_date, end_date)
+        if not bank_lines:
+            return [], bank_lines, []
+        lo = (datetime.strptime(bank_lines[0]["date"], "%Y-%m-%d") - timedelta(days=window_days)).strftime("%Y-%m-%d")
+        hi = (datetime.strptime(bank_lines[-1]["date"], "%Y-%m-%d") + timedelta(days=window_days)).strftime("%Y-%m-%d")
+        cash_rows = self._unmatched_cash(lo, hi)
+
+        by_amount = defaultdict(list)
+        for c in cash_rows:
+            c["_day"] = datetime.strptime(c["date"], "%Y-%m-%d").toordinal()
+            c["_norm"] = _normalize(c["description"])
+            by_amount[int(round(float(c["signed_amount"]) * 100))].append(c)
+
+        candidates = []
+        total = len(bank_lines)
+        for i, b in enumerate(bank_lines):
+            if i % batch_size == 0:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ExportCancelled()
+                if progress:
+                    progress(i, total)
+            bucket = by_amount.get(int(round(float(b["amount"]) * 100)))
+            if not bucket:
+                continue
+            b_day = datetime.strptime(b["date"], "%Y-%m-%d").toordinal()
+            b["_norm"] = _normalize(b["description"])
+            for c in bucket:
+                days = abs(c["_day"] - b_day)
+                if days <= window_days:
+                    candidates.append((self._score(b, c, days, window_days), days, b["id"], c["id"]))
+
+        if progress:
+            progress(total, total)
+        candidates.sort(key=lambda t: (-t[0], t[1], t[2], t[3]))
+        used_bank, used_cash, matches = set(), set(), []
+        for score, days, b_id, c_id in candidates:
+            if b_id in used_bank or c_id in used_cash:
+                continue
+            used_bank.add(b_id)
+            used_cash.add(c_id)
+            matches.append({"statement_line_id": b_id, "cash_register_id": c_id,
+                            "score": score, "date_diff": days})
+
+        unmatched_bank = [b for b in bank_lines if b["id"] not in used_bank]
+        unmatched_cash = [c for c in cash_rows if c["id"] not in used_cash]
+        for row in unmatched_bank + unmatched_cash:
+            row.pop("_day", None)
+            row.pop("_norm", None)
+        return matches, unmatched_bank, unmatched_cash
+
+    def reconcile(self, window_days=3, start_date=None, end_date=None, progress=None, cancel_event=None,
+                  batch_size=1000):
+        """
+        Concilia todo lo pendiente en una pasada y guarda los pares. Devuelve un resumen.
+        cancel_event se revisa entre bloques; al cancelar no se guarda ningún par.
+        """
+        if not self.auth.current_user:
+            raise Exception("Usuario no autenticado")
+        t0 = time.perf_counter()
+        matches, unmatched_bank, unmatched_cash = self.find_matches(window_days, start_date, end_date,
+                                                                    progress, cancel_event, batch_size)
+        with self.db.transaction() as cur:
+            for start in range(0, len(matches), batch_size):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ExportCancelled()
+                cur.executemany("""
+                    INSERT OR IGNORE INTO bank_reconciliations
+                        (statement_line_id, cash_register_id, score, date_diff, method, user_id)
+                    VALUES (?, ?, ?, ?, 'auto', ?)
+                """, [(m["statement_line_id"], m["cash_register_id"], m["score"], m["date_diff"],
+                       self.auth.current_user) for m in matches[start:start + batch_size]])
+        return {
+            "matched": len(matches),
+            "unmatched_bank": len(unmatched_bank),
+            "unmatched_cash": len(unmatched_cash),
+            "seconds": round(time.perf_counter() - t0, 3),
+        }
+
+    def match_manually(self, statement_line_id, cash_register_id):
+        """Concilia a mano un par que la búsqueda automática no encontró."""
+        if not self.auth.current_user:
+            raise Exception("Usuario no autenticado")
+        b = self.db.execute_query("""
+            SELECT b.date, b.amount,
+                   EXISTS (SELECT 1 FROM bank_reconciliations r WHERE r.statement_line_id = b.id) AS matched
+              FROM bank_statement_lines b WHERE b.id = ?
+        """, (statement_line_id,))
+        c = self.db.execute_query("""
+            SELECT cr.date, cr.payment_method,
+                   CASE WHEN cr.type = 'expense' THEN -cr.amount ELSE cr.amount END AS signed_amount,
+                   EXISTS (SELECT 1 FROM bank_reconciliations r WHERE r.cash_register_id = cr.id) AS matched
+              FROM cash_register cr WHERE cr.id = ?
+        """, (cash_register_id,))
+        if not b or not c:
+            raise Exception("La línea del extracto o el movimiento de Caja no existe")
+        b, c = b[0], c[0]
+        if c["payment_method"] != "transfer":
+            raise Exception("El movimiento de Caja no es una transferencia")
+        if b["matched"]:
+            raise Exception("La línea del extracto ya está conciliada")
+        if c["matched"]:
+            raise Exception("El movimiento de Caja ya está conciliado")
+        if int(round(float(b["amount"]) * 100)) != int(round(float(c["signed_amount"]) * 100)):
+            raise Exception(f"El monto no coincide: extracto ${float(b['amount']):,.2f}, "
+                            f"Caja ${float(c['signed_amount']):,.2f} (positivo = ingreso, negativo = egreso)")
+        days = abs((datetime.strptime(b["date"], "%Y-%m-%d") - datetime.strptime(c["date"], "%Y-%m-%d")).days)
+        return self.db.execute_query("""
+            INSERT INTO bank_reconciliations (statement_line_id, cash_register_id, score, date_diff, method, user_id)
+            VALUES (?, ?, NULL, ?, 'manual', ?)
+        """, (statement_line_id, cash_register_id, days, self.auth.current_user))
+
+    def unmatch(self, reconciliation_id):
+        if not self.auth.has_permission('admin'):
+            raise Exception("Solo los administradores pueden deshacer conciliaciones")
+        self.db.execute_query("DELETE FROM bank_reconciliations WHERE id = ?", (reconciliation_id,))
+        return True
+
+    # ------------------------------
+    # Consultas para la vista
+    # ------------------------------
+    def get_matches(self, start_date=None, end_date=None):
+        q = """
+            SELECT r.id, r.score, r.date_diff, r.method,
+                   b.date AS bank_date, b.description AS bank_description, b.amount AS bank_amount,
+                   cr.id AS cash_id, cr.date AS cash_date, cr.description AS cash_description
+              FROM bank_reconciliations r
+              JOIN bank_statement_lines b ON b.id = r.statement_line_id
+              JOIN cash_register cr ON cr.id = r.cash_register_id
+             WHERE 1=1
+        """
+        p = []
+        if start_date:
+            q += " AND b.date >= ?"; p.append(start_date)
+        if end_date:
+            q += " AND b.date <= ?"; p.append(end_date)
+        q += " ORDER BY b.date DESC, b.id DESC"
+        return [dict(r) for r in self.db.execute_query(q, p) or []]
+
+    def get_unmatched(self, start_date=None, end_date=None):
+        """(líneas del extracto sin conciliar, transferencias de Caja sin conciliar)"""
+        return self._unmatched_bank(start_date, end_date), self._unmatched_cash(start_date, end_date)
@@ -2,21 +2,19 @@ import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from tkcalendar import DateEntry
 from datetime import datetime, timedelta
-from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
-from reportlab.lib.units import mm
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
-
-import csv
 
 from modules.cash_register.controller import CashRegisterController
+from modules.cash_register.reconciliation import BankReconciler
+from utils.report_export import write_table_pdf, run_in_background
+from utils.virtual_tree import VirtualTreeview
 
 # Mapeos de valores internos <-> etiquetas en español
 TYPE_TO_ES = {"income": "Ingreso", "expense": "Egreso"}
 TYPE_FROM_ES = {v: k for k, v in TYPE_TO_ES.items()}
 PAYMENT_TO_ES = {"cash": "Efectivo", "transfer": "Transferencia"}
 PAYMENT_FROM_ES = {v: k for k, v in PAYMENT_TO_ES.items()}
+EXPORT_FILETYPES = [("CSV", ".csv"), ("CSV comprimido", ".csv.gz"), ("Excel", ".xlsx")]
 
 
 class CashRegisterView:
@@ -87,7 +85,9 @@ class CashRegisterView:
         payment_combo.grid(row=4, column=1, sticky=tk.EW, pady=2, padx=(5, 0))
 
         ttk.Label(form_frame, text="Categoría:").grid(row=5, column=0, sticky=tk.W, pady=2)
-        self.category_entry = ttk.Entry(form_frame)
+        # se puede elegir una categoría existente o escribir una nueva
+        self.category_entry = ttk.Combobox(form_frame,
+                                           values=[c['code'] for c in self.controller.get_categories()])
         self.category_entry.grid(row=5, column=1, sticky=tk.EW, pady=2, padx=(5, 0))
 
         button_frame = ttk.Frame(form_frame)
@@ -158,9 +158,19 @@ class CashRegisterView:
         chart_frame = ttk.Frame(tab_control)
         tab_control.add(chart_frame, text="Gráficos")
 
-        # Treeview dentro de la pestaña Movimientos
+        # Treeview virtual dentro de la pestaña Movimientos (solo las filas visibles, por bloques)
         columns = ('id', 'date', 'type', 'description', 'amount', 'payment', 'category', 'user')
-        self.tree = ttk.Treeview(table_frame, columns=columns, show='headings')
+        self._filters = {}
+        self._summary = {"count": 0, "income": 0.0, "expense": 0.0}
+        self.vtree = VirtualTreeview(
+            table_frame, columns,
+            fetch_block=lambda after, offset, limit: self.controller.get_transactions_page(
+                after=after, offset=offset or 0, limit=limit, **self._filters),
+            count_rows=lambda: self._summary["count"],
+            to_values=self._row_values,
+            key_of=lambda r: (r['date'], r['id']),
+        )
+        self.tree = self.vtree.tree
 
         # Encabezados
         headers = ['ID', 'Fecha', 'Tipo', 'Descripción', 'Monto', 'Método', 'Categoría', 'Usuario']
@@ -177,16 +187,11 @@ class CashRegisterView:
         self.tree.column('category', width=140, anchor=tk.W)
         self.tree.column('user', width=120, anchor=tk.W)
 
-        # Scrollbar vertical
-        scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.tree.yview)
-        self.tree.configure(yscrollcommand=scrollbar.set)
-
         # Tags para colorear filas
         self.tree.tag_configure('income', foreground='green')
         self.tree.tag_configure('expense', foreground='red')
 
-        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.vtree.pack(fill=tk.BOTH, expand=True)
 
         # Botón para gráficos
         ttk.Button(chart_frame, text="Generar gráfico mensual",
@@ -207,56 +212,49 @@ class CashRegisterView:
 
         ttk.Button(action_frame, text="Actualizar", command=self.load_transactions).pack(side=tk.RIGHT, padx=5)
         ttk.Button(action_frame, text="Reporte", command=self.show_report).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(action_frame, text="Exportar", command=self.export_transactions).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(action_frame, text="Arqueo / Cierre", command=self.show_closure_dialog).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(action_frame, text="Conciliación bancaria",
+                   command=self.show_reconciliation_dialog).pack(side=tk.RIGHT, padx=5)
 
     # ---------------------------------------------------------------------
     # Lógica
     # ---------------------------------------------------------------------
-    def _insert_row(self, trans):
+    def _row_values(self, trans):
         amount = float(trans['amount'])
         tipo = trans['type']  # 'income' | 'expense'
         tipo_es = TYPE_TO_ES.get(tipo, tipo)
         pago_es = PAYMENT_TO_ES.get(trans['payment_method'], trans['payment_method'])
         tag = 'income' if tipo == 'income' else 'expense'
 
-        self.tree.insert(
-            '', 'end',
-            values=(
-                trans['id'],
-                trans['date'],
-                tipo_es,
-                trans['description'],
-                f"${amount:.2f}",
-                pago_es,
-                trans.get('category') or '',
-                trans.get('username') or ''
-            ),
-            tags=(tag,)
+        values = (
+            trans['id'],
+            trans['date'],
+            tipo_es,
+            trans['description'],
+            f"${amount:.2f}",
+            pago_es,
+            trans.get('category_name') or trans.get('category') or '',
+            trans.get('username') or ''
         )
+        return values, (tag,)
+
+    def _reload_grid(self):
+        # totales y cantidad desde los contadores del libro diario; las filas se piden al desplazarse
+        self._summary = self.controller.get_transactions_summary(**self._filters)
+        self.vtree.reload()
+        self._update_summary(self._summary["income"], self._summary["expense"])
 
     def load_transactions(self):
-        """Cargar transacciones en el treeview"""
-        # Limpiar treeview
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-
-        # Obtener transacciones
-        transactions = self.controller.get_transactions()
-
-        # Calcular totales
-        total_income = 0.0
-        total_expense = 0.0
-
-        # Agregar filas
-        for trans in transactions:
-            amount = float(trans['amount'])
-            if trans['type'] == 'income':
-                total_income += amount
-            else:
-                total_expense += amount
-            self._insert_row(trans)
+        """Cargar transacciones (sin filtros) en el treeview"""
+        self._filters = {}
+        self._reload_grid()
 
-        # Resumen
-        self._update_summary(total_income, total_expense)
+    def on_ledger_changed(self):
+        """Hubo altas/ediciones/borrados en caja: totales desde los contadores y filas visibles de nuevo"""
+        self._summary = self.controller.get_transactions_summary(**self._filters)
+        self.vtree.refresh()
+        self._update_summary(self._summary["income"], self._summary["expense"])
 
     def _update_summary(self, total_income: float, total_expense: float):
         balance = total_income - total_expense
@@ -276,25 +274,13 @@ class CashRegisterView:
         payment_filter_es = (self.filter_payment.get() or '').strip()
         payment_filter = PAYMENT_FROM_ES.get(payment_filter_es) if payment_filter_es else None
 
-        # Limpiar
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-
-        # Consultar con filtros
-        transactions = self.controller.get_transactions(start_date, end_date, type_filter, payment_filter)
-
-        total_income = 0.0
-        total_expense = 0.0
-
-        for trans in transactions:
-            amount = float(trans['amount'])
-            if trans['type'] == 'income':
-                total_income += amount
-            else:
-                total_expense += amount
-            self._insert_row(trans)
-
-        self._update_summary(total_income, total_expense)
+        self._filters = {
+            "start_date": start_date,
+            "end_date": end_date,
+            "type_filter": type_filter,
+            "payment_method_filter": payment_filter,
+        }
+        self._reload_grid()
 
     def add_transaction(self):
         """Agregar una nueva transacción"""
@@ -322,6 +308,7 @@ class CashRegisterView:
 
             # Agregar
             self.controller.add_transaction(date, type_val_internal, description, amount, payment_method_internal, category)
+            self.category_entry['values'] = [c['code'] for c in self.controller.get_categories()]
 
             messagebox.showinfo("Éxito", "Transacción agregada correctamente")
             self.clear_form()
@@ -375,6 +362,299 @@ class CashRegisterView:
             except Exception as e:
                 messagebox.showerror("Error", f"No se pudo eliminar la transacción: {str(e)}")
 
+    def export_transactions(self):
+        """Exportar los movimientos del filtro actual (todos, no solo los visibles en la grilla)"""
+        path = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            filetypes=EXPORT_FILETYPES,
+            title="Exportar movimientos",
+            initialfile=f"movimientos_caja_{datetime.now().strftime('%Y%m%d')}.csv"
+        )
+        if not path:
+            return
+        filters = dict(self._filters)
+        run_in_background(
+            self.parent, "Exportar movimientos",
+            lambda progress, cancel_event: self.controller.export_transactions(
+                path, progress=progress, cancel_event=cancel_event, **filters),
+            on_success=lambda n: messagebox.showinfo("Éxito", f"Se exportaron {n:,} movimientos"),
+            error_text="No se pudo exportar"
+        )
+
+    def show_closure_dialog(self):
+        """Arqueo de caja: saldo esperado del sistema vs. efectivo contado"""
+        win = tk.Toplevel(self.parent)
+        win.title("Arqueo y cierre de caja")
+        win.geometry("640x480")
+        win.transient(self.parent.winfo_toplevel())
+
+        body = ttk.Frame(win, padding=10)
+        body.pack(fill=tk.BOTH, expand=True)
+
+        form = ttk.LabelFrame(body, text="Cierre del día", padding=10)
+        form.pack(fill=tk.X)
+
+        ttk.Label(form, text="Fecha:").grid(row=0, column=0, sticky=tk.W, pady=2)
+        date_entry = DateEntry(form, date_pattern='yyyy-mm-dd')
+        date_entry.set_date(datetime.now())
+        date_entry.grid(row=0, column=1, sticky=tk.W, pady=2, padx=(5, 0))
+
+        opening_var = tk.StringVar()
+        income_var = tk.StringVar()
+        expense_var = tk.StringVar()
+        system_var = tk.StringVar()
+        diff_var = tk.StringVar(value="Diferencia: -")
+        status_var = tk.StringVar()
+
+        ttk.Label(form, textvariable=opening_var).grid(row=1, column=0, columnspan=2, sticky=tk.W)
+        ttk.Label(form, textvariable=income_var, style="Income.TLabel").grid(row=2, column=0, columnspan=2, sticky=tk.W)
+        ttk.Label(form, textvariable=expense_var, style="Expense.TLabel").grid(row=3, column=0, columnspan=2, sticky=tk.W)
+        ttk.Label(form, textvariable=system_var, style="Balance.TLabel").grid(row=4, column=0, columnspan=2, sticky=tk.W)
+
+        ttk.Label(form, text="Efectivo contado:").grid(row=1, column=2, sticky=tk.W, padx=(20, 0))
+        counted_entry = ttk.Entry(form, width=16)
+        counted_entry.grid(row=1, column=3, sticky=tk.W, padx=(5, 0))
+        ttk.Label(form, text="Notas:").grid(row=2, column=2, sticky=tk.W, padx=(20, 0))
+        notes_entry = ttk.Entry(form, width=28)
+        notes_entry.grid(row=2, column=3, sticky=tk.W, padx=(5, 0))
+        ttk.Label(form, textvariable=diff_var, style="Balance.TLabel").grid(row=3, column=2, columnspan=2, sticky=tk.W, padx=(20, 0))
+        ttk.Label(form, textvariable=status_var).grid(row=4, column=2, columnspan=2, sticky=tk.W, padx=(20, 0))
+
+        summary = {}
+
+        def refresh_day(_event=None):
+            day = date_entry.get_date().strftime('%Y-%m-%d')
+            summary.clear()
+            summary.update(self.controller.get_day_summary(day))
+            origin = (f"(desde el cierre del {summary['opening_from_closure']})"
+                      if summary['opening_from_closure'] else "(según movimientos)")
+            opening_var.set(f"Saldo de apertura: ${summary['opening_balance']:.2f} {origin}")
+            income_var.set(f"Ingresos en efectivo: ${summary['cash_income']:.2f}")
+            expense_var.set(f"Egresos en efectivo: ${summary['cash_expense']:.2f}")
+            system_var.set(f"Saldo del sistema: ${summary['system_balance']:.2f}")
+            closure = self.controller.get_closure(day)
+            if closure:
+                status_var.set(f"Día cerrado: contado ${closure['counted_cash']:.2f}, "
+                               f"diferencia ${closure['difference']:.2f}")
+                close_btn.config(state="disabled")
+            else:
+                status_var.set("Día abierto")
+                close_btn.config(state="normal")
+            update_diff()
+
+        def update_diff(_event=None):
+            try:
+                counted = float(counted_entry.get().strip())
+            except ValueError:
+                diff_var.set("Diferencia: -")
+                return
+            diff = counted - summary.get('system_balance', 0)
+            label = "sobrante" if diff > 0 else "faltante" if diff < 0 else "cuadra"
+            diff_var.set(f"Diferencia: ${diff:.2f} ({label})")
+
+        def load_history():
+            for item in hist.get_children():
+                hist.delete(item)
+            for c in self.controller.get_closures(limit=60):
+                hist.insert('', 'end', values=(
+                    c['date'], f"${c['opening_balance']:.2f}", f"${c['system_balance']:.2f}",
+                    f"${c['counted_cash']:.2f}", f"${c['difference']:.2f}", c.get('username') or ''
+                ), tags=('diff',) if abs(c['difference'] or 0) >= 0.01 else ())
+
+        def do_close():
+            day = date_entry.get_date().strftime('%Y-%m-%d')
+            try:
+                counted = float(counted_entry.get().strip())
+            except ValueError:
+                messagebox.showerror("Error", "El efectivo contado debe ser un número válido", parent=win)
+                return
+            diff = counted - summary.get('system_balance', 0)
+            if abs(diff) >= 0.01 and not messagebox.askyesno(
+                    "Confirmar", f"Hay una diferencia de ${diff:.2f}. ¿Cerrar la caja de todos modos?", parent=win):
+                return
+            try:
+                self.controller.close_day(day, counted, notes_entry.get().strip())
+            except Exception as e:
+                messagebox.showerror("Error", f"No se pudo cerrar la caja: {str(e)}", parent=win)
+                return
+            messagebox.showinfo("Éxito", f"Caja del {day} cerrada correctamente", parent=win)
+            counted_entry.delete(0, tk.END)
+            notes_entry.delete(0, tk.END)
+            refresh_day()
+            load_history()
+
+        def do_reopen():
+            day = date_entry.get_date().strftime('%Y-%m-%d')
+            if not messagebox.askyesno("Confirmar", f"¿Reabrir la caja del {day}?", parent=win):
+                return
+            try:
+                self.controller.delete_closure(day)
+            except Exception as e:
+                messagebox.showerror("Error", f"No se pudo reabrir el día: {str(e)}", parent=win)
+                return
+            refresh_day()
+            load_history()
+
+        close_btn = ttk.Button(form, text="Cerrar caja", command=do_close)
+        close_btn.grid(row=5, column=3, sticky=tk.E, pady=(8, 0))
+        if self.auth_manager.has_permission('admin'):
+            ttk.Button(form, text="Reabrir día", command=do_reopen).grid(row=5, column=2, sticky=tk.E, pady=(8, 0))
+
+        hist_frame = ttk.LabelFrame(body, text="Cierres anteriores", padding=5)
+        hist_frame.pack(fill=tk.BOTH, expand=True, pady=(10, 0))
+        cols = ('date', 'opening', 'system', 'counted', 'difference', 'user')
+        hist = ttk.Treeview(hist_frame, columns=cols, show='headings', height=10)
+        for col, text, width in zip(cols, ("Fecha", "Apertura", "Sistema", "Contado", "Diferencia", "Usuario"),
+                                    (90, 90, 90, 90, 90, 90)):
+            hist.heading(col, text=text)
+            hist.column(col, width=width)
+        hist.tag_configure('diff', foreground='red')
+        hist_scroll = ttk.Scrollbar(hist_frame, orient=tk.VERTICAL, command=hist.yview)
+        hist.configure(yscrollcommand=hist_scroll.set)
+        hist.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        hist_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+
+        date_entry.bind("<<DateEntrySelected>>", refresh_day)
+        counted_entry.bind("<KeyRelease>", update_diff)
+        refresh_day()
+        load_history()
+
+    def show_reconciliation_dialog(self):
+        """Conciliación de transferencias contra el extracto bancario"""
+        reconciler = BankReconciler(self.db, self.auth_manager)
+
+        win = tk.Toplevel(self.parent)
+        win.title("Conciliación bancaria")
+        win.geometry("980x560")
+        win.transient(self.parent.winfo_toplevel())
+
+        top = ttk.Frame(win, padding=10)
+        top.pack(fill=tk.X)
+        ttk.Button(top, text="Importar extracto…", command=lambda: import_file()).pack(side=tk.LEFT, padx=2)
+        ttk.Label(top, text="Tolerancia (días):").pack(side=tk.LEFT, padx=(12, 2))
+        window_var = tk.StringVar(value="3")
+        ttk.Spinbox(top, from_=0, to=15, textvariable=window_var, width=4).pack(side=tk.LEFT)
+        ttk.Button(top, text="Conciliar", command=lambda: run()).pack(side=tk.LEFT, padx=8)
+        ttk.Button(top, text="Conciliar selección", command=lambda: manual()).pack(side=tk.LEFT, padx=2)
+        if self.auth_manager.has_permission('admin'):
+            ttk.Button(top, text="Deshacer", command=lambda: undo()).pack(side=tk.LEFT, padx=2)
+        status_var = tk.StringVar()
+        ttk.Label(top, textvariable=status_var).pack(side=tk.RIGHT)
+
+        notebook = ttk.Notebook(win)
+        notebook.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
+
+        def make_tree(title, cols, headers, widths):
+            frame = ttk.Frame(notebook)
+            notebook.add(frame, text=title)
+            tree = ttk.Treeview(frame, columns=cols, show='headings')
+            for c, h, w in zip(cols, headers, widths):
+                tree.heading(c, text=h)
+                tree.column(c, width=w, anchor=tk.E if c.endswith("amount") else tk.W)
+            sb = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=tree.yview)
+            tree.configure(yscrollcommand=sb.set)
+            tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            sb.pack(side=tk.RIGHT, fill=tk.Y)
+            return tree
+
+        matched_tree = make_tree(
+            "Conciliados", ("bank_date", "bank_desc", "bank_amount", "cash_date", "cash_desc", "score", "method"),
+            ("Fecha banco", "Descripción banco", "Monto", "Fecha caja", "Descripción caja", "Puntaje", "Tipo"),
+            (85, 230, 100, 85, 230, 70, 70))
+        bank_tree = make_tree(
+            "Extracto sin conciliar", ("date", "desc", "ref", "amount"),
+            ("Fecha", "Descripción", "Referencia", "Monto"), (90, 420, 140, 120))
+        cash_tree = make_tree(
+            "Caja sin conciliar", ("id", "date", "desc", "category", "amount"),
+            ("ID", "Fecha", "Descripción", "Categoría", "Monto"), (60, 90, 400, 140, 120))
+
+        def load():
+            for tree in (matched_tree, bank_tree, cash_tree):
+                tree.delete(*tree.get_children())
+            matches = reconciler.get_matches()
+            for m in matches:
+                matched_tree.insert('', 'end', iid=str(m['id']), values=(
+                    m['bank_date'], m['bank_description'], f"${m['bank_amount']:,.2f}",
+                    m['cash_date'], m['cash_description'],
+                    "" if m['score'] is None else f"{m['score']:.2f}",
+                    "Manual" if m['method'] == 'manual' else "Auto"))
+            bank_lines, cash_rows = reconciler.get_unmatched()
+            for b in bank_lines:
+                bank_tree.insert('', 'end', iid=str(b['id']), values=(
+                    b['date'], b['description'], b['reference'] or '', f"${b['amount']:,.2f}"))
+            for c in cash_rows:
+                cash_tree.insert('', 'end', iid=str(c['id']), values=(
+                    c['id'], c['date'], c['description'], c.get('category') or '', f"${c['signed_amount']:,.2f}"))
+            notebook.tab(0, text=f"Conciliados ({len(matches)})")
+            notebook.tab(1, text=f"Extracto sin conciliar ({len(bank_lines)})")
+            notebook.tab(2, text=f"Caja sin conciliar ({len(cash_rows)})")
+
+        def import_file():
+            path = filedialog.askopenfilename(
+                title="Extracto bancario", parent=win,
+                filetypes=[("CSV o Excel", "*.csv *.xlsx"), ("CSV", "*.csv"), ("Excel", "*.xlsx")])
+            if not path:
+                return
+
+            def done(summary):
+                msg = (f"Líneas leídas: {summary['read']:,}\nNuevas: {summary['imported']:,}\n"
+                       f"Ya importadas: {summary['duplicates']:,}\n"
+                       f"Rechazadas (sin fecha o monto): {len(summary['rejected_lines']):,}")
+                messagebox.showinfo("Extracto importado", msg, parent=win)
+                load()
+
+            run_in_background(win, "Importar extracto",
+                              lambda progress, cancel_event: reconciler.import_statement(path, progress, cancel_event),
+                              on_success=done, error_text="No se pudo importar el extracto",
+                              cancel_text="Importación cancelada.")
+
+        def run():
+            try:
+                days = int(window_var.get())
+            except ValueError:
+                messagebox.showerror("Error", "La tolerancia debe ser un número de días", parent=win)
+                return
+
+            def done(summary):
+                status_var.set(f"{summary['matched']:,} conciliados en {summary['seconds']:.2f} s | "
+                               f"sin conciliar: extracto {summary['unmatched_bank']:,}, "
+                               f"caja {summary['unmatched_cash']:,}")
+                load()
+
+            run_in_background(win, "Conciliación bancaria",
+                              lambda progress, cancel_event: reconciler.reconcile(
+                                  window_days=days, progress=progress, cancel_event=cancel_event),
+                              on_success=done, error_text="No se pudo conciliar",
+                              cancel_text="Conciliación cancelada: no se guardó ningún par.")
+
+        def manual():
+            b_sel, c_sel = bank_tree.selection(), cash_tree.selection()
+            if not b_sel or not c_sel:
+                messagebox.showwarning("Advertencia", "Seleccione una línea del extracto y un movimiento de caja",
+                                       parent=win)
+                return
+            try:
+                reconciler.match_manually(int(b_sel[0]), int(c_sel[0]))
+            except Exception as e:
+                messagebox.showerror("Error", f"No se pudo conciliar: {e}", parent=win)
+                return
+            load()
+
+        def undo():
+            sel = matched_tree.selection()
+            if not sel:
+                messagebox.showwarning("Advertencia", "Seleccione una conciliación", parent=win)
+                return
+            try:
+                for iid in sel:
+                    reconciler.unmatch(int(iid))
+            except Exception as e:
+                messagebox.showerror("Error", str(e), parent=win)
+                return
+            load()
+
+        load()
+
     def show_report(self):
         """Mostrar ventana de reportes de caja"""
         report_win = tk.Toplevel(self.parent)
@@ -405,6 +685,7 @@ class CashRegisterView:
         ttk.Button(btns, text="Generar", command=lambda: generate()).pack(side=tk.LEFT, padx=2)
         ttk.Button(btns, text="Exportar CSV", command=lambda: export_csv()).pack(side=tk.LEFT, padx=2)
         ttk.Button(btns, text="Exportar PDF", command=lambda: export_pdf()).pack(side=tk.LEFT, padx=2)
+        ttk.Button(btns, text="Por categoría", command=lambda: show_categories()).pack(side=tk.LEFT, padx=2)
 
         # Tabla de reporte
         table_frame = ttk.Frame(report_win, padding=10)
@@ -472,29 +753,44 @@ class CashRegisterView:
             sum_bal.set(f"Balance: ${(tot_inc - tot_exp):,.2f}")
 
         def export_csv():
-            if not rep_tree.get_children():
-                messagebox.showinfo("Información", "Primero genere el reporte para exportar.")
-                return
+            # se exporta desde SQL (valores numéricos, cualquier rango), no lo que muestra la tabla
+            start = d1.get_date().strftime('%Y-%m-%d')
+            end = d2.get_date().strftime('%Y-%m-%d')
+            gb_map = {"Día": "day", "Semana": "week", "Mes": "month"}
+            group_by = gb_map.get(group_var.get(), "day")
             path = filedialog.asksaveasfilename(
                 defaultextension=".csv",
-                filetypes=[("CSV", ".csv")],
-                title="Guardar reporte como"
+                filetypes=EXPORT_FILETYPES,
+                title="Guardar reporte como",
+                initialfile=f"flujo_caja_{start}_{end}.csv",
+                parent=report_win
             )
             if not path:
                 return
-            try:
-                with open(path, 'w', newline='', encoding='utf-8') as f:
-                    writer = csv.writer(f)
-                    writer.writerow(["Fecha", "Ingresos", "Egresos", "Balance"])
-                    for iid in rep_tree.get_children():
-                        writer.writerow(rep_tree.item(iid)['values'])
-                messagebox.showinfo("Éxito", "Reporte exportado correctamente")
-            except Exception as e:
-                messagebox.showerror("Error", f"No se pudo exportar el reporte: {e}")
+            run_in_background(
+                report_win, "Exportar flujo de caja",
+                lambda progress, cancel_event: self.controller.export_cash_flow(
+                    path, start, end, group_by, progress=progress, cancel_event=cancel_event),
+                on_success=lambda n: messagebox.showinfo(
+                    "Éxito", f"Reporte exportado correctamente ({n:,} filas)", parent=report_win),
+                error_text="No se pudo exportar el reporte"
+            )
 
         def export_pdf():
-            if not rep_tree.get_children():
-                messagebox.showinfo("Información", "Primero genere el reporte para exportar.")
+            start = d1.get_date().strftime('%Y-%m-%d')
+            end = d2.get_date().strftime('%Y-%m-%d')
+            gb_map = {"Día": "day", "Semana": "week", "Mes": "month"}
+            group_by = gb_map.get(group_var.get(), "day")
+
+            try:
+                n_rows = self.controller.count_cash_flow_rows(start, end, group_by)
+                n_movements = self.controller.get_transactions_summary(start, end)["count"]
+                totals = self.controller.get_period_balance(start, end)
+            except Exception as e:
+                messagebox.showerror("Error", f"No se pudo generar el reporte: {e}")
+                return
+            if not n_movements:
+                messagebox.showinfo("Información", "No hay movimientos en el período seleccionado.")
                 return
 
             # Nombre: reporte_caja_YYYYMMDD_YYYYMMDD.pdf
@@ -511,71 +807,65 @@ class CashRegisterView:
             if not path:
                 return
 
-            try:
-                doc = SimpleDocTemplate(
-                    path, pagesize=A4,
-                    leftMargin=15*mm, rightMargin=15*mm,
-                    topMargin=15*mm, bottomMargin=15*mm
-                )
-                story = []
-                styles = getSampleStyleSheet()
-
-                title = Paragraph("<b>Reporte de Caja</b>", styles['Title'])
-                periodo = Paragraph(
-                    f"Período: {d1.get_date().strftime('%Y-%m-%d')} a {d2.get_date().strftime('%Y-%m-%d')} | "
-                    f"Generado: {datetime.now().strftime('%Y-%m-%d %H:%M')}",
-                    styles['Normal']
+            tot_inc = float(totals['income'])
+            tot_exp = float(totals['expense'])
+
+            def _row(row):
+                return [row['date'], f"${float(row['income']):,.2f}",
+                        f"${float(row['expense']):,.2f}", f"${float(row['balance']):,.2f}"]
+
+            def job(progress, cancel_event):
+                # Colores por columna: Ingresos=verde, Egresos=rojo
+                return write_table_pdf(
+                    path,
+                    title="Reporte de Caja",
+                    subtitle=f"Período: {start} a {end} | Agrupado por: {group_var.get()}",
+                    headers=["Fecha", "Ingresos", "Egresos", "Balance"],
+                    chunks=self.controller.iter_cash_flow_report(start, end, group_by),
+                    row_mapper=_row,
+                    col_weights=[1, 1, 1, 1],
+                    align={1: 'RIGHT', 2: 'RIGHT', 3: 'RIGHT'},
+                    landscape_page=False,
+                    extra_styles=[
+                        ('TEXTCOLOR', (1, 1), (1, -1), colors.HexColor('#0b6b0b')),
+                        ('TEXTCOLOR', (2, 1), (2, -1), colors.HexColor('#8b0000')),
+                    ],
+                    totals_row=["Totales", f"${tot_inc:,.2f}", f"${tot_exp:,.2f}",
+                                f"${(tot_inc - tot_exp):,.2f}"],
+                    summary_lines=[f"Ingresos: ${tot_inc:,.2f}", f"Egresos: ${tot_exp:,.2f}",
+                                   f"Balance: ${(tot_inc - tot_exp):,.2f}"],
+                    total_rows=n_rows,
+                    progress=progress,
+                    cancel_event=cancel_event,
                 )
-                story += [title, Spacer(1, 4*mm), periodo, Spacer(1, 6*mm)]
-
-                headers = ["Fecha", "Ingresos", "Egresos", "Balance"]
-                data = [headers]
-                tot_inc = 0.0
-                tot_exp = 0.0
-
-                def to_float(txt):
-                    return float(str(txt).replace('$', '').replace(',', ''))
-
-                for iid in rep_tree.get_children():
-                    fecha, inc_txt, eg_txt, bal_txt = rep_tree.item(iid)['values']
-                    tot_inc += to_float(inc_txt)
-                    tot_exp += to_float(eg_txt)
-                    data.append([fecha, inc_txt, eg_txt, bal_txt])
-
-                data.append(["Totales", f"${tot_inc:,.2f}", f"${tot_exp:,.2f}", f"${(tot_inc - tot_exp):,.2f}"])
-
-                table = Table(data, repeatRows=1)
-                ts = TableStyle([
-                    ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
-                    ('TEXTCOLOR', (0,0), (-1,0), colors.black),
-                    ('ALIGN', (1,1), (-1,-1), 'RIGHT'),
-                    ('ALIGN', (0,0), (-1,0), 'CENTER'),
-                    ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-                    ('FONTSIZE', (0,0), (-1,0), 10),
-                    ('GRID', (0,0), (-1,-1), 0.25, colors.grey),
-                    ('ROWBACKGROUNDS', (0,1), (-1,-2), [colors.whitesmoke, colors.transparent]),
-                    ('FONTNAME', (0,-1), (-1,-1), 'Helvetica-Bold'),
-                ])
-
-                # Colores por columna: Ingresos=verde, Egresos=rojo, Balance=negro
-                if len(data) > 1:
-                    ts.add('TEXTCOLOR', (1, 1), (1, -1), colors.HexColor('#0b6b0b'))
-                    ts.add('TEXTCOLOR', (2, 1), (2, -1), colors.HexColor('#8b0000'))
-                    ts.add('TEXTCOLOR', (3, 1), (3, -1), colors.black)
-
-                ts.add('BACKGROUND', (0, len(data)-1), (-1, len(data)-1), colors.lightgrey)
-                table.setStyle(ts)
-
-                story.append(table)
-                story.append(Spacer(1, 6*mm))
-                story.append(Paragraph(sum_ing.get(), styles['Normal']))
-                story.append(Paragraph(sum_egr.get(), styles['Normal']))
-                story.append(Paragraph(sum_bal.get(), styles['Normal']))
-
-                doc.build(story)
-                messagebox.showinfo("Éxito", "PDF exportado correctamente")
+
+            run_in_background(
+                report_win, "Reporte de Caja", job,
+                on_success=lambda _n: messagebox.showinfo("Éxito", "PDF exportado correctamente", parent=report_win)
+            )
+
+        def show_categories():
+            start = d1.get_date().strftime('%Y-%m-%d')
+            end = d2.get_date().strftime('%Y-%m-%d')
+            try:
+                data = self.controller.get_category_breakdown(start, end)
             except Exception as e:
-                messagebox.showerror("Error", f"No se pudo exportar el PDF: {e}")
+                messagebox.showerror("Error", f"No se pudo generar el resumen: {e}", parent=report_win)
+                return
+            win = tk.Toplevel(report_win)
+            win.title(f"Caja por categoría ({start} a {end})")
+            win.geometry("620x360")
+            cat_cols = ("categoria", "movimientos", "ingresos", "egresos", "balance")
+            cat_tree = ttk.Treeview(win, columns=cat_cols, show='headings')
+            for c, t, w in zip(cat_cols, ["Categoría", "Movimientos", "Ingresos", "Egresos", "Balance"],
+                               (200, 90, 100, 100, 100)):
+                cat_tree.heading(c, text=t)
+                cat_tree.column(c, width=w, anchor=tk.W if c == "categoria" else tk.E)
+            for r in data:
+                cat_tree.insert('', 'end', values=(
+                    r['name'], r['count'], f"${r['income']:,.2f}", f"${r['expense']:,.2f}", f"${r['balance']:,.2f}"
+                ))
+            cat_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
 
         # Generar con valores por defecto al abrir
         generate()
@@ -585,7 +875,7 @@ class CashRegisterView:
         try:
             monthly_data = self.controller.get_monthly_summary()
 
-            if not monthly_data:
+            if not any(m['income'] or m['expense'] for m in monthly_data):
                 messagebox.showinfo("Información", "No hay datos disponibles para generar el gráfico")
                 return
 
@@ -0,0 +1,397 @@
+# modules/credit_sales/controller.py
+"""
+Controlador de Ventas a Crédito (fiado)
+- Registra la venta como salida de inventario (vía InventoryController: stock y costales)
+- La venta NO entra a Caja; cada abono sí se registra como ingreso (credit_sale_payments.cash_register_id)
+  y al anular el abono ese ingreso se borra, o se revierte si el día ya tiene arqueo o está conciliado
+- Saldo por factura (credit_sales.balance) y por cliente (credit_customers.balance)
+  materializados: se actualizan en cada venta/abono, no se suman pagos al leer
+- Reporte de antigüedad de cartera en una sola consulta agrupada
+"""
+
+from datetime import datetime
+from typing import Optional, List, Dict, Any
+
+from modules.inventory.controller import InventoryController
+from modules.cash_register.controller import CashRegisterController
+
+AGING_BUCKETS = (("d0_30", "0-30"), ("d31_60", "31-60"), ("d61_90", "61-90"), ("d90_plus", "90+"))
+
+
+class CreditSalesController:
+    def __init__(self, database, auth_manager, cash_controller=None):
+        self.db = database
+        self.auth = auth_manager
+        self.cash = cash_controller or CashRegisterController(database, auth_manager)
+        self.inv = InventoryController(database, auth_manager)
+        self._ensure_schema()
+
+    # ------------------------------
+    # Esquema
+    # ------------------------------
+    def _ensure_schema(self):
+        """Tablas base (por si la BD es nueva) + columnas/índices del saldo materializado."""
+        self.db.execute_query("""
+            CREATE TABLE IF NOT EXISTS credit_sales (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TEXT NOT NULL,
+                customer_name TEXT NOT NULL,
+                product_name TEXT NOT NULL,
+                quantity INTEGER NOT NULL,
+                unit_price REAL NOT NULL,
+                quality TEXT NOT NULL,
+                total_amount REAL NOT NULL,
+                status TEXT DEFAULT 'active',
+                notes TEXT,
+                user_id INTEGER,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        """)
+        self.db.execute_query("""
+            CREATE TABLE IF NOT EXISTS credit_sale_payments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                credit_sale_id INTEGER,
+                payment_date TEXT NOT NULL,
+                amount REAL NOT NULL,
+                payment_method TEXT NOT NULL,
+                notes TEXT,
+                user_id INTEGER,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (credit_sale_id) REFERENCES credit_sales (id),
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        """)
+        # Saldo por cliente (materializado)
+        self.db.execute_query("""
+            CREATE TABLE IF NOT EXISTS credit_customers (
+                customer_name TEXT PRIMARY KEY COLLATE NOCASE,
+                balance REAL NOT NULL DEFAULT 0,
+                open_invoices INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # columnas credit_sales.paid_amount / balance / inventory_id
+        try:
+            self.db.execute_query("SELECT balance FROM credit_sales LIMIT 1")
+        except Exception:
+            self.db.execute_query("ALTER TABLE credit_sales ADD COLUMN paid_amount REAL NOT NULL DEFAULT 0")
+            self.db.execute_query("ALTER TABLE credit_sales ADD COLUMN balance REAL")
+            self.db.execute_query("ALTER TABLE credit_sales ADD COLUMN inventory_id INTEGER")
+            # poblar saldos de ventas ya existentes (una sola vez)
+            self.db.execute_query("""
+                UPDATE credit_sales
+                   SET paid_amount = (SELECT COALESCE(SUM(amount), 0) FROM credit_sale_payments
+                                       WHERE credit_sale_id = credit_sales.id)
+            """)
+            self.db.execute_query("UPDATE credit_sales SET balance = ROUND(total_amount - paid_amount, 2)")
+            self.rebuild_customer_balances()
+
+        # columna credit_sale_payments.cash_register_id (movimiento de Caja del abono)
+        try:
+            self.db.execute_query("SELECT cash_register_id FROM credit_sale_payments LIMIT 1")
+        except Exception:
+            self.db.execute_query("ALTER TABLE credit_sale_payments ADD COLUMN cash_register_id INTEGER")
+            self._link_legacy_payments()
+
+        # índices: facturas abiertas por cliente (parcial) y pagos por factura
+        try:
+            self.db.execute_query(
+                "CREATE INDEX IF NOT EXISTS idx_cs_open ON credit_sales(customer_name, date) WHERE balance > 0"
+            )
+            self.db.execute_query(
+                "CREATE INDEX IF NOT EXISTS idx_csp_sale ON credit_sale_payments(credit_sale_id)"
+            )
+        except Exception:
+            pass
+
+    def _link_legacy_payments(self):
+        """
+        Abonos anteriores a cash_register_id: se enlazan (una sola vez) con el ingreso de Caja
+        de la misma fecha, monto y descripción; cada movimiento se usa para un solo abono.
+        """
+        pays = self.db.execute_query("""
+            SELECT p.id, p.payment_date, p.amount, p.credit_sale_id, s.customer_name
+              FROM credit_sale_payments p
+              JOIN credit_sales s ON s.id = p.credit_sale_id
+          ORDER BY p.id
+        """) or []
+        used = set()
+        with self.db.transaction():
+            for p in pays:
+                rows = self.db.execute_query("""
+                    SELECT id FROM cash_register
+                     WHERE date = ? AND type = 'income' AND ROUND(amount, 2) = ROUND(?, 2) AND description = ?
+                  ORDER BY id
+                """, (p["payment_date"], p["amount"],
+                      f"Abono venta a crédito #{p['credit_sale_id']}: {p['customer_name']}")) or []
+                cash_id = next((r["id"] for r in rows if r["id"] not in used), None)
+                if cash_id is not None:
+                    used.add(cash_id)
+                    self.db.execute_query(
+                        "UPDATE credit_sale_payments SET cash_register_id = ? WHERE id = ?", (cash_id, p["id"]))
+
+    def _cash_movement_locked(self, cash_id: int, date: str) -> bool:
+        """True si el movimiento ya no se puede borrar: su día tiene arqueo o está conciliado con el banco."""
+        if self.cash.is_day_closed(date):
+            return True
+        try:
+            return bool(self.db.execute_query(
+                "SELECT 1 FROM bank_reconciliations WHERE cash_register_id = ? LIMIT 1", (cash_id,)))
+        except Exception:
+            return False  # sin conciliación bancaria en esta BD
+
+    def _user_id(self):
+        u = self.auth.current_user
+        return u["id"] if isinstance(u, dict) and "id" in u else u
+
+    def _require_admin(self):
+        if not getattr(self.auth, "has_permission", None) or not self.auth.has_permission("admin"):
+            raise PermissionError("Solo el usuario administrador puede realizar esta acción")
+
+    def _bump_customer(self, customer: str, delta_balance: float, delta_open: int):
+        """Ajusta el saldo materializado del cliente (crea la fila si no existe)."""
+        self.db.execute_query(
+            """
+            INSERT INTO credit_customers (customer_name, balance, open_invoices, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(customer_name) DO UPDATE
+               SET balance = ROUND(balance + excluded.balance, 2),
+                   open_invoices = open_invoices + excluded.open_invoices,
+                   updated_at = CURRENT_TIMESTAMP
+            """,
+            (customer, round(float(delta_balance), 2), int(delta_open)),
+        )
+
+    # ------------------------------
+    # Ventas a crédito
+    # ------------------------------
+    def create_credit_sale(
+        self, date: str, potato_type: str, quality: str, quantity: int,
+        unit_price: float, customer: str, notes: str = "",
+    ) -> int:
+        if not self.auth.current_user:
+            raise Exception("Usuario no autenticado")
+
+        potato_type, quality = self.inv.validate_type_quality(potato_type, quality)
+        customer = (customer or "").strip()
+        if not customer:
+            raise ValueError("El cliente es obligatorio en una venta a crédito")
+        if int(quantity) <= 0:
+            raise ValueError("La cantidad debe ser positiva")
+        if float(unit_price) < 0:
+            raise ValueError("El precio unitario no puede ser negativo")
+
+        total = round(int(quantity) * float(unit_price), 2)
+        notes = (notes or "").strip()
+
+        try:
+            with self.db.transaction():
+                # salida de inventario: valida stock y costales, y los descuenta
+                inv_id = self.inv.add_inventory_record(
+                    date=date, potato_type=potato_type, quality=quality, operation="exit",
+                    quantity=int(quantity), unit_price=float(unit_price),
+                    supplier_customer=customer, notes=notes or "Venta a crédito",
+                )
+                sale_id = self.db.execute_query(
+                    """
+                    INSERT INTO credit_sales
+                        (date, customer_name, product_name, quantity, unit_price, quality, total_amount,
+                         status, notes, user_id, paid_amount, balance, inventory_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, 'active', ?, ?, 0, ?, ?)
+                    """,
+                    (date, customer, potato_type, int(quantity), float(unit_price), quality, total,
+                     notes, self._user_id(), total, inv_id),
+                )
+                self._bump_customer(customer, total, 1 if total > 0 else 0)
+        except Exception:
+            # la salida se revirtió: descartar el precio que ya se anotó en memoria
+            self.inv.hints.invalidate()
+            raise
+        return int(sale_id)
+
+    def get_credit_sale(self, sale_id: int) -> Optional[Dict[str, Any]]:
+        rows = self.db.execute_query("SELECT * FROM credit_sales WHERE id = ?", (int(sale_id),))
+        return dict(rows[0]) if rows else None
+
+    def list_credit_sales(
+        self, customer: Optional[str] = None, only_open: bool = False,
+        start_date: Optional[str] = None, end_date: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        q = [
+            "SELECT cs.*, u.username FROM credit_sales cs",
+            "LEFT JOIN users u ON u.id = cs.user_id",
+            "WHERE 1=1",
+        ]
+        params: list = []
+        if only_open:
+            q.append("AND cs.balance > 0")
+        if customer:
+            q.append("AND cs.customer_name = ? COLLATE NOCASE")
+            params.append(customer.strip())
+        if start_date:
+            q.append("AND cs.date >= ?"); params.append(start_date)
+        if end_date:
+            q.append("AND cs.date <= ?"); params.append(end_date)
+        q.append("ORDER BY cs.date DESC, cs.id DESC")
+        rows = self.db.execute_query(" ".join(q), tuple(params))
+        return [dict(r) for r in rows] if rows else []
+
+    # ------------------------------
+    # Abonos
+    # ------------------------------
+    def add_payment(
+        self, credit_sale_id: int, payment_date: str, amount: float,
+        payment_method: str = "cash", notes: str = "", register_in_cash: bool = True,
+    ) -> int:
+        if not self.auth.current_user:
+            raise Exception("Usuario no autenticado")
+        amount = round(float(amount), 2)
+        if amount <= 0:
+            raise ValueError("El monto del abono debe ser mayor a cero")
+
+        with self.db.transaction():
+            sale = self.get_credit_sale(credit_sale_id)
+            if not sale:
+                raise ValueError("Venta a crédito no encontrada")
+            balance = float(sale["balance"] or 0)
+            if amount > balance + 0.005:
+                raise ValueError(f"El abono (${amount:,.2f}) supera el saldo pendiente (${balance:,.2f})")
+
+            pay_id = self.db.execute_query(
+                """
+                INSERT INTO credit_sale_payments (credit_sale_id, payment_date, amount, payment_method, notes, user_id)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (int(credit_sale_id), payment_date, amount, payment_method, (notes or "").strip(), self._user_id()),
+            )
+            new_balance = max(round(balance - amount, 2), 0.0)
+            new_status = "paid" if new_balance <= 0 else "active"
+            self.db.execute_query(
+                "UPDATE credit_sales SET paid_amount = ROUND(paid_amount + ?, 2), balance = ?, status = ? WHERE id = ?",
+                (amount, new_balance, new_status, int(credit_sale_id)),
+            )
+            self._bump_customer(sale["customer_name"], -amount, -1 if new_status == "paid" else 0)
+
+            if register_in_cash:
+                cash_id = self.cash.add_transaction(
+                    payment_date, "income",
+                    f"Abono venta a crédito #{sale['id']}: {sale['customer_name']}",
+                    amount, payment_method, "venta_credito",
+                )
+                self.db.execute_query(
+                    "UPDATE credit_sale_payments SET cash_register_id = ? WHERE id = ?", (cash_id, pay_id))
+        return int(pay_id)
+
+    def delete_payment(self, payment_id: int):
+        """
+        Anula un abono (solo admin) y, en la misma transacción, su ingreso en Caja: se borra,
+        o si su día ya tiene arqueo o está conciliado se registra un egreso de reversión hoy.
+        """
+        self._require_admin()
+        with self.db.transaction():
+            rows = self.db.execute_query("SELECT * FROM credit_sale_payments WHERE id = ?", (int(payment_id),))
+            if not rows:
+                raise ValueError("Abono no encontrado")
+            pay = dict(rows[0])
+            sale = self.get_credit_sale(pay["credit_sale_id"])
+            self.db.execute_query("DELETE FROM credit_sale_payments WHERE id = ?", (int(payment_id),))
+            if sale:
+                amount = float(pay["amount"])
+                was_paid = float(sale["balance"] or 0) <= 0
+                self.db.execute_query(
+                    """
+                    UPDATE credit_sales
+                       SET paid_amount = ROUND(paid_amount - ?, 2),
+                           balance = ROUND(balance + ?, 2),
+                           status = 'active'
+                     WHERE id = ?
+                    """,
+                    (amount, amount, sale["id"]),
+                )
+                self._bump_customer(sale["customer_name"], amount, 1 if was_paid else 0)
+
+            cash = self.db.execute_query(
+                "SELECT * FROM cash_register WHERE id = ?", (pay["cash_register_id"],)
+            ) if pay.get("cash_register_id") else None
+            if cash:
+                cash = dict(cash[0])
+                if self._cash_movement_locked(cash["id"], cash["date"]):
+                    self.cash.add_transaction(
+                        datetime.now().strftime("%Y-%m-%d"), "expense",
+                        f"Anulación abono venta a crédito #{pay['credit_sale_id']} (mov. #{cash['id']})",
+                        float(cash["amount"]), cash["payment_method"], "venta_credito",
+                    )
+                else:
+                    self.db.execute_query("DELETE FROM cash_register WHERE id = ?", (cash["id"],))
+        return True
+
+    def get_sale_payments(self, credit_sale_id: int) -> List[Dict[str, Any]]:
+        rows = self.db.execute_query(
+            """
+            SELECT p.*, u.username
+              FROM credit_sale_payments p
+         LEFT JOIN users u ON u.id = p.user_id
+             WHERE p.credit_sale_id = ?
+          ORDER BY p.payment_date DESC, p.id DESC
+            """,
+            (int(credit_sale_id),),
+        )
+        return [dict(r) for r in rows] if rows else []
+
+    # ------------------------------
+    # Cartera (saldos materializados)
+    # ------------------------------
+    def get_customer_balance(self, customer: str) -> float:
+        rows = self.db.execute_query(
+            "SELECT balance FROM credit_customers WHERE customer_name = ?", ((customer or "").strip(),)
+        )
+        return float(rows[0]["balance"]) if rows else 0.0
+
+    def list_customer_balances(self, only_with_balance: bool = True) -> List[Dict[str, Any]]:
+        q = "SELECT * FROM credit_customers"
+        if only_with_balance:
+            q += " WHERE balance > 0"
+        q += " ORDER BY balance DESC, customer_name"
+        rows = self.db.execute_query(q)
+        return [dict(r) for r in rows] if rows else []
+
+    def rebuild_customer_balances(self):
+        """Recalcula credit_customers desde las facturas (consistencia / migración)."""
+        with self.db.transaction():
+            self.db.execute_query("DELETE FROM credit_customers")
+            self.db.execute_query("""
+                INSERT INTO credit_customers (customer_name, balance, open_invoices, updated_at)
+                SELECT customer_name, ROUND(SUM(balance), 2), SUM(CASE WHEN balance > 0 THEN 1 ELSE 0 END),
+                       CURRENT_TIMESTAMP
+                  FROM credit_sales
+              GROUP BY customer_name COLLATE NOCASE
+            """)
+
+    def get_aging_report(self, as_of: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Antigüedad de cartera por cliente (días desde la fecha de la venta),
+        en una sola consulta agrupada sobre las facturas abiertas.
+        """
+        as_of = as_of or datetime.now().strftime("%Y-%m-%d")
+        rows = self.db.execute_query(
+            """
+            SELECT customer_name,
+                   COUNT(*) AS invoices,
+                   ROUND(SUM(balance), 2) AS total,
+                   ROUND(SUM(CASE WHEN age <= 30 THEN balance ELSE 0 END), 2) AS d0_30,
+                   ROUND(SUM(CASE WHEN age > 30 AND age <= 60 THEN balance ELSE 0 END), 2) AS d31_60,
+                   ROUND(SUM(CASE WHEN age > 60 AND age <= 90 THEN balance ELSE 0 END), 2) AS d61_90,
+                   ROUND(SUM(CASE WHEN age > 90 THEN balance ELSE 0 END), 2) AS d90_plus,
+                   MAX(age) AS oldest_days
+              FROM (SELECT customer_name, balance,
+                           CAST(julianday(?) - julianday(date) AS INTEGER) AS age
+                      FROM credit_sales
+                     WHERE balance > 0)
+          GROUP BY customer_name COLLATE NOCASE
+          ORDER BY total DESC
+            """,
+            (as_of,),
+        )
+        return [dict(r) for r in rows] if rows else []
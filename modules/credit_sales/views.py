@@ -0,0 +1,322 @@
+"""
+Vista de Ventas a Crédito (Tkinter + ttk)
+- Registrar venta fiada (descuenta inventario y costales, no entra a Caja)
+- Facturas con saldo y registro de abonos (el abono sí entra a Caja)
+- Saldos por cliente (materializados) y antigüedad de cartera
+"""
+
+import tkinter as tk
+from tkinter import ttk, messagebox
+from tkcalendar import DateEntry
+from datetime import datetime
+
+from modules.credit_sales.controller import CreditSalesController, AGING_BUCKETS
+from modules.inventory.controller import VALID_COMBOS
+
+PAY_TO_CODE = {"Efectivo": "cash", "Transferencia": "transfer"}
+STATUS_TO_ES = {"active": "Pendiente", "paid": "Pagada"}
+
+
+class CreditSalesView:
+    def __init__(self, parent, database, auth_manager, cash_controller=None):
+        self.parent = parent
+        self.db = database
+        self.auth = auth_manager
+        self.controller = CreditSalesController(database, auth_manager, cash_controller)
+
+        self._build_ui()
+        self.refresh_all()
+
+    # ---------------------------
+    # UI
+    # ---------------------------
+    def _build_ui(self):
+        container = ttk.Frame(self.parent, padding=8)
+        container.pack(fill=tk.BOTH, expand=True)
+
+        left = ttk.LabelFrame(container, text="Nueva venta a crédito", padding=10)
+        left.pack(side=tk.LEFT, fill=tk.Y, padx=(0, 8))
+
+        right = ttk.Frame(container)
+        right.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        row = 0
+        ttk.Label(left, text="Fecha:").grid(row=row, column=0, sticky=tk.W, pady=2)
+        self.date_entry = DateEntry(left, date_pattern="yyyy-mm-dd")
+        self.date_entry.set_date(datetime.now())
+        self.date_entry.grid(row=row, column=1, sticky=tk.EW, pady=2, padx=(5, 0))
+        row += 1
+
+        ttk.Label(left, text="Tipo de papa:").grid(row=row, column=0, sticky=tk.W, pady=2)
+        self.type_cb = ttk.Combobox(left, state="readonly", values=tuple(VALID_COMBOS.keys()))
+        self.type_cb.set("parda")
+        self.type_cb.grid(row=row, column=1, sticky=tk.EW, pady=2, padx=(5, 0))
+        self.type_cb.bind("<<ComboboxSelected>>", self._on_type_change)
+        row += 1
+
+        ttk.Label(left, text="Calidad:").grid(row=row, column=0, sticky=tk.W, pady=2)
+        self.quality_cb = ttk.Combobox(left, state="readonly")
+        self._reload_quality_options("parda")
+        self.quality_cb.grid(row=row, column=1, sticky=tk.EW, pady=2, padx=(5, 0))
+        row += 1
+
+        ttk.Label(left, text="Cantidad (bultos):").grid(row=row, column=0, sticky=tk.W, pady=2)
+        self.qty_entry = ttk.Entry(left)
+        self.qty_entry.grid(row=row, column=1, sticky=tk.EW, pady=2, padx=(5, 0))
+        row += 1
+
+        ttk.Label(left, text="Precio unitario:").grid(row=row, column=0, sticky=tk.W, pady=2)
+        self.unit_price_entry = ttk.Entry(left)
+        self.unit_price_entry.grid(row=row, column=1, sticky=tk.EW, pady=2, padx=(5, 0))
+        row += 1
+
+        ttk.Label(left, text="Cliente:").grid(row=row, column=0, sticky=tk.W, pady=2)
+        self.customer_entry = ttk.Entry(left)
+        self.customer_entry.grid(row=row, column=1, sticky=tk.EW, pady=2, padx=(5, 0))
+        row += 1
+
+        ttk.Label(left, text="Notas:").grid(row=row, column=0, sticky=tk.W, pady=2)
+        self.notes_entry = ttk.Entry(left)
+        self.notes_entry.grid(row=row, column=1, sticky=tk.EW, pady=2, padx=(5, 0))
+        row += 1
+
+        ttk.Button(left, text="Registrar venta a crédito", command=self._create_sale)\
+            .grid(row=row, column=0, columnspan=2, pady=8, sticky=tk.W)
+
+        for c in (0, 1):
+            left.grid_columnconfigure(c, weight=1)
+
+        # ---- Derecha: facturas / clientes / antigüedad ----
+        tabs = ttk.Notebook(right)
+        tabs.pack(fill=tk.BOTH, expand=True)
+
+        # Facturas
+        inv_tab = ttk.Frame(tabs, padding=6)
+        tabs.add(inv_tab, text="Facturas")
+
+        filters = ttk.Frame(inv_tab)
+        filters.pack(fill=tk.X, pady=(0, 6))
+        ttk.Label(filters, text="Cliente:").pack(side=tk.LEFT)
+        self.f_customer = ttk.Entry(filters, width=22)
+        self.f_customer.pack(side=tk.LEFT, padx=(4, 12))
+        self.only_open = tk.BooleanVar(value=True)
+        ttk.Checkbutton(filters, text="Solo con saldo", variable=self.only_open).pack(side=tk.LEFT)
+        ttk.Button(filters, text="Aplicar", command=self._load_invoices).pack(side=tk.LEFT, padx=8)
+
+        columns = ("id", "date", "customer", "product", "qty", "total", "paid", "balance", "status")
+        headers = {"id": "ID", "date": "Fecha", "customer": "Cliente", "product": "Producto", "qty": "Bultos",
+                   "total": "Total", "paid": "Abonado", "balance": "Saldo", "status": "Estado"}
+        widths = {"id": 50, "date": 95, "customer": 160, "product": 140, "qty": 60,
+                  "total": 100, "paid": 100, "balance": 100, "status": 80}
+
+        tree_frame = ttk.Frame(inv_tab)
+        tree_frame.pack(fill=tk.BOTH, expand=True)
+        self.inv_tree = ttk.Treeview(tree_frame, columns=columns, show="headings", height=14)
+        for c in columns:
+            self.inv_tree.heading(c, text=headers[c])
+            anchor = tk.E if c in ("total", "paid", "balance") else (tk.W if c in ("customer", "product") else tk.CENTER)
+            self.inv_tree.column(c, width=widths[c], anchor=anchor)
+        ysb = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.inv_tree.yview)
+        self.inv_tree.configure(yscrollcommand=ysb.set)
+        self.inv_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        ysb.pack(side=tk.RIGHT, fill=tk.Y)
+        self.inv_tree.tag_configure("paid", foreground="gray")
+        self.inv_tree.bind("<Double-1>", lambda e: self._show_payment_dialog())
+
+        actions = ttk.Frame(inv_tab)
+        actions.pack(fill=tk.X, pady=(6, 0))
+        ttk.Button(actions, text="Registrar abono", command=self._show_payment_dialog).pack(side=tk.LEFT)
+        ttk.Button(actions, text="Actualizar", command=self.refresh_all).pack(side=tk.RIGHT)
+
+        # Clientes
+        cust_tab = ttk.Frame(tabs, padding=6)
+        tabs.add(cust_tab, text="Saldos por cliente")
+        ccols = ("customer", "open", "balance")
+        self.cust_tree = ttk.Treeview(cust_tab, columns=ccols, show="headings", height=14)
+        for c, t, w, a in (("customer", "Cliente", 220, tk.W), ("open", "Facturas abiertas", 120, tk.CENTER),
+                           ("balance", "Saldo", 120, tk.E)):
+            self.cust_tree.heading(c, text=t)
+            self.cust_tree.column(c, width=w, anchor=a)
+        self.cust_tree.pack(fill=tk.BOTH, expand=True)
+
+        # Antigüedad
+        aging_tab = ttk.Frame(tabs, padding=6)
+        tabs.add(aging_tab, text="Antigüedad de cartera")
+        acols = ("customer", "invoices") + tuple(k for k, _ in AGING_BUCKETS) + ("total",)
+        self.aging_tree = ttk.Treeview(aging_tab, columns=acols, show="headings", height=14)
+        self.aging_tree.heading("customer", text="Cliente")
+        self.aging_tree.column("customer", width=200, anchor=tk.W)
+        self.aging_tree.heading("invoices", text="Facturas")
+        self.aging_tree.column("invoices", width=70, anchor=tk.CENTER)
+        for key, label in AGING_BUCKETS:
+            self.aging_tree.heading(key, text=f"{label} días")
+            self.aging_tree.column(key, width=100, anchor=tk.E)
+        self.aging_tree.heading("total", text="Total")
+        self.aging_tree.column("total", width=110, anchor=tk.E)
+        self.aging_tree.pack(fill=tk.BOTH, expand=True)
+
+        self.totals_lbl = ttk.Label(right, text="Cartera total: —", font=('Segoe UI', 9, 'bold'))
+        self.totals_lbl.pack(anchor=tk.E, pady=(6, 0))
+
+    # ---------------------------
+    # Helpers
+    # ---------------------------
+    def _reload_quality_options(self, potato_type: str):
+        values = VALID_COMBOS.get(potato_type.lower(), [])
+        self.quality_cb["values"] = tuple(values)
+        self.quality_cb.set(values[0] if values else "")
+
+    def _on_type_change(self, _evt=None):
+        self._reload_quality_options(self.type_cb.get())
+
+    def _reset_form(self):
+        self.qty_entry.delete(0, tk.END)
+        self.unit_price_entry.delete(0, tk.END)
+        self.customer_entry.delete(0, tk.END)
+        self.notes_entry.delete(0, tk.END)
+
+    # ---------------------------
+    # Acciones
+    # ---------------------------
+    def _create_sale(self):
+        try:
+            date = self.date_entry.get_date().strftime("%Y-%m-%d")
+            t = self.type_cb.get().strip().lower()
+            q = self.quality_cb.get().strip().lower()
+            qty = int((self.qty_entry.get() or "").strip())
+            price = float((self.unit_price_entry.get() or "").strip())
+            customer = self.customer_entry.get().strip()
+            notes = self.notes_entry.get().strip()
+
+            self.controller.create_credit_sale(date, t, q, qty, price, customer, notes)
+            messagebox.showinfo("Venta a crédito", "Venta a crédito registrada correctamente.")
+            self._reset_form()
+            self.refresh_all()
+            try:
+                self.parent.event_generate("<<SaleCreated>>", when="tail")
+            except Exception:
+                pass
+        except ValueError as ve:
+            messagebox.showerror("Error", str(ve) or "Cantidad/precio inválidos.")
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
+
+    def _show_payment_dialog(self):
+        sel = self.inv_tree.selection()
+        if not sel:
+            messagebox.showwarning("Advertencia", "Seleccione una factura para registrar el abono")
+            return
+        vals = self.inv_tree.item(sel[0])["values"]
+        if not vals or not str(vals[0]).isdigit():
+            return
+        sale = self.controller.get_credit_sale(int(vals[0]))
+        if not sale:
+            return
+        if float(sale["balance"] or 0) <= 0:
+            messagebox.showinfo("Abono", "La factura ya está pagada.")
+            return
+
+        win = tk.Toplevel(self.parent)
+        win.title(f"Abono - Factura #{sale['id']} ({sale['customer_name']})")
+        win.geometry("400x240")
+        win.transient(self.parent)
+        win.grab_set()
+
+        main = ttk.Frame(win, padding=10)
+        main.pack(fill=tk.BOTH, expand=True)
+
+        ttk.Label(main, text=f"Saldo pendiente: ${float(sale['balance']):,.2f}",
+                  font=('Segoe UI', 9, 'bold')).grid(row=0, column=0, columnspan=2, sticky=tk.W, pady=(0, 6))
+
+        ttk.Label(main, text="Fecha:").grid(row=1, column=0, sticky=tk.W, pady=4)
+        date_entry = DateEntry(main, date_pattern='yyyy-mm-dd')
+        date_entry.set_date(datetime.now())
+        date_entry.grid(row=1, column=1, sticky=tk.EW, pady=4, padx=(5, 0))
+
+        ttk.Label(main, text="Monto:").grid(row=2, column=0, sticky=tk.W, pady=4)
+        amount_entry = ttk.Entry(main)
+        amount_entry.insert(0, f"{float(sale['balance']):.2f}")
+        amount_entry.grid(row=2, column=1, sticky=tk.EW, pady=4, padx=(5, 0))
+
+        ttk.Label(main, text="Método:").grid(row=3, column=0, sticky=tk.W, pady=4)
+        method_cb = ttk.Combobox(main, state="readonly", values=tuple(PAY_TO_CODE.keys()), width=18)
+        method_cb.set("Efectivo")
+        method_cb.grid(row=3, column=1, sticky=tk.EW, pady=4, padx=(5, 0))
+
+        ttk.Label(main, text="Notas:").grid(row=4, column=0, sticky=tk.W, pady=4)
+        notes_entry = ttk.Entry(main)
+        notes_entry.grid(row=4, column=1, sticky=tk.EW, pady=4, padx=(5, 0))
+
+        def do_register():
+            try:
+                self.controller.add_payment(
+                    sale["id"], date_entry.get_date().strftime('%Y-%m-%d'),
+                    float(amount_entry.get()), PAY_TO_CODE[method_cb.get()], notes_entry.get(),
+                )
+                messagebox.showinfo("Abono", "Abono registrado.")
+                win.destroy()
+                self.refresh_all()
+            except ValueError as ve:
+                messagebox.showerror("Error", str(ve) or "Monto inválido")
+            except Exception as e:
+                messagebox.showerror("Error", str(e))
+
+        btns = ttk.Frame(main)
+        btns.grid(row=5, column=0, columnspan=2, pady=10)
+        ttk.Button(btns, text="Registrar", command=do_register).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btns, text="Cancelar", command=win.destroy).pack(side=tk.LEFT, padx=5)
+        main.columnconfigure(1, weight=1)
+
+    # ---------------------------
+    # Carga de tablas
+    # ---------------------------
+    def _load_invoices(self):
+        for i in self.inv_tree.get_children():
+            self.inv_tree.delete(i)
+        customer = self.f_customer.get().strip() or None
+        rows = self.controller.list_credit_sales(customer=customer, only_open=self.only_open.get())
+        if not rows:
+            self.inv_tree.insert("", "end", values=("— Sin facturas —", "", "", "", "", "", "", "", ""))
+            return
+        for r in rows:
+            self.inv_tree.insert("", "end", values=(
+                r["id"],
+                r["date"],
+                r["customer_name"],
+                f"{r['product_name']} {r['quality']}",
+                int(r["quantity"]),
+                f"${float(r['total_amount']):,.2f}",
+                f"${float(r['paid_amount'] or 0):,.2f}",
+                f"${float(r['balance'] or 0):,.2f}",
+                STATUS_TO_ES.get(r["status"], r["status"]),
+            ), tags=("paid",) if r["status"] == "paid" else ())
+
+    def _load_customers(self):
+        for i in self.cust_tree.get_children():
+            self.cust_tree.delete(i)
+        total = 0.0
+        for r in self.controller.list_customer_balances():
+            total += float(r["balance"])
+            self.cust_tree.insert("", "end", values=(
+                r["customer_name"], int(r["open_invoices"]), f"${float(r['balance']):,.2f}"
+            ))
+        self.totals_lbl.config(text=f"Cartera total: ${total:,.2f}")
+
+    def _load_aging(self):
+        for i in self.aging_tree.get_children():
+            self.aging_tree.delete(i)
+        for r in self.controller.get_aging_report():
+            self.aging_tree.insert("", "end", values=(
+                r["customer_name"], int(r["invoices"]),
+                *(f"${float(r[k]):,.2f}" for k, _ in AGING_BUCKETS),
+                f"${float(r['total']):,.2f}",
+            ))
+
+    # públicos (para refresco general desde MainWindow)
+    def refresh_all(self):
+        try:
+            self._load_invoices()
+            self._load_customers()
+            self._load_aging()
+        except Exception as e:
+            messagebox.showerror("Ventas a crédito", str(e))
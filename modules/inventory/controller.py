@@ -8,11 +8,14 @@ Controlador de Inventario de Papas
 - Actualiza registros (solo admin)
 - Precio de referencia por combinación (tabla inventory_prices)
 - Valorización del inventario (costo, valor potencial, margen)
+- Precios sugeridos servidos desde memoria (PriceHintIndex)
 """
 
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 
+from modules.inventory.price_hints import PriceHintIndex
+
 VALID_COMBOS = {
     "parda": ["primera", "segunda", "tercera"],
     "colorada": ["primera", "tercera"],
@@ -23,6 +26,7 @@ class InventoryController:
     def __init__(self, database, auth_manager):
         self.db = database
         self.auth = auth_manager
+        self.hints = PriceHintIndex.for_database(database)
 
     # ------------------------------
     # Utilidades / permisos
@@ -56,16 +60,10 @@ class InventoryController:
 
     def get_reference_price(self, potato_type: str, quality: str) -> Optional[float]:
         """Precio de VENTA de referencia; si no existe, usamos el último precio de entrada como sugerencia."""
-        self._ensure_price_table()
         t, q = self.validate_type_quality(potato_type, quality)
-        row = self.db.execute_query(
-            "SELECT unit_price FROM inventory_prices WHERE potato_type=? AND quality=?", (t, q)
-        )
-        if row:
-            try:
-                return float(row[0]["unit_price"])
-            except Exception:
-                return None
+        price = self.hints.reference_price(t, q)
+        if price is not None:
+            return price
         # fallback: último precio de compra registrado
         return self.get_last_purchase_price(t, q)
 
@@ -85,6 +83,15 @@ class InventoryController:
             """,
             (t, q, price),
         )
+        self.hints.set_reference(t, q, price)
+
+    def get_price_hints(self, potato_type: str, quality: str, customer: str = "") -> Dict[str, Optional[float]]:
+        """Última compra, última venta, promedio 30 días, último precio del cliente y sugerencia de venta."""
+        t, q = self.validate_type_quality(potato_type, quality)
+        return self.hints.get_hints(t, q, customer)
+
+    def suggest_sale_price(self, potato_type: str, quality: str, customer: str = "") -> Optional[float]:
+        return self.get_price_hints(potato_type, quality, customer)["suggested_sale"]
 
     # ------------------------------
     # Costales
@@ -158,8 +165,8 @@ class InventoryController:
         return None
 
     def get_last_purchase_price(self, potato_type: str, quality: str) -> Optional[float]:
-        """Último precio de COMPRA (de entradas) para autollenar."""
-        return self.get_last_unit_price(potato_type, quality, "entry")
+        """Último precio de COMPRA (de entradas) para autollenar (desde el índice en memoria)."""
+        return self.hints.last_price(potato_type, quality, "entry")
 
     def add_inventory_record(
         self, date: str, potato_type: str, quality: str, operation: str,
@@ -212,6 +219,8 @@ class InventoryController:
         if operation == "exit":
             self.consume_sacks(quantity)
 
+        self.hints.record(new_id, date, potato_type, quality, operation,
+                          quantity, unit_price, supplier_customer)
         return int(new_id)
 
 
@@ -367,6 +376,7 @@ class InventoryController:
             """,
             (new_qty, unit_price, total_value, supplier_customer, notes, int(record_id)),
         )
+        self.hints.invalidate()
 
     def set_stock_by_admin(self, potato_type: str, quality: str, target_stock: int, note: str = ""):
         """Ajuste administrativo de stock total (no afecta costales ni Caja)."""
@@ -0,0 +1,325 @@
+# modules/inventory/importer.py
+"""
+Importación masiva de compras (entradas) y ventas (salidas) desde CSV o XLSX
+- Lee el archivo por bloques
+- Valida por columnas (combinaciones, fechas, cantidades y precios) con tablas en memoria,
+  sin consultar la base fila por fila
+- Simula el efecto en stock en orden de fecha sobre el saldo de cada fecha (no el actual); las
+  salidas anteriores al último movimiento registrado no consumen costales actuales
+- Inserta todo con executemany en una sola transacción
+- Escribe un CSV con las filas rechazadas y el motivo
+No registra movimientos en Caja (son datos históricos).
+"""
+
+import csv
+import os
+import time
+from bisect import bisect_right
+from datetime import datetime
+from typing import Dict, Iterator, List, Tuple
+
+from modules.inventory.controller import VALID_COMBOS
+from utils.numbers import parse_amount
+from utils.cancel import ExportCancelled
+
+VALID_PAIRS = {(t, q) for t, qs in VALID_COMBOS.items() for q in qs}
+
+OPERATION_ALIASES = {
+    "entry": "entry", "entrada": "entry", "compra": "entry", "e": "entry",
+    "exit": "exit", "salida": "exit", "venta": "exit", "s": "exit",
+}
+
+# encabezado normalizado -> campo
+COLUMN_ALIASES = {
+    "fecha": "date", "date": "date",
+    "operacion": "operation", "operación": "operation", "operation": "operation", "movimiento": "operation",
+    "tipo": "potato_type", "potato_type": "potato_type", "tipo de papa": "potato_type",
+    "calidad": "quality", "quality": "quality",
+    "cantidad": "quantity", "bultos": "quantity", "quantity": "quantity",
+    "precio": "unit_price", "precio unitario": "unit_price", "unit_price": "unit_price",
+    "cliente/proveedor": "supplier_customer", "cliente": "supplier_customer", "proveedor": "supplier_customer",
+    "supplier_customer": "supplier_customer",
+    "notas": "notes", "notes": "notes",
+}
+REQUIRED = ("date", "operation", "potato_type", "quality", "quantity", "unit_price")
+
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%Y/%m/%d")
+
+
+def _read_csv(path: str, chunk_size: int) -> Iterator[Tuple[List[str], List[Tuple[int, list]]]]:
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        delimiter = ";" if sample.count(";") > sample.count(",") else ","
+        reader = csv.reader(f, delimiter=delimiter)
+        header = next(reader, None) or []
+        chunk = []
+        for line_no, row in enumerate(reader, start=2):
+            chunk.append((line_no, row))
+            if len(chunk) >= chunk_size:
+                yield header, chunk
+                chunk = []
+        if chunk:
+            yield header, chunk
+
+
+def _read_xlsx(path: str, chunk_size: int) -> Iterator[Tuple[List[str], List[Tuple[int, list]]]]:
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise Exception("Para importar XLSX necesitas instalar openpyxl:\n\npip install openpyxl")
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = [("" if c is None else str(c)) for c in (next(rows, None) or [])]
+        chunk = []
+        for line_no, row in enumerate(rows, start=2):
+            chunk.append((line_no, list(row)))
+            if len(chunk) >= chunk_size:
+                yield header, chunk
+                chunk = []
+        if chunk:
+            yield header, chunk
+    finally:
+        wb.close()
+
+
+def read_chunks(path: str, chunk_size: int = 5000):
+    """Devuelve (encabezado, [(nro_linea, valores), ...]) por bloques."""
+    if path.lower().endswith((".xlsx", ".xlsm")):
+        return _read_xlsx(path, chunk_size)
+    return _read_csv(path, chunk_size)
+
+
+class InventoryImporter:
+    def __init__(self, database, auth_manager, inventory_controller):
+        self.db = database
+        self.auth = auth_manager
+        self.inv = inventory_controller
+        self._date_cache: Dict[str, str] = {}
+
+    # ------------------------------
+    # Validación por columnas
+    # ------------------------------
+    @staticmethod
+    def _map_header(header: List[str]) -> Dict[str, int]:
+        idx = {}
+        for i, name in enumerate(header):
+            field = COLUMN_ALIASES.get(str(name or "").strip().lower())
+            if field and field not in idx:
+                idx[field] = i
+        missing = [c for c in REQUIRED if c not in idx]
+        if missing:
+            raise ValueError(f"Faltan columnas obligatorias en el archivo: {', '.join(missing)}")
+        return idx
+
+    def _parse_date(self, raw) -> str:
+        if isinstance(raw, datetime):
+            return raw.strftime("%Y-%m-%d")
+        txt = str(raw or "").strip()[:10]
+        hit = self._date_cache.get(txt)
+        if hit is None:
+            hit = ""
+            for fmt in DATE_FORMATS:
+                try:
+                    hit = datetime.strptime(txt, fmt).strftime("%Y-%m-%d")
+                    break
+                except ValueError:
+                    continue
+            self._date_cache[txt] = hit
+        return hit
+
+    @staticmethod
+    def _to_quantity(raw):
+        """Cantidad entera de bultos; None si no es un número entero (no se trunca "2.7")."""
+        value = parse_amount(raw)
+        if value is None or value != int(value):
+            return None
+        return int(value)
+
+    def validate_chunk(self, header, chunk):
+        """
+        Devuelve (validas, rechazadas).
+        validas: (línea, fecha, tipo, calidad, operación, cantidad, precio, cliente/proveedor, notas, fila original)
+        """
+        idx = self._map_header(header)
+
+        def column(field):
+            i = idx.get(field)
+            return [(row[i] if i is not None and i < len(row) else None) for _, row in chunk]
+
+        lines = [n for n, _ in chunk]
+        dates = [self._parse_date(v) for v in column("date")]
+        ops = [OPERATION_ALIASES.get(str(v or "").strip().lower()) for v in column("operation")]
+        types = [str(v or "").strip().lower() for v in column("potato_type")]
+        quals = [str(v or "").strip().lower() for v in column("quality")]
+        qtys = [self._to_quantity(v) for v in column("quantity")]
+        prices = [parse_amount(v) for v in column("unit_price")]
+        parties = [str(v or "").strip() for v in column("supplier_customer")]
+        notes = [str(v or "").strip() for v in column("notes")]
+
+        valid, rejected = [], []
+        for k, line in enumerate(lines):
+            if not dates[k]:
+                reason = "Fecha inválida"
+            elif ops[k] is None:
+                reason = "Operación inválida (use entrada/salida)"
+            elif (types[k], quals[k]) not in VALID_PAIRS:
+                reason = f"Combinación inválida: {types[k]} {quals[k]}"
+            elif qtys[k] is None or qtys[k] <= 0:
+                reason = "Cantidad inválida (debe ser un número entero mayor a cero)"
+            elif prices[k] is None or prices[k] < 0:
+                reason = "Precio inválido"
+            else:
+                valid.append((line, dates[k], types[k], quals[k], ops[k], qtys[k], prices[k],
+                              parties[k], notes[k], chunk[k][1]))
+                continue
+            rejected.append((line, reason, chunk[k][1]))
+        return valid, rejected
+
+    # ------------------------------
+    # Simulación de stock
+    # ------------------------------
+    def _balance_timeline(self):
+        """
+        Saldo por combinación a lo largo del tiempo, con una consulta agrupada por día:
+        {(tipo, calidad): (fechas, saldo al cierre de cada fecha, mínimo de los saldos desde
+        cada fecha en adelante)} y la fecha del último movimiento registrado.
+        """
+        rows = self.db.execute_query("""
+            SELECT LOWER(potato_type) AS t, LOWER(quality) AS q, date,
+                   SUM(CASE WHEN operation='entry' THEN quantity ELSE -quantity END) AS net
+              FROM potato_inventory
+             GROUP BY LOWER(potato_type), LOWER(quality), date
+             ORDER BY t, q, date
+        """) or []
+        timeline, last_date = {}, None
+        for r in rows:
+            dates, cum, _ = timeline.setdefault((r["t"], r["q"]), ([], [], []))
+            dates.append(r["date"])
+            cum.append((cum[-1] if cum else 0) + int(r["net"] or 0))
+            last_date = max(last_date or r["date"], r["date"])
+        for dates, cum, suffix_min in timeline.values():
+            low = None
+            for v in reversed(cum):
+                low = v if low is None else min(low, v)
+                suffix_min.append(low)
+            suffix_min.reverse()
+        return timeline, last_date
+
+    def simulate(self, records, consume_sacks=True):
+        """
+        Aplica los movimientos en orden (fecha, línea) sobre el saldo histórico de cada fecha:
+        una salida se acepta si hay stock ese día y no deja en negativo ningún saldo posterior
+        ya registrado. Solo las salidas desde la fecha del último movimiento registrado usan
+        costales actuales (las anteriores son historia: sus costales ya se descontaron o no aplican).
+        """
+        timeline, last_date = self._balance_timeline()
+        delta = {}  # efecto de lo ya aceptado (todo con fecha <= la fila actual)
+        sacks = self.inv.get_sacks_count()
+        accepted, rejected, sacks_used = [], [], 0
+        for rec in sorted(records, key=lambda r: (r[1], r[0])):
+            line, date, t, q, op, qty = rec[:6]
+            if op == "exit":
+                dates, cum, suffix_min = timeline.get((t, q), ((), (), ()))
+                i = bisect_right(dates, date)
+                available = cum[i - 1] if i else 0
+                if i < len(dates):
+                    available = min(available, suffix_min[i])
+                available += delta.get((t, q), 0)
+                if available < qty:
+                    rejected.append((line, f"Stock insuficiente de {t} {q} al {date}: disponible {available}, "
+                                           f"salida {qty}", rec[9]))
+                    continue
+                uses_sacks = consume_sacks and (last_date is None or date >= last_date)
+                if uses_sacks and sacks < qty:
+                    rejected.append((line, f"Costales insuficientes: disponibles {sacks}, requeridos {qty}", rec[9]))
+                    continue
+                delta[(t, q)] = delta.get((t, q), 0) - qty
+                if uses_sacks:
+                    sacks -= qty
+                    sacks_used += qty
+            else:
+                delta[(t, q)] = delta.get((t, q), 0) + qty
+            accepted.append(rec)
+        return accepted, rejected, sacks_used
+
+    # ------------------------------
+    # Importación
+    # ------------------------------
+    def import_file(self, path, consume_sacks=True, chunk_size=5000,
+                    progress=None, cancel_event=None, rejected_path=None):
+        """
+        Importa el archivo completo. Devuelve un resumen:
+        read, imported, entries, exits, rejected, rejected_path, seconds.
+        """
+        if not self.auth.current_user:
+            raise Exception("Usuario no autenticado")
+        t0 = time.perf_counter()
+        self._date_cache.clear()
+
+        valid, rejected, header = [], [], []
+        read = 0
+        for header, chunk in read_chunks(path, chunk_size):
+            if cancel_event is not None and cancel_event.is_set():
+                raise ExportCancelled()
+            ok, bad = self.validate_chunk(header, chunk)
+            valid.extend(ok)
+            rejected.extend(bad)
+            read += len(chunk)
+            if progress:
+                progress(read, None)
+
+        accepted, stock_rejected, sacks_used = self.simulate(valid, consume_sacks)
+        rejected.extend(stock_rejected)
+
+        if cancel_event is not None and cancel_event.is_set():
+            raise ExportCancelled()
+
+        user_id = (self.auth.current_user["id"]
+                   if isinstance(self.auth.current_user, dict) and "id" in self.auth.current_user
+                   else self.auth.current_user)
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        params = [
+            (d, t, q, op, qty, price, round(qty * price, 2), party, notes or "Importado", user_id, now)
+            for (_line, d, t, q, op, qty, price, party, notes, _raw) in accepted
+        ]
+
+        with self.db.transaction() as cur:
+            cur.executemany(
+                """
+                INSERT INTO potato_inventory
+                    (date, potato_type, quality, operation, quantity, unit_price, total_value,
+                     supplier_customer, notes, user_id, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                params,
+            )
+            if sacks_used:
+                cur.execute(
+                    "UPDATE packaging_stock SET sacks_count = sacks_count - ?, updated_at = CURRENT_TIMESTAMP WHERE id = 1",
+                    (int(sacks_used),),
+                )
+        self.inv.hints.invalidate()
+
+        if rejected:
+            rejected.sort(key=lambda r: r[0])
+            rejected_path = rejected_path or (os.path.splitext(path)[0] + "_rechazados.csv")
+            with open(rejected_path, "w", encoding="utf-8", newline="") as f:
+                w = csv.writer(f)
+                w.writerow(["linea", "motivo"] + list(header))
+                for line, reason, raw in rejected:
+                    w.writerow([line, reason] + ["" if v is None else v for v in (raw or [])])
+        else:
+            rejected_path = None
+
+        return {
+            "read": read,
+            "imported": len(accepted),
+            "entries": sum(1 for r in accepted if r[4] == "entry"),
+            "exits": sum(1 for r in accepted if r[4] == "exit"),
+            "rejected": len(rejected),
+            "rejected_path": rejected_path,
+            "sacks_used": sacks_used,
+            "seconds": round(time.perf_counter() - t0, 2),
+        }
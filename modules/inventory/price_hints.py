@@ -0,0 +1,223 @@
+# modules/inventory/price_hints.py
+"""
+Índice en memoria de precios sugeridos por combinación (tipo, calidad):
+- Último precio de compra (entradas)
+- Último precio de venta (salidas)
+- Promedio ponderado de venta de los últimos N días (30 por defecto)
+- Último precio pagado por cada cliente
+- Precio de venta de referencia (tabla inventory_prices)
+
+Se carga una sola vez por base de datos con consultas agrupadas y luego se
+actualiza en cada movimiento (record), de modo que el autollenado de los
+formularios no consulta la base.
+"""
+
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+
+def _key(potato_type: str, quality: str) -> Tuple[str, str]:
+    return (potato_type or "").strip().lower(), (quality or "").strip().lower()
+
+
+def _cust(customer: Optional[str]) -> str:
+    return (customer or "").strip().lower()
+
+
+class PriceHintIndex:
+    _instances: Dict[int, "PriceHintIndex"] = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def for_database(cls, database) -> "PriceHintIndex":
+        """Una instancia compartida por base de datos (la comparten Inventario, Ventas, etc.)."""
+        with cls._instances_lock:
+            idx = cls._instances.get(id(database))
+            if idx is None or idx.db is not database:
+                idx = cls(database)
+                cls._instances[id(database)] = idx
+            return idx
+
+    def __init__(self, database, window_days: int = 30):
+        self.db = database
+        self.window_days = int(window_days)
+        self._lock = threading.RLock()
+        self._loaded = False
+
+    # ------------------------------
+    # Carga / invalidación
+    # ------------------------------
+    def invalidate(self):
+        """Fuerza a recargar desde la base en la próxima consulta (tras ediciones o borrados)."""
+        with self._lock:
+            self._loaded = False
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self._load()
+
+    def _load(self):
+        with self._lock:
+            # (tipo, calidad, operación) -> ((fecha, id), precio)
+            self._last: Dict[Tuple[str, str, str], Tuple[Tuple[str, int], float]] = {}
+            # (tipo, calidad, cliente) -> ((fecha, id), precio)
+            self._by_customer: Dict[Tuple[str, str, str], Tuple[Tuple[str, int], float]] = {}
+            # (tipo, calidad) -> deque[(fecha, cantidad, precio)] de ventas dentro de la ventana
+            self._recent: Dict[Tuple[str, str], deque] = {}
+            self._reference: Dict[Tuple[str, str], float] = {}
+
+            rows = self.db.execute_query("""
+                SELECT t, q, operation, date, id, unit_price FROM (
+                    SELECT LOWER(potato_type) AS t, LOWER(quality) AS q, operation, date, id, unit_price,
+                           ROW_NUMBER() OVER (PARTITION BY LOWER(potato_type), LOWER(quality), operation
+                                              ORDER BY date DESC, id DESC) AS rn
+                      FROM potato_inventory
+                     WHERE COALESCE(supplier_customer,'') <> 'ajuste'
+                )
+                WHERE rn = 1
+            """)
+            for r in rows or []:
+                self._last[(r["t"], r["q"], r["operation"])] = ((r["date"], r["id"]), float(r["unit_price"] or 0))
+
+            rows = self.db.execute_query("""
+                SELECT t, q, c, date, id, unit_price FROM (
+                    SELECT LOWER(potato_type) AS t, LOWER(quality) AS q,
+                           LOWER(TRIM(supplier_customer)) AS c, date, id, unit_price,
+                           ROW_NUMBER() OVER (PARTITION BY LOWER(potato_type), LOWER(quality),
+                                                           LOWER(TRIM(supplier_customer))
+                                              ORDER BY date DESC, id DESC) AS rn
+                      FROM potato_inventory
+                     WHERE operation='exit'
+                       AND COALESCE(TRIM(supplier_customer),'') NOT IN ('', 'ajuste')
+                )
+                WHERE rn = 1
+            """)
+            for r in rows or []:
+                self._by_customer[(r["t"], r["q"], r["c"])] = ((r["date"], r["id"]), float(r["unit_price"] or 0))
+
+            rows = self.db.execute_query("""
+                SELECT LOWER(potato_type) AS t, LOWER(quality) AS q, date, quantity, unit_price
+                  FROM potato_inventory
+                 WHERE operation='exit'
+                   AND COALESCE(supplier_customer,'') <> 'ajuste'
+                   AND date >= ?
+                 ORDER BY date
+            """, (self._window_start(),))
+            for r in rows or []:
+                self._recent.setdefault((r["t"], r["q"]), deque()).append(
+                    (r["date"], int(r["quantity"] or 0), float(r["unit_price"] or 0))
+                )
+
+            try:
+                rows = self.db.execute_query("SELECT potato_type, quality, unit_price FROM inventory_prices")
+            except Exception:
+                rows = []  # la tabla se crea al primer uso del precio de referencia
+            for r in rows or []:
+                self._reference[_key(r["potato_type"], r["quality"])] = float(r["unit_price"])
+
+            self._loaded = True
+
+    def _window_start(self) -> str:
+        return (datetime.now() - timedelta(days=self.window_days)).strftime("%Y-%m-%d")
+
+    # ------------------------------
+    # Actualización incremental
+    # ------------------------------
+    def record(self, record_id: int, date: str, potato_type: str, quality: str, operation: str,
+               quantity: int, unit_price: float, customer: str = ""):
+        """Registra un movimiento recién insertado sin volver a leer la base."""
+        with self._lock:
+            if not self._loaded:
+                return  # se leerá completo en la primera consulta
+            t, q = _key(potato_type, quality)
+            c = _cust(customer)
+            if c == "ajuste":
+                return
+            stamp = (date, int(record_id))
+            price = float(unit_price)
+
+            cur = self._last.get((t, q, operation))
+            if cur is None or stamp >= cur[0]:
+                self._last[(t, q, operation)] = (stamp, price)
+
+            if operation == "exit":
+                if c:
+                    cur = self._by_customer.get((t, q, c))
+                    if cur is None or stamp >= cur[0]:
+                        self._by_customer[(t, q, c)] = (stamp, price)
+                if date >= self._window_start():
+                    # ordenado por fecha (una venta con fecha atrasada no queda al final), así
+                    # average_sale_price descarta las vencidas solo desde la izquierda
+                    items = self._recent.setdefault((t, q), deque())
+                    i = len(items)
+                    while i and items[i - 1][0] > date:
+                        i -= 1
+                    items.insert(i, (date, int(quantity), price))
+
+    def set_reference(self, potato_type: str, quality: str, unit_price: float):
+        with self._lock:
+            if self._loaded:
+                self._reference[_key(potato_type, quality)] = float(unit_price)
+
+    # ------------------------------
+    # Consultas (en memoria)
+    # ------------------------------
+    def last_price(self, potato_type: str, quality: str, operation: str) -> Optional[float]:
+        with self._lock:
+            self._ensure_loaded()
+            t, q = _key(potato_type, quality)
+            hit = self._last.get((t, q, operation))
+            return hit[1] if hit else None
+
+    def reference_price(self, potato_type: str, quality: str) -> Optional[float]:
+        with self._lock:
+            self._ensure_loaded()
+            return self._reference.get(_key(potato_type, quality))
+
+    def customer_price(self, potato_type: str, quality: str, customer: str) -> Optional[float]:
+        c = _cust(customer)
+        if not c:
+            return None
+        with self._lock:
+            self._ensure_loaded()
+            t, q = _key(potato_type, quality)
+            hit = self._by_customer.get((t, q, c))
+            return hit[1] if hit else None
+
+    def average_sale_price(self, potato_type: str, quality: str) -> Optional[float]:
+        """Promedio ponderado por bultos de las ventas dentro de la ventana."""
+        with self._lock:
+            self._ensure_loaded()
+            items = self._recent.get(_key(potato_type, quality))
+            if not items:
+                return None
+            start = self._window_start()
+            while items and items[0][0] < start:
+                items.popleft()
+            qty = sum(i[1] for i in items)
+            if qty <= 0:
+                return None
+            return round(sum(i[1] * i[2] for i in items) / qty, 2)
+
+    def get_hints(self, potato_type: str, quality: str, customer: str = "") -> Dict[str, Optional[float]]:
+        """
+        Todas las pistas de precio de una combinación y la sugerencia de venta:
+        cliente > referencia > última venta > última compra.
+        """
+        with self._lock:
+            hints = {
+                "last_purchase": self.last_price(potato_type, quality, "entry"),
+                "last_sale": self.last_price(potato_type, quality, "exit"),
+                "avg_sale": self.average_sale_price(potato_type, quality),
+                "customer_last": self.customer_price(potato_type, quality, customer),
+                "reference": self.reference_price(potato_type, quality),
+            }
+        for k in ("customer_last", "reference", "last_sale", "last_purchase"):
+            if hints[k] is not None:
+                hints["suggested_sale"] = hints[k]
+                break
+        else:
+            hints["suggested_sale"] = None
+        return hints
@@ -8,15 +8,18 @@ Inventario de Papas (stock + entradas)
   con scroll vertical y horizontal.
 - Edición admin: ajustar precio ref. y stock total (doble clic o botón "Editar seleccionado").
 - Método refresh_all() para actualizar al abrir la pestaña.
+- Importación masiva de compras/ventas desde CSV o XLSX (en segundo plano).
 """
 
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 from tkcalendar import DateEntry
 from datetime import datetime
 
 from modules.inventory.controller import InventoryController, VALID_COMBOS
 from modules.cash_register.controller import CashRegisterController
+from modules.inventory.importer import InventoryImporter
+from utils.report_export import run_in_background
 
 import matplotlib
 matplotlib.use("TkAgg")
@@ -116,6 +119,7 @@ class InventoryView:
         btn.grid(row=row, column=0, columnspan=2, pady=8, sticky=tk.W)
         ttk.Button(btn, text="Guardar entrada", command=self.add_entry).pack(side=tk.LEFT, padx=(0, 6))
         ttk.Button(btn, text="Gráfico mensual", command=self.show_monthly_chart).pack(side=tk.LEFT)
+        ttk.Button(btn, text="Importar CSV/XLSX…", command=self.import_file_click).pack(side=tk.LEFT, padx=(6, 0))
         row += 1
 
         # ----------------- Costales -----------------
@@ -404,6 +408,36 @@ class InventoryView:
         except Exception as e:
             messagebox.showerror("Error", str(e))
 
+    def import_file_click(self):
+        path = filedialog.askopenfilename(
+            title="Importar compras y ventas",
+            filetypes=[("CSV o Excel", "*.csv *.xlsx"), ("CSV", "*.csv"), ("Excel", "*.xlsx")]
+        )
+        if not path:
+            return
+        consume = messagebox.askyesno(
+            "Importar",
+            "¿Descontar costales por las ventas (salidas) importadas?"
+        )
+        importer = InventoryImporter(self.db, self.auth, self.controller)
+
+        def job(progress, cancel_event):
+            return importer.import_file(path, consume_sacks=consume,
+                                        progress=progress, cancel_event=cancel_event)
+
+        def done(res):
+            msg = (f"Filas leídas: {res['read']}\n"
+                   f"Importadas: {res['imported']} (entradas {res['entries']}, salidas {res['exits']})\n"
+                   f"Rechazadas: {res['rejected']}\n"
+                   f"Tiempo: {res['seconds']} s")
+            if res["rejected_path"]:
+                msg += f"\n\nDetalle de rechazos:\n{res['rejected_path']}"
+            messagebox.showinfo("Importación", msg)
+            self.refresh_all()
+
+        run_in_background(self.parent, "Importar compras y ventas", job, on_success=done,
+                          error_text="No se pudo importar el archivo", cancel_text="Importación cancelada.")
+
     def refresh_stock_table(self):
         for item in self.stock_tree.get_children():
             self.stock_tree.delete(item)
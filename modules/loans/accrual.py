@@ -0,0 +1,184 @@
+# modules/loans/accrual.py
+"""
+Devengo de intereses por tiempo de los préstamos
+- Cada préstamo puede tener una tasa anual (loans.accrual_rate, %) que se devenga día a día
+  sobre el capital pendiente (interés simple, base 365): los pagos se aplican a las cuotas en
+  orden y de cada cuota solo cuenta su parte de capital, así el interés fijo (interest_rate)
+  de las cuotas no genera intereses
+- accrue() solo procesa los días aún no devengados (loans.accrued_through) y asienta una
+  entrada por día o por mes en loan_interest_accruals; el total queda en loans.accrued_interest
+  y los triggers de saldos lo suman a total_due / balance
+- Los pagos dentro del tramo se toman del historial: cada día usa el saldo que había ese día
+- Los reportes leen las columnas de loans: O(préstamos), no O(préstamos × días)
+"""
+import time
+from collections import defaultdict
+from datetime import datetime, date, timedelta
+
+MODES = ("daily", "monthly")
+
+
+def _unpaid_principal(plan, paid):
+    """
+    Capital sin pagar si se aplicó paid a las cuotas en orden (como los triggers de loans).
+    plan: [(capital, monto de la cuota)]; de cada cuota pagada en parte se descuenta la
+    proporción de capital.
+    """
+    out = 0.0
+    for principal, amount in plan:
+        if amount <= 0:
+            continue
+        applied = min(max(paid, 0.0), amount)
+        out += principal * (amount - applied) / amount
+        paid -= amount
+    return out
+
+
+def _month_end_before(d):
+    """Último día del mes completo más reciente (d si d ya es fin de mes)."""
+    if (d + timedelta(days=1)).month != d.month:
+        return d
+    return d.replace(day=1) - timedelta(days=1)
+
+
+class InterestAccrual:
+    def __init__(self, database):
+        self.db = database
+
+    def accrue(self, through=None, mode="daily"):
+        """
+        Devenga intereses hasta through (incluido; por defecto hoy). En modo 'monthly' solo
+        hasta el último mes cerrado y con una entrada por mes. Devuelve
+        {'loans', 'entries', 'amount', 'through', 'ms'}.
+        """
+        if mode not in MODES:
+            raise ValueError(f"Modo de devengo desconocido: {mode}")
+        t0 = time.perf_counter()
+        end = datetime.strptime(through, "%Y-%m-%d").date() if through else date.today()
+        if mode == "monthly":
+            end = _month_end_before(end)
+        end_s = end.strftime("%Y-%m-%d")
+
+        loans = self.db.execute_query("""
+            SELECT id, accrual_rate, amount, interest_rate, total_paid,
+                   COALESCE(accrued_through, date_issued) AS since
+              FROM loans
+             WHERE accrual_rate > 0 AND COALESCE(accrued_through, date_issued) < ?
+        """, (end_s,))
+        loans = [dict(r) for r in loans or []]
+        if not loans:
+            return {"loans": 0, "entries": 0, "amount": 0.0, "through": end_s, "ms": 0.0}
+
+        # capital de cada cuota (sin plan de cuotas: una sola por monto + interés fijo)
+        plans = defaultdict(list)
+        for r in self.db.execute_query("""
+            SELECT i.loan_id, i.principal, i.amount
+              FROM loan_installments i
+              JOIN loans l ON l.id = i.loan_id
+             WHERE l.accrual_rate > 0 AND COALESCE(l.accrued_through, l.date_issued) < ?
+          ORDER BY i.loan_id, i.number
+        """, (end_s,)) or []:
+            plans[r["loan_id"]].append((float(r["principal"]), float(r["amount"])))
+
+        # pagos posteriores al último devengo de cada préstamo (para reconstruir el saldo diario)
+        pays = defaultdict(list)
+        for r in self.db.execute_query("""
+            SELECT p.loan_id, p.payment_date, SUM(p.amount) AS amount
+              FROM loan_payments p
+              JOIN loans l ON l.id = p.loan_id
+             WHERE l.accrual_rate > 0 AND p.payment_date > COALESCE(l.accrued_through, l.date_issued)
+          GROUP BY p.loan_id, p.payment_date
+        """) or []:
+            pays[r["loan_id"]].append((r["payment_date"], float(r["amount"])))
+
+        entries, totals = [], {}
+        for L in loans:
+            daily_rate = float(L["accrual_rate"]) / 100.0 / 365.0
+            principal = float(L["amount"])
+            plan = plans.get(L["id"]) or [(principal, principal * (1 + float(L["interest_rate"] or 0) / 100.0))]
+            later = sorted(pays.get(L["id"], []))
+            # pagado al cierre del día d = pagado hoy - pagos con fecha posterior a d
+            paid = float(L["total_paid"] or 0) - sum(a for _, a in later)
+            base = _unpaid_principal(plan, paid)
+            i = 0
+            d = datetime.strptime(L["since"], "%Y-%m-%d").date() + timedelta(days=1)
+            groups = {}
+            while d <= end:
+                ds = d.strftime("%Y-%m-%d")
+                if i < len(later) and later[i][0] <= ds:
+                    while i < len(later) and later[i][0] <= ds:
+                        paid += later[i][1]
+                        i += 1
+                    base = _unpaid_principal(plan, paid)
+                if base > 0.005:
+                    key = ds if mode == "daily" else ds[:7]
+                    g = groups.setdefault(key, [ds, ds, 0, 0.0, 0.0])
+                    g[1] = ds
+                    g[2] += 1
+                    g[3] += base
+                    g[4] += base * daily_rate
+                d += timedelta(days=1)
+            total = 0.0
+            for start_s, end_day, days, base_sum, amount in groups.values():
+                amount = round(amount, 2)
+                if amount <= 0:
+                    continue
+                entries.append((L["id"], start_s, end_day, days, round(base_sum / days, 2),
+                                float(L["accrual_rate"]), amount))
+                total += amount
+            totals[L["id"]] = round(total, 2)
+
+        with self.db.transaction() as cur:
+            cur.executemany("""
+                INSERT INTO loan_interest_accruals
+                       (loan_id, period_start, period_end, days, base_balance, rate, amount)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, entries)
+            # accrued_interest dispara el recálculo de total_due / balance (triggers de loans)
+            cur.executemany("""
+                UPDATE loans
+                   SET accrued_interest = ROUND(accrued_interest + ?, 2), accrued_through = ?
+                 WHERE id = ?
+            """, [(amt, end_s, lid) for lid, amt in totals.items()])
+
+        ms = (time.perf_counter() - t0) * 1000.0
+        amount = round(sum(totals.values()), 2)
+        if entries:
+            print(f"[InterestAccrual] Intereses al {end_s}: {len(entries)} asiento(s), ${amount:,.2f} "
+                  f"en {len(loans)} préstamo(s), {ms:.1f} ms")
+        return {"loans": len(loans), "entries": len(entries), "amount": amount, "through": end_s, "ms": ms}
+
+    def get_accruals(self, loan_id):
+        rows = self.db.execute_query(
+            "SELECT * FROM loan_interest_accruals WHERE loan_id=? ORDER BY period_end", (loan_id,))
+        return [dict(r) for r in rows] if rows else []
+
+    def get_accrued_balances(self, as_of=None, employee_id=None):
+        """
+        Saldo devengado a la fecha por préstamo: saldo guardado + interés de los días aún no
+        asentados (estimado con el capital pendiente actual). Una fila por préstamo, sin recorrer días.
+        """
+        as_of = as_of or date.today().strftime("%Y-%m-%d")
+        q = """
+            SELECT id, employee_id, employee_name, balance, accrual_rate, accrued_interest, accrued_through,
+                   ROUND(COALESCE((SELECT SUM(i.principal * (i.amount - i.paid_amount) / i.amount)
+                                     FROM loan_installments i WHERE i.loan_id = loans.id AND i.amount > 0),
+                                  MAX(amount * (1 + COALESCE(interest_rate, 0) / 100.0) - total_paid, 0)
+                                      / (1 + COALESCE(interest_rate, 0) / 100.0))
+                         * accrual_rate / 36500.0
+                         * MAX(julianday(:as_of) - julianday(COALESCE(accrued_through, date_issued)), 0), 2)
+                       AS pending_interest
+              FROM loans
+             WHERE balance > 0
+        """
+        params = {"as_of": as_of}
+        if employee_id:
+            q += " AND employee_id = :emp"
+            params["emp"] = employee_id
+        q += " ORDER BY id"
+        out = []
+        for r in self.db.execute_query(q, params) or []:
+            d = dict(r)
+            d["balance_to_date"] = round(float(d["balance"]) + float(d["pending_interest"] or 0), 2)
+            out.append(d)
+        return out
@@ -0,0 +1,85 @@
+# modules/loans/amortization.py
+"""
+Tablas de amortización de préstamos (sin base de datos)
+- Esquemas: flat (interés simple repartido en cuotas iguales),
+  french (cuota constante) y german (amortización de capital constante)
+- La tasa del préstamo (interest_rate) es el % del plazo completo, como en el resto
+  del módulo: en flat el interés total es monto * tasa; en french/german la tasa por
+  cuota es tasa / número de cuotas y se aplica sobre el saldo pendiente
+- Las fechas de las cuotas reparten el plazo (fecha préstamo -> vencimiento) en partes
+  iguales; la última cuota vence el día del vencimiento del préstamo
+- Los importes se redondean a centavos y la última cuota absorbe la diferencia
+"""
+from datetime import datetime, timedelta
+
+SCHEMES = {
+    "flat": "Interés simple (cuotas iguales)",
+    "french": "Francés (cuota constante)",
+    "german": "Alemán (capital constante)",
+}
+
+
+def installment_dates(date_issued, due_date, n):
+    """n fechas 'YYYY-MM-DD' repartidas entre date_issued (excluida) y due_date (incluida)."""
+    start = datetime.strptime(date_issued, "%Y-%m-%d").date()
+    end = datetime.strptime(due_date, "%Y-%m-%d").date()
+    span = (end - start).days
+    return [(start + timedelta(days=round(span * k / n))).strftime("%Y-%m-%d") for k in range(1, n + 1)]
+
+
+def build_schedule(principal, interest_rate, n, date_issued, due_date, scheme="flat"):
+    """
+    Cuotas del préstamo: lista de dict con number, due_date, principal, interest, amount.
+    """
+    if scheme not in SCHEMES:
+        raise ValueError(f"Esquema de amortización desconocido: {scheme}")
+    n = int(n)
+    if n < 1:
+        raise ValueError("El número de cuotas debe ser al menos 1")
+    principal = round(float(principal), 2)
+    rate = float(interest_rate or 0) / 100.0
+    dates = installment_dates(date_issued, due_date, n)
+
+    out = []
+    outstanding = principal
+    if scheme == "flat":
+        total_interest = round(principal * rate, 2)
+        for k in range(n):
+            cap = round(principal / n, 2) if k < n - 1 else round(outstanding, 2)
+            intr = round(total_interest / n, 2) if k < n - 1 else round(total_interest - round(total_interest / n, 2) * (n - 1), 2)
+            outstanding -= cap
+            out.append((cap, intr))
+    else:
+        i = rate / n
+        if scheme == "french":
+            payment = principal / n if i == 0 else principal * i / (1 - (1 + i) ** -n)
+        for k in range(n):
+            intr = round(outstanding * i, 2)
+            if k == n - 1:
+                cap = round(outstanding, 2)
+            elif scheme == "french":
+                cap = round(payment - intr, 2)
+            else:
+                cap = round(principal / n, 2)
+            outstanding = round(outstanding - cap, 2)
+            out.append((cap, intr))
+
+    return [
+        {"number": k + 1, "due_date": dates[k], "principal": cap, "interest": intr,
+         "amount": round(cap + intr, 2)}
+        for k, (cap, intr) in enumerate(out)
+    ]
+
+
+def build_schedules(loans):
+    """
+    Genera en un solo paso las cuotas de muchos préstamos (dict con id, amount, interest_rate,
+    installments, date_issued, due_date, scheme) como tuplas listas para executemany:
+    (loan_id, number, due_date, principal, interest, amount).
+    """
+    rows = []
+    for L in loans:
+        for c in build_schedule(L["amount"], L.get("interest_rate") or 0, L.get("installments") or 1,
+                                L["date_issued"], L["due_date"], L.get("scheme") or "flat"):
+            rows.append((L["id"], c["number"], c["due_date"], c["principal"], c["interest"], c["amount"]))
+    return rows
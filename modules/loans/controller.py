@@ -7,8 +7,51 @@ Controlador para el módulo de préstamos a empleados
 - Impacto en Caja: préstamos, pagos y nómina
 """
 
+import time
 from datetime import datetime
 from modules.cash_register.controller import CashRegisterController
+from utils.search import SearchIndex, build_match
+from utils.export import export_rows
+from modules.loans.amortization import build_schedule, build_schedules
+from modules.loans.accrual import InterestAccrual
+
+# estado según el saldo materializado y las cuotas vencidas (parámetro :today = 'YYYY-MM-DD')
+_STATUS_CASE = ("(CASE WHEN balance <= 0 THEN 'paid' "
+                "WHEN due_date < :today OR EXISTS (SELECT 1 FROM loan_installments li "
+                "WHERE li.loan_id = loans.id AND li.due_date < :today AND li.paid_amount < li.amount) "
+                "THEN 'overdue' ELSE 'active' END)")
+
+# criterios para repartir un abono entre varios préstamos del mismo empleado
+ALLOCATION_STRATEGIES = {
+    "oldest": "Más antiguo primero",
+    "highest_interest": "Mayor interés primero",
+    "pro_rata": "Proporcional al saldo",
+}
+
+# reparto en cascada de lo pagado: cada cuota recibe lo que queda tras cubrir las anteriores
+_ALLOCATE_SQL = """
+    UPDATE loan_installments
+       SET paid_amount = ROUND(MAX(0, MIN(amount, {paid} - COALESCE(
+               (SELECT SUM(p.amount) FROM loan_installments p
+                 WHERE p.loan_id = loan_installments.loan_id AND p.number < loan_installments.number), 0))), 2)
+     WHERE {where}
+"""
+
+
+def _oldest_open_due_sql(alias):
+    """Vencimiento de la cuota impaga más antigua (o del préstamo si no tiene plan de cuotas)"""
+    return (f"COALESCE((SELECT MIN(li.due_date) FROM loan_installments li "
+            f"WHERE li.loan_id = {alias}.id AND li.paid_amount < li.amount), {alias}.due_date)")
+
+
+def _due_sql(alias):
+    """
+    Total a pagar: suma de las cuotas (o, si el préstamo aún no tiene plan, monto + interés simple)
+    más los intereses devengados por tiempo
+    """
+    return (f"ROUND(COALESCE((SELECT SUM(amount) FROM loan_installments WHERE loan_id = {alias}.id), "
+            f"{alias}.amount * (1 + COALESCE({alias}.interest_rate, 0) / 100.0)) "
+            f"+ COALESCE({alias}.accrued_interest, 0), 2)")
 
 
 class LoansController:
@@ -17,9 +60,12 @@ class LoansController:
         self.auth_manager = auth_manager
         self.cash = CashRegisterController(database, auth_manager)
         self._ensure_schema()  # <- importante
+        self.search = SearchIndex(database)
+        self.accrual = InterestAccrual(database)
 
     def _ensure_schema(self):
-        """Garantiza columnas/tablas requeridas: employees, loans.employee_id, loan_payments.is_payroll_deduction"""
+        """Garantiza columnas/tablas requeridas: employees, payroll_history, loans.employee_id,
+        loan_payments.is_payroll_deduction"""
         # employees (por si no existe el módulo de empleados aún)
         self.db.execute_query("""
             CREATE TABLE IF NOT EXISTS employees (
@@ -32,6 +78,46 @@ class LoansController:
             )
         """)
 
+        # historial de pagos de nómina (lo escriben los pagos de aquí y de PayrollController)
+        self.db.execute_query("""
+            CREATE TABLE IF NOT EXISTS payroll_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                employee_id INTEGER NOT NULL,
+                pay_date TEXT NOT NULL,
+                gross_salary REAL NOT NULL,
+                total_deducted REAL NOT NULL,
+                net_paid REAL NOT NULL,
+                payment_method TEXT NOT NULL, -- 'cash' | 'transfer'
+                registered_in_cash INTEGER NOT NULL DEFAULT 1,
+                user_id INTEGER,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (employee_id) REFERENCES employees (id),
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        """)
+        for col in ("period TEXT", "run_id INTEGER REFERENCES payroll_runs(id)"):
+            try:
+                self.db.execute_query(f"ALTER TABLE payroll_history ADD COLUMN {col}")
+            except Exception:
+                pass  # columna ya existe
+        # un pago por empleado y período, venga de una corrida, de un pago individual o del backfill;
+        # (period, employee_id) sirve además a los reportes del período
+        self.db.execute_query("UPDATE payroll_history SET period = SUBSTR(pay_date, 1, 7) WHERE period IS NULL")
+        has_dup_index = self.db.execute_query(
+            "SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_ph_period_employee_dup'")
+        try:
+            if not has_dup_index:
+                self.db.execute_query(
+                    "CREATE UNIQUE INDEX IF NOT EXISTS idx_ph_period_employee ON payroll_history(period, employee_id)"
+                )
+        except Exception as e:
+            # historiales con pagos repetidos en un mes (anteriores a esta regla): índice sin unicidad,
+            # los pagos nuevos igual se rechazan con ensure_period_unpaid
+            print(f"[Loans] payroll_history tiene pagos repetidos por período: {e}")
+            self.db.execute_query(
+                "CREATE INDEX IF NOT EXISTS idx_ph_period_employee_dup ON payroll_history(period, employee_id)"
+            )
+
         # columna loans.employee_id
         try:
             self.db.execute_query("SELECT employee_id FROM loans LIMIT 1")
@@ -47,9 +133,217 @@ class LoansController:
         # índices útiles
         try:
             self.db.execute_query("CREATE INDEX IF NOT EXISTS idx_lp_payroll ON loan_payments(is_payroll_deduction)")
+            # pagos de un préstamo (reporte agrupado, detalle ordenado por fecha)
+            self.db.execute_query("CREATE INDEX IF NOT EXISTS idx_lp_loan_date ON loan_payments(loan_id, payment_date)")
+            self.db.execute_query("CREATE INDEX IF NOT EXISTS idx_loans_issued ON loans(date_issued)")
         except Exception:
             pass
 
+        # saldos materializados: loans.total_due / total_paid / balance (los mantienen los triggers)
+        try:
+            self.db.execute_query("SELECT balance FROM loans LIMIT 1")
+            migrate = False
+        except Exception:
+            self.db.execute_query("ALTER TABLE loans ADD COLUMN total_due REAL NOT NULL DEFAULT 0")
+            self.db.execute_query("ALTER TABLE loans ADD COLUMN total_paid REAL NOT NULL DEFAULT 0")
+            self.db.execute_query("ALTER TABLE loans ADD COLUMN balance REAL NOT NULL DEFAULT 0")
+            migrate = True
+
+        # plan de cuotas: loans.scheme / installments y tabla loan_installments
+        try:
+            self.db.execute_query("SELECT scheme FROM loans LIMIT 1")
+        except Exception:
+            self.db.execute_query("ALTER TABLE loans ADD COLUMN scheme TEXT NOT NULL DEFAULT 'flat'")
+            self.db.execute_query("ALTER TABLE loans ADD COLUMN installments INTEGER NOT NULL DEFAULT 1")
+        new_installments = not self.db.execute_query(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='loan_installments'"
+        )
+        # intereses devengados por tiempo (ver modules/loans/accrual.py)
+        try:
+            self.db.execute_query("SELECT accrued_interest FROM loans LIMIT 1")
+            new_accrual = False
+        except Exception:
+            self.db.execute_query("ALTER TABLE loans ADD COLUMN accrual_rate REAL NOT NULL DEFAULT 0")
+            self.db.execute_query("ALTER TABLE loans ADD COLUMN accrued_interest REAL NOT NULL DEFAULT 0")
+            self.db.execute_query("ALTER TABLE loans ADD COLUMN accrued_through TEXT")
+            new_accrual = True
+        self.db.execute_query("""
+            CREATE TABLE IF NOT EXISTS loan_interest_accruals (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                loan_id INTEGER NOT NULL,
+                period_start TEXT NOT NULL,
+                period_end TEXT NOT NULL,
+                days INTEGER NOT NULL,
+                base_balance REAL NOT NULL,
+                rate REAL NOT NULL,
+                amount REAL NOT NULL,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (loan_id, period_end),
+                FOREIGN KEY (loan_id) REFERENCES loans (id)
+            )
+        """)
+        self.db.execute_query("""
+            CREATE TABLE IF NOT EXISTS loan_installments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                loan_id INTEGER NOT NULL,
+                number INTEGER NOT NULL,
+                due_date TEXT NOT NULL,
+                principal REAL NOT NULL,
+                interest REAL NOT NULL DEFAULT 0,
+                amount REAL NOT NULL,
+                paid_amount REAL NOT NULL DEFAULT 0,
+                UNIQUE (loan_id, number),
+                FOREIGN KEY (loan_id) REFERENCES loans (id)
+            )
+        """)
+        # "qué vence esta semana": rango sobre las cuotas con saldo
+        self.db.execute_query(
+            "CREATE INDEX IF NOT EXISTS idx_li_open_due ON loan_installments(due_date) WHERE paid_amount < amount"
+        )
+        if new_installments or new_accrual:
+            # cambió la fórmula del total a pagar: regenerar los triggers de saldos
+            for name in self._balance_triggers():
+                self.db.execute_query(f"DROP TRIGGER IF EXISTS {name}")
+
+        for name, sql in self._balance_triggers().items():
+            self.db.execute_query(f"CREATE TRIGGER IF NOT EXISTS {name} {sql}")
+        if migrate:
+            self.rebuild_loan_balances()
+        if new_installments:
+            self.backfill_installments()
+
+        # antigüedad de cartera: se calcula una vez por día y se invalida al cambiar un saldo
+        self.db.execute_query("""
+            CREATE TABLE IF NOT EXISTS loan_aging_cache (
+                as_of TEXT NOT NULL,
+                employee_id INTEGER,
+                employee TEXT NOT NULL,
+                loans INTEGER NOT NULL,
+                current REAL NOT NULL,
+                d1_30 REAL NOT NULL,
+                d31_60 REAL NOT NULL,
+                d61_90 REAL NOT NULL,
+                d90_plus REAL NOT NULL,
+                total REAL NOT NULL,
+                oldest_days INTEGER NOT NULL
+            )
+        """)
+        self.db.execute_query("CREATE INDEX IF NOT EXISTS idx_lac_as_of ON loan_aging_cache(as_of)")
+        for name, sql in {
+            "trg_loan_aging_au": "AFTER UPDATE OF balance, status, employee_id, employee_name ON loans",
+            "trg_loan_aging_ad": "AFTER DELETE ON loans",
+        }.items():
+            self.db.execute_query(
+                f"CREATE TRIGGER IF NOT EXISTS {name} {sql} BEGIN DELETE FROM loan_aging_cache; END")
+
+    @staticmethod
+    def _balance_triggers():
+        """
+        Triggers que mantienen loans.total_due / total_paid / balance al día y reparten
+        lo pagado entre las cuotas (cascada: la cuota más antigua primero)
+        """
+        due = _due_sql("NEW")
+
+        def paid(loan_id, delta):
+            return f"""
+                UPDATE loans
+                   SET total_paid = ROUND(total_paid + {delta}, 2),
+                       balance = ROUND(total_due - (total_paid + {delta}), 2)
+                 WHERE id = {loan_id};
+            """
+
+        def refresh_due(loan_id):
+            return f"""
+                UPDATE loans SET total_due = {_due_sql('loans')}, balance = ROUND({_due_sql('loans')} - total_paid, 2)
+                 WHERE id = {loan_id};
+            """
+        return {
+            "trg_loans_due_ai": f"AFTER INSERT ON loans BEGIN "
+                                f"UPDATE loans SET total_due = {due}, balance = ROUND({due} - total_paid, 2) "
+                                f"WHERE id = NEW.id; END",
+            "trg_loans_due_au": f"AFTER UPDATE OF amount, interest_rate, accrued_interest ON loans BEGIN "
+                                f"UPDATE loans SET total_due = {due}, balance = ROUND({due} - total_paid, 2) "
+                                f"WHERE id = NEW.id; END",
+            "trg_loan_payments_ai": f"AFTER INSERT ON loan_payments BEGIN {paid('NEW.loan_id', 'NEW.amount')} END",
+            "trg_loan_payments_ad": f"AFTER DELETE ON loan_payments BEGIN {paid('OLD.loan_id', '-OLD.amount')} END",
+            "trg_loan_payments_au": (
+                "AFTER UPDATE OF amount, loan_id ON loan_payments BEGIN "
+                f"{paid('OLD.loan_id', '-OLD.amount')} {paid('NEW.loan_id', 'NEW.amount')} END"
+            ),
+            "trg_loan_installments_ai": f"AFTER INSERT ON loan_installments BEGIN {refresh_due('NEW.loan_id')} END",
+            "trg_loan_installments_ad": f"AFTER DELETE ON loan_installments BEGIN {refresh_due('OLD.loan_id')} END",
+            "trg_loans_allocate_au": (
+                "AFTER UPDATE OF total_paid, total_due ON loans BEGIN "
+                f"{_ALLOCATE_SQL.format(paid='NEW.total_paid', where='loan_id = NEW.id')}; END"
+            ),
+        }
+
+    def rebuild_loan_balances(self):
+        """Recalcula los saldos materializados desde loan_payments (migración / reparación)"""
+        with self.db.transaction() as cur:
+            cur.execute("""
+                UPDATE loans
+                   SET total_paid = ROUND((SELECT COALESCE(SUM(amount), 0) FROM loan_payments
+                                            WHERE loan_id = loans.id), 2),
+                       accrued_interest = ROUND((SELECT COALESCE(SUM(amount), 0) FROM loan_interest_accruals
+                                                  WHERE loan_id = loans.id), 2)
+            """)
+            cur.execute(f"UPDATE loans SET total_due = {_due_sql('loans')}")
+            cur.execute("UPDATE loans SET balance = ROUND(total_due - total_paid, 2)")
+            cur.execute(_ALLOCATE_SQL.format(
+                paid="(SELECT total_paid FROM loans WHERE id = loan_installments.loan_id)", where="1=1"))
+
+    def backfill_installments(self):
+        """
+        Préstamos sin plan de cuotas (anteriores a las cuotas): una sola cuota por el total
+        al vencimiento, repartiendo lo ya pagado. Todo en sentencias de conjunto.
+        """
+        with self.db.transaction() as cur:
+            cur.execute("""
+                INSERT INTO loan_installments (loan_id, number, due_date, principal, interest, amount)
+                SELECT l.id, 1, l.due_date, l.amount,
+                       ROUND(l.amount * COALESCE(l.interest_rate, 0) / 100.0, 2),
+                       ROUND(l.amount * (1 + COALESCE(l.interest_rate, 0) / 100.0), 2)
+                  FROM loans l
+                 WHERE NOT EXISTS (SELECT 1 FROM loan_installments li WHERE li.loan_id = l.id)
+            """)
+            cur.execute(_ALLOCATE_SQL.format(
+                paid="(SELECT total_paid FROM loans WHERE id = loan_installments.loan_id)", where="1=1"))
+
+    def check_loan_balances(self, fix=False):
+        """
+        Compara los saldos guardados con los calculados desde los pagos y las cuotas.
+        Devuelve la lista de préstamos con diferencias; con fix=True además los corrige.
+        """
+        rows = self.db.execute_query(f"""
+            SELECT l.id, l.employee_name, l.total_due, l.total_paid, l.balance, l.accrued_interest,
+                   {_due_sql('l')} AS expected_due,
+                   ROUND(COALESCE(p.paid, 0), 2) AS expected_paid,
+                   (SELECT ROUND(COALESCE(SUM(paid_amount), 0), 2) FROM loan_installments
+                     WHERE loan_id = l.id) AS allocated,
+                   (SELECT ROUND(COALESCE(SUM(amount), 0), 2) FROM loan_interest_accruals
+                     WHERE loan_id = l.id) AS expected_accrued
+              FROM loans l
+         LEFT JOIN (SELECT loan_id, SUM(amount) AS paid FROM loan_payments GROUP BY loan_id) p
+                ON p.loan_id = l.id
+        """)
+        issues = []
+        for r in rows or []:
+            d = dict(r)
+            # las cuotas solo absorben hasta su importe; el resto cubre intereses devengados
+            expected_alloc = min(d["expected_paid"], d["expected_due"] - float(d["accrued_interest"] or 0))
+            if (abs(d["total_due"] - d["expected_due"]) > 0.005
+                    or abs(d["total_paid"] - d["expected_paid"]) > 0.005
+                    or abs(d["balance"] - (d["total_due"] - d["total_paid"])) > 0.005
+                    or abs(d["allocated"] - expected_alloc) > 0.005
+                    or abs(float(d["accrued_interest"] or 0) - d["expected_accrued"]) > 0.005):
+                issues.append(d)
+        if issues and fix:
+            self.rebuild_loan_balances()
+            for d in issues:
+                self._update_loan_status(d["id"])
+        return issues
+
     # ------------ Utilidades Empleados (mínimas) ------------
     def add_employee(self, first_name: str, last_name: str, salary: float):
         if not self.auth_manager.has_permission("admin"):
@@ -84,7 +378,8 @@ class LoansController:
     # -------------------- Préstamos --------------------
     def add_loan(self, employee_id: int, amount: float, date_issued: str,
                  due_date: str, interest_rate: float, notes: str,
-                 register_in_cash: bool = True, payment_method: str = "cash"):
+                 register_in_cash: bool = True, payment_method: str = "cash",
+                 scheme: str = "flat", installments: int = 1, accrual_rate: float = 0):
         # solo admin
         if not self.auth_manager.has_permission('admin'):
             raise Exception("Solo los administradores pueden crear préstamos")
@@ -95,49 +390,105 @@ class LoansController:
 
         if float(amount) <= 0:
             raise Exception("El monto debe ser mayor a cero")
-        if float(interest_rate) < 0:
+        if float(interest_rate) < 0 or float(accrual_rate or 0) < 0:
             raise Exception("La tasa de interés no puede ser negativa")
         if due_date <= date_issued:
             raise Exception("La fecha de vencimiento debe ser posterior a la fecha de préstamo")
+        schedule = build_schedule(amount, interest_rate, installments, date_issued, due_date, scheme)
 
         emp_name = self.format_employee_name(emp)
-        loan_id = self.db.execute_query(
-            """
-            INSERT INTO loans (employee_name, amount, date_issued, due_date, interest_rate, notes, user_id, employee_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (emp_name, float(amount), date_issued, due_date, float(interest_rate), (notes or ""),
-             self.auth_manager.current_user, employee_id)
-        )
+        with self.db.transaction():
+            loan_id = self.db.execute_query(
+                """
+                INSERT INTO loans (employee_name, amount, date_issued, due_date, interest_rate, notes, user_id,
+                                   employee_id, scheme, installments, accrual_rate)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (emp_name, float(amount), date_issued, due_date, float(interest_rate), (notes or ""),
+                 self.auth_manager.current_user, employee_id, scheme, int(installments), float(accrual_rate or 0))
+            )
+            self._write_installments(loan_id, schedule)
 
         if register_in_cash:
             self.cash.add_transaction(date_issued, "expense",
                                       f"Préstamo a empleado: {emp_name}",
-                                      float(amount), payment_method, "prestamo_empleado")
+                                      float(amount), payment_method, "prestamo_empleado",
+                                      employee_id=employee_id)
         return loan_id
 
-    def update_loan(self, loan_id, employee_id, amount, date_issued, due_date, interest_rate, notes):
+    def update_loan(self, loan_id, employee_id, amount, date_issued, due_date, interest_rate, notes,
+                    scheme=None, installments=None, accrual_rate=None):
         if not self.auth_manager.has_permission('admin'):
             raise Exception("Solo los administradores pueden editar préstamos")
+        current = self.get_loan_by_id(loan_id)
+        if not current:
+            raise Exception("Préstamo no existe")
+        scheme = scheme or current.get("scheme") or "flat"
+        installments = int(installments or current.get("installments") or 1)
+        accrual_rate = float(current.get("accrual_rate") or 0) if accrual_rate is None else float(accrual_rate)
+        if accrual_rate < 0:
+            raise Exception("La tasa de interés no puede ser negativa")
+        schedule = build_schedule(amount, interest_rate, installments, date_issued, due_date, scheme)
         emp = self.get_employee(employee_id) if employee_id else None
         emp_name = self.format_employee_name(emp) if emp else None
-        self.db.execute_query(
-            """
-            UPDATE loans
-               SET employee_id = COALESCE(?, employee_id),
-                   employee_name = COALESCE(?, employee_name),
-                   amount=?, date_issued=?, due_date=?, interest_rate=?, notes=?
-             WHERE id=?
-            """,
-            (employee_id, emp_name, float(amount), date_issued, due_date, float(interest_rate), (notes or ""), loan_id)
-        )
+        with self.db.transaction():
+            self.db.execute_query(
+                """
+                UPDATE loans
+                   SET employee_id = COALESCE(?, employee_id),
+                       employee_name = COALESCE(?, employee_name),
+                       amount=?, date_issued=?, due_date=?, interest_rate=?, notes=?, scheme=?, installments=?,
+                       accrual_rate=?
+                 WHERE id=?
+                """,
+                (employee_id, emp_name, float(amount), date_issued, due_date, float(interest_rate), (notes or ""),
+                 scheme, installments, accrual_rate, loan_id)
+            )
+            # el plan se regenera; lo ya pagado se vuelve a repartir en cascada (triggers)
+            self.db.execute_query("DELETE FROM loan_installments WHERE loan_id=?", (loan_id,))
+            self._write_installments(loan_id, schedule)
+        self._update_loan_status(loan_id)
         return True
 
+    def _write_installments(self, loan_id, schedule):
+        with self.db.transaction() as cur:
+            cur.executemany(
+                """INSERT INTO loan_installments (loan_id, number, due_date, principal, interest, amount)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                [(loan_id, c["number"], c["due_date"], c["principal"], c["interest"], c["amount"])
+                 for c in schedule]
+            )
+
+    def regenerate_installments(self, loan_ids=None):
+        """
+        Regenera en lote el plan de cuotas de los préstamos indicados (o de todos):
+        calcula todas las cuotas en memoria y las escribe con un solo executemany.
+        """
+        q = "SELECT id, amount, interest_rate, installments, date_issued, due_date, scheme FROM loans"
+        p = []
+        if loan_ids:
+            q += f" WHERE id IN ({','.join('?' * len(loan_ids))})"
+            p = [int(x) for x in loan_ids]
+        loans = [dict(r) for r in self.db.execute_query(q, p) or []]
+        rows = build_schedules(loans)
+        with self.db.transaction() as cur:
+            if loan_ids:
+                cur.execute(f"DELETE FROM loan_installments WHERE loan_id IN ({','.join('?' * len(p))})", p)
+            else:
+                cur.execute("DELETE FROM loan_installments")
+            cur.executemany(
+                """INSERT INTO loan_installments (loan_id, number, due_date, principal, interest, amount)
+                   VALUES (?, ?, ?, ?, ?, ?)""", rows)
+        return len(rows)
+
     def delete_loan(self, loan_id):
         if not self.auth_manager.has_permission('admin'):
             raise Exception("Solo los administradores pueden eliminar préstamos")
-        self.db.execute_query("DELETE FROM loan_payments WHERE loan_id=?", (loan_id,))
-        self.db.execute_query("DELETE FROM loans WHERE id=?", (loan_id,))
+        with self.db.transaction():
+            self.db.execute_query("DELETE FROM loan_payments WHERE loan_id=?", (loan_id,))
+            self.db.execute_query("DELETE FROM loan_installments WHERE loan_id=?", (loan_id,))
+            self.db.execute_query("DELETE FROM loan_interest_accruals WHERE loan_id=?", (loan_id,))
+            self.db.execute_query("DELETE FROM loans WHERE id=?", (loan_id,))
         return True
 
     def get_loans(self, status_filter=None, employee_filter=None, employee_id=None):
@@ -152,8 +503,16 @@ class LoansController:
         if status_filter:
             q += " AND l.status = ?"; p.append(status_filter)
         if employee_filter:
-            q += " AND (l.employee_name LIKE ? OR (e.first_name || ' ' || e.last_name) LIKE ?)"
-            like = f"%{employee_filter}%"; p.extend([like, like])
+            # nombre guardado en el préstamo: índice FTS (prefijos); empleado vinculado: tabla chica, LIKE
+            like = f"%{employee_filter}%"
+            expr = build_match(employee_filter) if self.search.available else None
+            if expr is None:
+                q += " AND (l.employee_name LIKE ? OR (e.first_name || ' ' || e.last_name) LIKE ?)"
+                p.extend([like, like])
+            else:
+                q += (" AND (l.id IN (SELECT rowid FROM loans_fts WHERE loans_fts MATCH ?)"
+                      " OR (e.first_name || ' ' || e.last_name) LIKE ?)")
+                p.extend([expr, like])
         if employee_id:
             q += " AND l.employee_id = ?"; p.append(employee_id)
         q += " ORDER BY l.date_issued DESC, l.created_at DESC"
@@ -207,7 +566,8 @@ class LoansController:
             emp_name = loan.get("employee_display") if loan else "Empleado"
             self.cash.add_transaction(payment_date, "income",
                                       f"Pago préstamo {emp_name}",
-                                      float(amount), payment_method, "prestamo_empleado")
+                                      float(amount), payment_method, "prestamo_empleado",
+                                      employee_id=loan.get("employee_id") if loan else None)
 
         self._update_loan_status(loan_id)
         return pay_id
@@ -233,6 +593,85 @@ class LoansController:
             self._update_loan_status(p['loan_id'])
         return True
 
+    def plan_allocation(self, employee_id, amount, strategy="oldest"):
+        """
+        Reparte amount entre los préstamos con saldo del empleado sin escribir nada.
+        Devuelve [{'loan_id', 'balance', 'applied'}] (solo préstamos con monto aplicado).
+        """
+        if strategy not in ALLOCATION_STRATEGIES:
+            raise ValueError(f"Criterio de reparto desconocido: {strategy}")
+        amount = round(float(amount), 2)
+        if amount <= 0:
+            raise Exception("El monto del pago debe ser mayor a cero")
+        order = ("interest_rate DESC, date_issued, id" if strategy == "highest_interest"
+                 else "date_issued, id")
+        rows = self.db.execute_query(
+            f"SELECT id, balance FROM loans WHERE employee_id=? AND balance > 0 ORDER BY {order}",
+            (employee_id,))
+        loans = [(int(r["id"]), round(float(r["balance"]), 2)) for r in rows or []]
+        total = round(sum(b for _, b in loans), 2)
+        if not loans:
+            raise Exception("El empleado no tiene préstamos con saldo pendiente")
+        if amount > total + 0.005:
+            raise Exception(f"El monto (${amount:,.2f}) supera el saldo pendiente (${total:,.2f})")
+
+        if strategy == "pro_rata":
+            applied = [min(b, round(amount * b / total, 2)) for _, b in loans]
+            # los centavos del redondeo van a los primeros préstamos que aún tengan saldo
+            diff = round(amount - sum(applied), 2)
+            for i, (_, b) in enumerate(loans):
+                if abs(diff) < 0.005:
+                    break
+                step = max(-applied[i], min(diff, b - applied[i]))
+                applied[i] = round(applied[i] + step, 2)
+                diff = round(diff - step, 2)
+        else:
+            applied, remaining = [], amount
+            for _, b in loans:
+                pay = round(min(remaining, b), 2)
+                applied.append(pay)
+                remaining = round(remaining - pay, 2)
+
+        return [{"loan_id": lid, "balance": b, "applied": a}
+                for (lid, b), a in zip(loans, applied) if a > 0]
+
+    def allocate_payment(self, employee_id, amount, strategy="oldest", payment_date=None, notes="",
+                         register_in_cash=True, payment_method="cash", is_payroll_deduction=False):
+        """
+        Abono de un empleado repartido entre sus préstamos abiertos según strategy
+        ('oldest', 'highest_interest' o 'pro_rata'). Todos los pagos, los estados y un único
+        movimiento de caja se graban en una sola transacción. Devuelve el detalle del reparto.
+        """
+        if not self.auth_manager.current_user:
+            raise Exception("Usuario no autenticado")
+        emp = self.get_employee(employee_id)
+        if not emp:
+            raise Exception("Empleado no existe")
+        payment_date = payment_date or datetime.now().strftime('%Y-%m-%d')
+        plan = self.plan_allocation(employee_id, amount, strategy)
+        total = round(sum(x["applied"] for x in plan), 2)
+
+        with self.db.transaction() as cur:
+            cur.executemany(
+                """
+                INSERT INTO loan_payments (loan_id, payment_date, amount, notes, user_id, is_payroll_deduction)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [(x["loan_id"], payment_date, x["applied"], (notes or ""), self.auth_manager.current_user,
+                  1 if is_payroll_deduction else 0) for x in plan]
+            )
+            self.refresh_loan_statuses([x["loan_id"] for x in plan])
+            if register_in_cash:
+                self.cash.add_transaction(payment_date, "income",
+                                          f"Pago préstamos {self.format_employee_name(emp)} ({len(plan)})",
+                                          total, payment_method, "prestamo_empleado",
+                                          employee_id=employee_id)
+
+        for x in plan:
+            x["new_balance"] = round(x["balance"] - x["applied"], 2)
+        return {"employee": self.format_employee_name(emp), "strategy": strategy,
+                "total_applied": total, "applied": plan}
+
     def get_payment_by_id(self, payment_id):
         r = self.db.execute_query("SELECT * FROM loan_payments WHERE id=?", (payment_id,))
         return dict(r[0]) if r else None
@@ -247,35 +686,95 @@ class LoansController:
             (loan_id,))
         return [dict(x) for x in r] if r else []
 
+    # -------------------- Cuotas --------------------
+    def get_installments(self, loan_id):
+        r = self.db.execute_query(
+            """SELECT *, ROUND(amount - paid_amount, 2) AS pending
+                 FROM loan_installments WHERE loan_id=? ORDER BY number""", (loan_id,))
+        return [dict(x) for x in r] if r else []
+
+    def get_installments_due(self, start_date, end_date, employee_id=None):
+        """
+        Cuotas con saldo que vencen entre start_date y end_date (todas las anteriores
+        pendientes si start_date es None), de todos los empleados o de uno.
+        """
+        q = """
+        SELECT li.*, ROUND(li.amount - li.paid_amount, 2) AS pending,
+               l.employee_id, l.employee_name, e.first_name, e.last_name
+          FROM loan_installments li
+          JOIN loans l ON l.id = li.loan_id
+     LEFT JOIN employees e ON e.id = l.employee_id
+         WHERE li.paid_amount < li.amount AND li.due_date <= ?
+        """
+        p = [end_date]
+        if start_date:
+            q += " AND li.due_date >= ?"; p.append(start_date)
+        if employee_id:
+            q += " AND l.employee_id = ?"; p.append(employee_id)
+        q += " ORDER BY li.due_date, li.loan_id, li.number"
+        rows = self.db.execute_query(q, p)
+        return [self._with_employee_display(dict(r)) for r in rows or []]
+
     # -------------------- Resúmenes / Estados --------------------
-    def get_loan_summary(self, loan_id):
+    def get_loan_summary(self, loan_id, with_payments=True):
+        """Saldo del préstamo desde las columnas materializadas (los pagos solo si se piden)"""
         loan = self.get_loan_by_id(loan_id)
         if not loan:
             return None
-        pays = self.get_loan_payments(loan_id)
-        total_paid = sum(float(p['amount']) for p in pays)
-        principal = float(loan['amount'])
-        total_due = principal * (1 + float(loan['interest_rate'])/100) if float(loan['interest_rate']) > 0 else principal
-        balance = total_due - total_paid
+        balance = float(loan['balance'])
         due_date = datetime.strptime(loan['due_date'], '%Y-%m-%d').date()
         is_overdue = balance > 0 and due_date < datetime.now().date()
-        return {'loan': loan, 'total_paid': total_paid, 'total_due': total_due,
-                'balance': balance, 'is_overdue': is_overdue, 'payments': pays}
+        return {'loan': loan, 'total_paid': float(loan['total_paid']), 'total_due': float(loan['total_due']),
+                'balance': balance, 'is_overdue': is_overdue,
+                'payments': self.get_loan_payments(loan_id) if with_payments else []}
+
+    def get_loan_balance(self, loan_id):
+        """Saldo pendiente: una lectura por clave primaria"""
+        r = self.db.execute_query("SELECT balance FROM loans WHERE id=?", (loan_id,))
+        return float(r[0]["balance"]) if r else 0.0
 
     def _update_loan_status(self, loan_id):
-        s = self.get_loan_summary(loan_id)
-        if not s:
-            return
-        new_status = 'active'
-        if s['balance'] <= 0:
-            new_status = 'paid'
-        elif s['is_overdue']:
-            new_status = 'overdue'
-        self.db.execute_query("UPDATE loans SET status=? WHERE id=?", (new_status, loan_id))
+        self.refresh_loan_statuses([loan_id])
+
+    def refresh_loan_statuses(self, loan_ids, today=None):
+        """
+        Recalcula el estado (active / overdue / paid) de los préstamos indicados tras cambiar
+        sus pagos; se integra en la transacción abierta. Para todos los préstamos: sweep_loan_statuses.
+        """
+        ids = sorted({int(i) for i in loan_ids})
+        today = today or datetime.now().strftime('%Y-%m-%d')
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            params = {f"id{i}": v for i, v in enumerate(chunk)}
+            params["today"] = today
+            self.db.execute_query(f"UPDATE loans SET status = {_STATUS_CASE} "
+                                  f"WHERE id IN ({', '.join(':id' + str(i) for i in range(len(chunk)))})",
+                                  params)
+
+    def sweep_loan_statuses(self, today=None):
+        """
+        Recalcula el estado de todos los préstamos con un solo UPDATE sobre los saldos
+        materializados (los que vencieron sin movimientos pasan a 'overdue').
+        Devuelve {'changed': filas modificadas, 'ms': duración}.
+        """
+        today = today or datetime.now().strftime('%Y-%m-%d')
+        t0 = time.perf_counter()
+        with self.db.transaction() as cur:
+            cur.execute(f"""
+                UPDATE loans
+                   SET status = {_STATUS_CASE}
+                 WHERE status IS NOT {_STATUS_CASE}
+            """, {"today": today})
+            changed = cur.rowcount
+        ms = (time.perf_counter() - t0) * 1000.0
+        print(f"[LoansController] Estados de préstamos al {today}: {changed} actualizado(s) en {ms:.1f} ms")
+        return {"changed": changed, "ms": ms}
 
     def get_overdue_loans(self):
         r = self.db.execute_query(
-            """SELECT l.*, e.first_name, e.last_name
+            f"""SELECT l.*, e.first_name, e.last_name,
+                      CAST(julianday(date('now', 'localtime')) - julianday({_oldest_open_due_sql('l')})
+                           AS INTEGER) AS days_overdue
                  FROM loans l
             LEFT JOIN employees e ON e.id = l.employee_id
                 WHERE l.status='overdue'
@@ -288,6 +787,92 @@ class LoansController:
             out.append(d)
         return out
 
+    def get_aging_report(self, as_of=None, refresh=False):
+        """
+        Antigüedad de la cartera de préstamos por empleado: saldo pendiente repartido según
+        los días de atraso de la cuota impaga más antigua (al día, 1-30, 31-60, 61-90, 90+).
+        Para hoy (o una fecha futura) se calcula en una sola consulta sobre los saldos
+        materializados; el de hoy queda guardado (los triggers de loans vacían la caché cuando
+        cambia un saldo). Una fecha pasada se reconstruye con los pagos e intereses hasta esa
+        fecha y no se guarda.
+        """
+        today = datetime.now().strftime('%Y-%m-%d')
+        as_of = as_of or today
+        if as_of < today:
+            src = f"""
+                SELECT h.employee_id, h.employee, ROUND(h.due - h.paid, 2) AS balance,
+                       CAST(julianday(:as_of) - julianday(COALESCE(
+                           (SELECT MIN(li.due_date) FROM loan_installments li
+                             WHERE li.loan_id = h.id
+                               AND (SELECT SUM(p.amount) FROM loan_installments p
+                                     WHERE p.loan_id = li.loan_id AND p.number <= li.number) > h.paid + 0.005),
+                           h.due_date)) AS INTEGER) AS days
+                  FROM (SELECT l.id, l.employee_id, l.due_date,
+                               COALESCE(e.first_name || ' ' || e.last_name, l.employee_name, '—') AS employee,
+                               COALESCE((SELECT SUM(amount) FROM loan_installments WHERE loan_id = l.id),
+                                        l.amount * (1 + COALESCE(l.interest_rate, 0) / 100.0))
+                               + COALESCE((SELECT SUM(a.amount) FROM loan_interest_accruals a
+                                            WHERE a.loan_id = l.id AND a.period_end <= :as_of), 0) AS due,
+                               COALESCE((SELECT SUM(p.amount) FROM loan_payments p
+                                          WHERE p.loan_id = l.id AND p.payment_date <= :as_of), 0) AS paid
+                          FROM loans l
+                     LEFT JOIN employees e ON e.id = l.employee_id
+                         WHERE l.date_issued <= :as_of) h
+                 WHERE h.due - h.paid > 0.005
+            """
+        else:
+            src = f"""
+                SELECT l.employee_id, l.balance,
+                       COALESCE(e.first_name || ' ' || e.last_name, l.employee_name, '—') AS employee,
+                       CAST(julianday(:as_of) - julianday({_oldest_open_due_sql('l')}) AS INTEGER) AS days
+                  FROM loans l
+             LEFT JOIN employees e ON e.id = l.employee_id
+                 WHERE l.balance > 0
+            """
+        aging = f"""
+            SELECT :as_of AS as_of, employee_id, employee, COUNT(*) AS loans,
+                   ROUND(SUM(CASE WHEN days <= 0 THEN balance ELSE 0 END), 2) AS current,
+                   ROUND(SUM(CASE WHEN days BETWEEN 1 AND 30 THEN balance ELSE 0 END), 2) AS d1_30,
+                   ROUND(SUM(CASE WHEN days BETWEEN 31 AND 60 THEN balance ELSE 0 END), 2) AS d31_60,
+                   ROUND(SUM(CASE WHEN days BETWEEN 61 AND 90 THEN balance ELSE 0 END), 2) AS d61_90,
+                   ROUND(SUM(CASE WHEN days > 90 THEN balance ELSE 0 END), 2) AS d90_plus,
+                   ROUND(SUM(balance), 2) AS total,
+                   MAX(MAX(days, 0)) AS oldest_days
+              FROM ({src})
+          GROUP BY COALESCE(employee_id, -1), employee
+        """
+        if as_of != today:
+            rows = self.db.execute_query(aging + " ORDER BY total DESC, employee", {"as_of": as_of})
+            return [dict(r) for r in rows] if rows else []
+
+        rows = None if refresh else self.db.execute_query(
+            "SELECT * FROM loan_aging_cache WHERE as_of=? ORDER BY total DESC, employee", (as_of,))
+        if not rows:
+            with self.db.transaction() as cur:
+                cur.execute("DELETE FROM loan_aging_cache")  # solo se guarda el de hoy
+                cur.execute(f"""
+                    INSERT INTO loan_aging_cache (as_of, employee_id, employee, loans, current, d1_30, d31_60,
+                                                  d61_90, d90_plus, total, oldest_days)
+                    {aging}
+                """, {"as_of": as_of})
+            rows = self.db.execute_query(
+                "SELECT * FROM loan_aging_cache WHERE as_of=? ORDER BY total DESC, employee", (as_of,))
+        return [dict(r) for r in rows] if rows else []
+
+    def export_aging_report(self, path, as_of=None, progress=None, cancel_event=None):
+        """Antigüedad de cartera a CSV / CSV.GZ / XLSX (según la extensión de path)."""
+        rows = self.get_aging_report(as_of)
+        return export_rows(
+            path,
+            ["Empleado", "Préstamos", "Al día", "1-30 días", "31-60 días", "61-90 días", "90+ días",
+             "Total", "Máx. días de atraso"],
+            [rows],
+            row_mapper=lambda d: [d["employee"], d["loans"], d["current"], d["d1_30"], d["d31_60"],
+                                  d["d61_90"], d["d90_plus"], d["total"], d["oldest_days"]],
+            sheet_title="Antigüedad préstamos",
+            total_rows=len(rows), progress=progress, cancel_event=cancel_event,
+        )
+
     # -------------------- Nómina (pago con deducción) --------------------
     def process_payroll_payment(self, employee_id: int, date: str,
                                 payment_method: str = "cash", register_in_cash: bool = True):
@@ -302,43 +887,40 @@ class LoansController:
         if gross <= 0:
             raise Exception("El salario configurado para el empleado es 0")
 
-        # préstamos con saldo
-        loans = self.get_loans(employee_id=employee_id)
-        loans_with_balance = []
-        for L in loans:
-            s = self.get_loan_summary(L['id'])
-            if s and s['balance'] > 0:
-                loans_with_balance.append((L, s['balance']))
-        loans_with_balance.sort(key=lambda t: t[0]['date_issued'])
+        # préstamos con saldo: deducción en cascada (más antiguo primero) hasta el salario
+        rows = self.db.execute_query(
+            "SELECT COALESCE(SUM(balance), 0) AS open FROM loans WHERE employee_id=? AND balance > 0",
+            (employee_id,))
+        to_deduct = round(min(gross, float(rows[0]["open"]) if rows else 0.0), 2)
 
-        remaining = gross
         total_deducted = 0.0
         breakdown = []
+        with self.db.transaction():
+            self.ensure_period_unpaid(employee_id, date[:7])
+            if to_deduct > 0:
+                # Registrar como deducción de nómina (no impacta caja directamente aquí)
+                res = self.allocate_payment(employee_id, to_deduct, "oldest", payment_date=date,
+                                            notes="Deducción de nómina", register_in_cash=False,
+                                            is_payroll_deduction=True)
+                total_deducted = res["total_applied"]
+                breakdown = [{"loan_id": x["loan_id"], "applied": x["applied"]} for x in res["applied"]]
 
-        for loan, bal in loans_with_balance:
-            if remaining <= 0:
-                break
-            pay = min(remaining, bal)
-            # Registrar como deducción de nómina (no impacta caja directamente aquí)
-            self.add_payment(loan_id=loan['id'], payment_date=date, amount=pay,
-                             notes="Deducción de nómina", register_in_cash=False,
-                             is_payroll_deduction=True)
-            remaining -= pay
-            total_deducted += pay
-            breakdown.append({"loan_id": loan['id'], "applied": pay})
-
-        net = gross - total_deducted
+            net = gross - total_deducted
 
-        if register_in_cash:
-            emp_name = self.format_employee_name(emp)
-            if total_deducted > 0:
-                self.cash.add_transaction(date, "income",
-                                          f"Deducción préstamo vía nómina: {emp_name}",
-                                          round(total_deducted, 2), payment_method, "nomina_deduccion_prestamo")
-            if net > 0:
-                self.cash.add_transaction(date, "expense",
-                                          f"Pago de salario: {emp_name}",
-                                          round(net, 2), payment_method, "nomina_pago")
+            if register_in_cash:
+                emp_name = self.format_employee_name(emp)
+                if total_deducted > 0:
+                    self.cash.add_transaction(date, "income",
+                                              f"Deducción préstamo vía nómina: {emp_name}",
+                                              round(total_deducted, 2), payment_method, "nomina_deduccion_prestamo",
+                                              employee_id=employee_id)
+                if net > 0:
+                    self.cash.add_transaction(date, "expense",
+                                              f"Pago de salario: {emp_name}",
+                                              round(net, 2), payment_method, "nomina_pago",
+                                              employee_id=employee_id)
+            self.record_payroll_history(employee_id, date, gross, total_deducted, net,
+                                        payment_method, register_in_cash)
 
         return {"employee": self.format_employee_name(emp),
                 "gross_salary": round(gross, 2),
@@ -346,17 +928,52 @@ class LoansController:
                 "net_paid": round(net, 2),
                 "applied": breakdown}
 
+    def is_period_paid(self, employee_id, period):
+        """True si el empleado ya tiene un pago de nómina registrado en el período ('YYYY-MM')."""
+        return bool(self.db.execute_query(
+            "SELECT 1 FROM payroll_history WHERE period = ? AND employee_id = ? LIMIT 1", (period, employee_id)))
+
+    def ensure_period_unpaid(self, employee_id, period):
+        """
+        La nómina se paga una sola vez por empleado y mes (payroll_history tiene un índice único
+        por período y empleado). Si el mes ya está pagado lanza un error que lo explica, antes
+        de escribir nada; los adelantos o pagos quincenales se registran como préstamo.
+        """
+        rows = self.db.execute_query(
+            "SELECT pay_date, net_paid FROM payroll_history WHERE period = ? AND employee_id = ? "
+            "ORDER BY pay_date LIMIT 1", (period, employee_id))
+        if rows:
+            raise Exception(
+                f"La nómina de {period} ya está pagada para este empleado "
+                f"(pago del {rows[0]['pay_date']}, neto ${float(rows[0]['net_paid'] or 0):,.2f}).\n\n"
+                "Se registra un solo pago de nómina por empleado y mes. Los adelantos o pagos "
+                "quincenales se registran como préstamo al empleado y se descuentan en la nómina.")
+
+    def record_payroll_history(self, employee_id, pay_date, gross, deducted, net, payment_method,
+                               registered_in_cash, period=None):
+        """Guarda un pago de salario en payroll_history (período = mes de pay_date si no se indica)."""
+        return self.db.execute_query("""
+            INSERT INTO payroll_history (employee_id, pay_date, gross_salary, total_deducted, net_paid,
+                                         payment_method, registered_in_cash, user_id, period)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (employee_id, pay_date, round(float(gross), 2), round(float(deducted), 2), round(float(net), 2),
+              payment_method, 1 if registered_in_cash else 0,
+              self.auth_manager.current_user if self.auth_manager else None, period or pay_date[:7]))
+
     # -------------------- Reporte de préstamos --------------------
     def get_loans_report(self, start_date=None, end_date=None, status_filter=None):
-        q = """
-        SELECT l.*, e.first_name, e.last_name,
-               (SELECT COALESCE(SUM(amount),0) FROM loan_payments WHERE loan_id=l.id) AS total_paid,
-               (l.amount * (1 + l.interest_rate/100.0)) -
-               (SELECT COALESCE(SUM(amount),0) FROM loan_payments WHERE loan_id=l.id) AS balance
-          FROM loans l
-     LEFT JOIN employees e ON e.id = l.employee_id
-         WHERE 1=1
-        """
+        q, p = self._loans_report_query(start_date, end_date, status_filter)
+        rows = self.db.execute_query(q, p)
+        return [self._with_employee_display(dict(r)) for r in rows or []]
+
+    def iter_loans_report(self, start_date=None, end_date=None, status_filter=None, chunk_size=500):
+        """Mismo resultado que get_loans_report, entregado por bloques (para exportaciones)."""
+        q, p = self._loans_report_query(start_date, end_date, status_filter)
+        for chunk in self.db.stream_query(q, p, chunk_size):
+            yield [self._with_employee_display(d) for d in chunk]
+
+    def count_loans_report(self, start_date=None, end_date=None, status_filter=None):
+        q = "SELECT COUNT(*) FROM loans l WHERE 1=1"
         p = []
         if start_date:
             q += " AND l.date_issued>=?"; p.append(start_date)
@@ -364,13 +981,54 @@ class LoansController:
             q += " AND l.date_issued<=?"; p.append(end_date)
         if status_filter:
             q += " AND l.status=?"; p.append(status_filter)
-        q += " ORDER BY l.date_issued DESC"
-
         rows = self.db.execute_query(q, p)
-        data = []
-        for r in rows or []:
-            d = dict(r)
-            d["employee_display"] = (f"{d.get('first_name','')} {d.get('last_name','')}".strip()
-                                     if d.get("first_name") else (d.get("employee_name") or "—"))
-            data.append(d)
-        return data
+        return int(rows[0][0]) if rows else 0
+
+    def export_loans_report(self, path, start_date=None, end_date=None, status_filter=None,
+                            progress=None, cancel_event=None):
+        """Reporte de préstamos a CSV / CSV.GZ / XLSX (según la extensión de path), por bloques."""
+        return export_rows(
+            path,
+            ["ID", "Empleado", "Fecha", "Vence", "Monto", "Interés %", "Total pagado", "Saldo", "Estado", "Notas"],
+            self.iter_loans_report(start_date, end_date, status_filter, chunk_size=1000),
+            row_mapper=lambda d: [d["id"], d["employee_display"], d["date_issued"], d["due_date"],
+                                  float(d["amount"]), float(d["interest_rate"] or 0),
+                                  round(float(d["total_paid"] or 0), 2), round(float(d["balance"] or 0), 2),
+                                  d["status"], d.get("notes") or ""],
+            sheet_title="Préstamos",
+            total_rows=self.count_loans_report(start_date, end_date, status_filter),
+            progress=progress, cancel_event=cancel_event,
+        )
+
+    def _loans_report_query(self, start_date, end_date, status_filter):
+        """
+        Préstamos del filtro con los saldos materializados (loans.total_paid / balance, los
+        mantienen los triggers): el reporte no vuelve a sumar loan_payments y siempre coincide
+        con el listado de préstamos.
+        """
+        where, p = ["1=1"], []
+        if start_date:
+            where.append("l.date_issued>=?"); p.append(start_date)
+        if end_date:
+            where.append("l.date_issued<=?"); p.append(end_date)
+        if status_filter:
+            where.append("l.status=?"); p.append(status_filter)
+        q = f"""
+        SELECT l.id, l.employee_id, l.employee_name, l.amount, l.date_issued, l.due_date,
+               l.interest_rate, l.status, l.notes, l.user_id, l.created_at,
+               l.scheme, l.installments, l.total_due,
+               e.first_name, e.last_name,
+               ROUND(l.total_paid, 2) AS total_paid,
+               ROUND(l.balance, 2) AS balance
+          FROM loans l
+     LEFT JOIN employees e ON e.id = l.employee_id
+         WHERE {" AND ".join(where)}
+      ORDER BY l.date_issued DESC
+        """
+        return q, p
+
+    @staticmethod
+    def _with_employee_display(d):
+        d["employee_display"] = (f"{d.get('first_name','')} {d.get('last_name','')}".strip()
+                                 if d.get("first_name") else (d.get("employee_name") or "—"))
+        return d
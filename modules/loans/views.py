@@ -14,9 +14,16 @@ from tkinter import ttk, messagebox
 from tkcalendar import DateEntry
 from datetime import datetime, timedelta
 
-from modules.loans.controller import LoansController
+from modules.loans.controller import LoansController, ALLOCATION_STRATEGIES
+from modules.loans.amortization import SCHEMES
+from utils.report_export import write_table_pdf, run_in_background, reportlab_available
 
 PAY_TO_CODE = {"Efectivo": "cash", "Transferencia": "transfer"}
+SCHEME_TO_CODE = {label: code for code, label in SCHEMES.items()}
+STRATEGY_TO_CODE = {label: code for code, label in ALLOCATION_STRATEGIES.items()}
+AGING_BUCKETS = (("current", "Al día"), ("d1_30", "1-30 días"), ("d31_60", "31-60 días"),
+                 ("d61_90", "61-90 días"), ("d90_plus", "90+ días"))
+AGING_COLORS = ("#4caf50", "#ffc107", "#ff9800", "#f44336", "#8b0000")
 
 
 class LoansView:
@@ -90,21 +97,36 @@ class LoansView:
         self.interest_entry.insert(0, "0")
         self.interest_entry.grid(row=4, column=1, sticky=tk.EW, pady=2, padx=(5, 0))
 
-        ttk.Label(loan_frame, text="Notas:").grid(row=5, column=0, sticky=tk.W, pady=2)
+        ttk.Label(loan_frame, text="Amortización:").grid(row=5, column=0, sticky=tk.W, pady=2)
+        self.scheme_cb = ttk.Combobox(loan_frame, state="readonly", values=tuple(SCHEME_TO_CODE.keys()), width=26)
+        self.scheme_cb.set(SCHEMES["flat"])
+        self.scheme_cb.grid(row=5, column=1, sticky=tk.EW, pady=2, padx=(5, 0))
+
+        ttk.Label(loan_frame, text="Cuotas:").grid(row=6, column=0, sticky=tk.W, pady=2)
+        self.installments_sb = ttk.Spinbox(loan_frame, from_=1, to=120, width=6)
+        self.installments_sb.set(1)
+        self.installments_sb.grid(row=6, column=1, sticky=tk.W, pady=2, padx=(5, 0))
+
+        ttk.Label(loan_frame, text="Interés anual (%):").grid(row=7, column=0, sticky=tk.W, pady=2)
+        self.accrual_entry = ttk.Entry(loan_frame)
+        self.accrual_entry.insert(0, "0")
+        self.accrual_entry.grid(row=7, column=1, sticky=tk.EW, pady=2, padx=(5, 0))
+
+        ttk.Label(loan_frame, text="Notas:").grid(row=8, column=0, sticky=tk.W, pady=2)
         self.notes_entry = ttk.Entry(loan_frame)
-        self.notes_entry.grid(row=5, column=1, sticky=tk.EW, pady=2, padx=(5, 0))
+        self.notes_entry.grid(row=8, column=1, sticky=tk.EW, pady=2, padx=(5, 0))
 
         # caja en préstamo
         self.loan_register_cash = tk.BooleanVar(value=True)
-        ttk.Checkbutton(loan_frame, text="Registrar en Caja", variable=self.loan_register_cash).grid(row=6, column=0, columnspan=2, sticky=tk.W, pady=(4, 0))
+        ttk.Checkbutton(loan_frame, text="Registrar en Caja", variable=self.loan_register_cash).grid(row=9, column=0, columnspan=2, sticky=tk.W, pady=(4, 0))
 
-        ttk.Label(loan_frame, text="Método pago:").grid(row=7, column=0, sticky=tk.W, pady=2)
+        ttk.Label(loan_frame, text="Método pago:").grid(row=10, column=0, sticky=tk.W, pady=2)
         self.loan_pay_method = ttk.Combobox(loan_frame, state="readonly", values=tuple(PAY_TO_CODE.keys()), width=18)
         self.loan_pay_method.set("Efectivo")
-        self.loan_pay_method.grid(row=7, column=1, sticky=tk.EW, pady=2, padx=(5, 0))
+        self.loan_pay_method.grid(row=10, column=1, sticky=tk.EW, pady=2, padx=(5, 0))
 
         btns = ttk.Frame(loan_frame)
-        btns.grid(row=8, column=0, columnspan=2, pady=8)
+        btns.grid(row=11, column=0, columnspan=2, pady=8)
         ttk.Button(
             btns, text="Agregar", command=self.add_loan,
             state=("normal" if self.auth_manager.has_permission('admin') else "disabled")
@@ -135,6 +157,8 @@ class LoansView:
         ttk.Checkbutton(payroll, text="Registrar en Caja", variable=self.payroll_register_cash).grid(row=3, column=0, columnspan=2, sticky=tk.W, pady=(2, 0))
 
         ttk.Button(payroll, text="Pagar salario", command=self.pay_salary).grid(row=4, column=0, columnspan=2, pady=8)
+        ttk.Label(payroll, text="Un pago de nómina por empleado y mes. Adelantos o quincenas: regístrelos como préstamo.",
+                  foreground="#666666", wraplength=260).grid(row=5, column=0, columnspan=2, sticky=tk.W)
 
         payroll.columnconfigure(1, weight=1)
 
@@ -169,14 +193,21 @@ class LoansView:
         if self.auth_manager.has_permission('admin'):
             ttk.Button(action, text="Editar", command=self.edit_loan).pack(side=tk.LEFT, padx=5)
             ttk.Button(action, text="Eliminar", command=self.delete_loan).pack(side=tk.LEFT, padx=5)
+            ttk.Button(action, text="Verificar saldos", command=self.check_balances).pack(side=tk.RIGHT, padx=5)
 
         ttk.Button(action, text="Ver Detalles", command=self.show_loan_details).pack(side=tk.LEFT, padx=5)
         ttk.Button(
             action, text="Registrar Pago", command=self.show_payment_dialog,
             state=("normal" if self.auth_manager.has_permission('admin') else "disabled")
         ).pack(side=tk.LEFT, padx=5)
+        ttk.Button(
+            action, text="Abono múltiple", command=self.show_allocation_dialog,
+            state=("normal" if self.auth_manager.has_permission('admin') else "disabled")
+        ).pack(side=tk.LEFT, padx=5)
         ttk.Button(action, text="Actualizar", command=self.load_loans).pack(side=tk.RIGHT, padx=5)
         ttk.Button(action, text="Reporte", command=self.show_report).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(action, text="Cuotas por vencer", command=self.show_installments_due).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(action, text="Antigüedad", command=self.show_aging_report).pack(side=tk.RIGHT, padx=5)
 
         self.loans_tree.bind('<Double-1>', self.on_loan_double_click)
 
@@ -278,6 +309,9 @@ class LoansView:
         self.date_issued_entry.set_date(datetime.now())
         self.due_date_entry.set_date(datetime.now() + timedelta(days=30))
         self.interest_entry.delete(0, tk.END); self.interest_entry.insert(0, "0")
+        self.scheme_cb.set(SCHEMES["flat"])
+        self.installments_sb.set(1)
+        self.accrual_entry.delete(0, tk.END); self.accrual_entry.insert(0, "0")
         self.notes_entry.delete(0, tk.END)
         if self.employee_cb['values']:
             self.employee_cb.set(self.employee_cb['values'][0])
@@ -294,18 +328,43 @@ class LoansView:
             date_issued = self.date_issued_entry.get_date().strftime('%Y-%m-%d')
             due_date = self.due_date_entry.get_date().strftime('%Y-%m-%d')
             interest = float(self.interest_entry.get() or "0")
+            scheme = SCHEME_TO_CODE[self.scheme_cb.get()]
+            installments = int(self.installments_sb.get() or "1")
+            accrual = float(self.accrual_entry.get() or "0")
             notes = self.notes_entry.get()
             reg_cash = self.loan_register_cash.get()
             pay_method = PAY_TO_CODE[self.loan_pay_method.get()]
 
             self.controller.add_loan(emp_id, amount, date_issued, due_date, interest, notes,
-                                     register_in_cash=reg_cash, payment_method=pay_method)
+                                     register_in_cash=reg_cash, payment_method=pay_method,
+                                     scheme=scheme, installments=installments, accrual_rate=accrual)
             messagebox.showinfo("Préstamo", "Préstamo agregado correctamente.")
             self.clear_loan_form()
             self.load_loans()
             self.update_alerts()
         except ValueError:
-            messagebox.showerror("Error", "Monto/Interés inválidos.")
+            messagebox.showerror("Error", "Monto/Interés/Cuotas inválidos.")
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
+
+    def check_balances(self):
+        """Compara los saldos guardados con los pagos y ofrece corregir las diferencias"""
+        try:
+            issues = self.controller.check_loan_balances()
+            if not issues:
+                messagebox.showinfo("Saldos", "Todos los saldos de préstamos coinciden con sus pagos.")
+                return
+            lines = [f"#{d['id']} {d['employee_name']}: pagado ${float(d['total_paid']):,.2f} "
+                     f"(según pagos ${float(d['expected_paid']):,.2f})" for d in issues[:15]]
+            if len(issues) > 15:
+                lines.append(f"... y {len(issues) - 15} más")
+            if messagebox.askyesno("Saldos",
+                                   f"{len(issues)} préstamo(s) con saldo inconsistente:\n\n" +
+                                   "\n".join(lines) + "\n\n¿Recalcular ahora?"):
+                self.controller.check_loan_balances(fix=True)
+                self.load_loans()
+                self.update_alerts()
+                messagebox.showinfo("Saldos", "Saldos recalculados.")
         except Exception as e:
             messagebox.showerror("Error", str(e))
 
@@ -328,7 +387,7 @@ class LoansView:
 
         win = tk.Toplevel(self.parent)
         win.title(f"Detalles - {s['loan']['employee_display']}")
-        win.geometry("620x420")
+        win.geometry("620x600")
         win.transient(self.parent)
         win.grab_set()
 
@@ -341,11 +400,37 @@ class LoansView:
         text = (f"Empleado: {s['loan']['employee_display']}\n"
                 f"Monto original: ${float(s['loan']['amount']):.2f}\n"
                 f"Interés: {float(s['loan']['interest_rate']):.1f}%\n"
-                f"Total a pagar: ${float(s['total_due']):.2f}\n"
+                f"Total a pagar: ${float(s['total_due']):.2f} | "
+                f"{SCHEMES.get(s['loan'].get('scheme') or 'flat', '')}, {int(s['loan'].get('installments') or 1)} cuota(s)\n"
                 f"Fecha préstamo: {s['loan']['date_issued']} | Vence: {s['loan']['due_date']} | Estado: {self._translate_status(s['loan']['status'])}\n"
                 f"Pagado: ${float(s['total_paid']):.2f} | Saldo: ${float(s['balance']):.2f}")
+        if float(s['loan'].get('accrual_rate') or 0) > 0:
+            text += (f"\nInterés anual {float(s['loan']['accrual_rate']):.1f}%: devengado "
+                     f"${float(s['loan']['accrued_interest'] or 0):.2f} al {s['loan'].get('accrued_through') or '—'}")
         ttk.Label(info, text=text, justify=tk.LEFT).pack(anchor=tk.W)
 
+        inst_frame = ttk.LabelFrame(main, text="Cuotas", padding=8)
+        inst_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 8))
+        icols = ('number', 'due', 'principal', 'interest', 'amount', 'paid', 'pending')
+        itree = ttk.Treeview(inst_frame, columns=icols, show='headings', height=6)
+        for c, txt, w in (('number', '#', 40), ('due', 'Vence', 95), ('principal', 'Capital', 80),
+                          ('interest', 'Interés', 75), ('amount', 'Cuota', 80), ('paid', 'Pagado', 80),
+                          ('pending', 'Pendiente', 85)):
+            itree.heading(c, text=txt)
+            itree.column(c, width=w, anchor=tk.CENTER)
+        today = datetime.now().strftime('%Y-%m-%d')
+        itree.tag_configure('late', foreground='#8b0000')
+        itree.tag_configure('done', foreground='#777777')
+        for c in self.controller.get_installments(loan_id):
+            tag = 'done' if c['pending'] <= 0 else ('late' if c['due_date'] < today else '')
+            itree.insert('', 'end', tags=(tag,), values=(
+                c['number'], c['due_date'], f"${c['principal']:.2f}", f"${c['interest']:.2f}",
+                f"${c['amount']:.2f}", f"${c['paid_amount']:.2f}", f"${c['pending']:.2f}"))
+        isb = ttk.Scrollbar(inst_frame, orient=tk.VERTICAL, command=itree.yview)
+        itree.configure(yscrollcommand=isb.set)
+        itree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        isb.pack(side=tk.RIGHT, fill=tk.Y)
+
         pays_frame = ttk.LabelFrame(main, text="Pagos", padding=8)
         pays_frame.pack(fill=tk.BOTH, expand=True)
 
@@ -361,6 +446,39 @@ class LoansView:
         tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         ysb.pack(side=tk.RIGHT, fill=tk.Y)
 
+    def show_installments_due(self):
+        """Cuotas con saldo de todos los empleados: vencidas y de la semana en curso"""
+        today = datetime.now().date()
+        week_end = (today + timedelta(days=6 - today.weekday())).strftime('%Y-%m-%d')
+        rows = self.controller.get_installments_due(None, week_end)
+
+        win = tk.Toplevel(self.parent)
+        win.title(f"Cuotas por vencer (hasta {week_end})")
+        win.geometry("640x380")
+        win.transient(self.parent)
+
+        main = ttk.Frame(win, padding=10)
+        main.pack(fill=tk.BOTH, expand=True)
+        cols = ('due', 'employee', 'loan', 'number', 'amount', 'pending')
+        tree = ttk.Treeview(main, columns=cols, show='headings')
+        for c, txt, w in (('due', 'Vence', 95), ('employee', 'Empleado', 200), ('loan', 'Préstamo', 70),
+                          ('number', 'Cuota', 60), ('amount', 'Cuota $', 90), ('pending', 'Pendiente', 90)):
+            tree.heading(c, text=txt)
+            tree.column(c, width=w, anchor=tk.W if c == 'employee' else tk.CENTER)
+        tree.tag_configure('late', foreground='#8b0000')
+        today_s = today.strftime('%Y-%m-%d')
+        total = 0.0
+        for r in rows:
+            total += r['pending']
+            tree.insert('', 'end', tags=('late',) if r['due_date'] < today_s else (), values=(
+                r['due_date'], r['employee_display'], r['loan_id'], r['number'],
+                f"${r['amount']:,.2f}", f"${r['pending']:,.2f}"))
+        ysb = ttk.Scrollbar(main, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=ysb.set)
+        tree.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        ttk.Label(win, text=f"{len(rows)} cuota(s) | Pendiente: ${total:,.2f}  (en rojo: vencidas)",
+                  padding=(10, 0, 10, 8)).pack(anchor=tk.W)
+
     def show_payment_dialog(self):
         sel = self.loans_tree.selection()
         if not sel:
@@ -423,6 +541,99 @@ class LoansView:
 
         main.columnconfigure(1, weight=1)
 
+    def show_allocation_dialog(self):
+        """Un solo abono del empleado repartido entre todos sus préstamos con saldo"""
+        win = tk.Toplevel(self.parent)
+        win.title("Abono a varios préstamos")
+        win.geometry("520x470")
+        win.transient(self.parent)
+        win.grab_set()
+
+        main = ttk.Frame(win, padding=10)
+        main.pack(fill=tk.BOTH, expand=True)
+
+        ttk.Label(main, text="Empleado:").grid(row=0, column=0, sticky=tk.W, pady=4)
+        emp_cb = ttk.Combobox(main, state="readonly", values=self.employee_cb['values'], width=32)
+        emp_cb.grid(row=0, column=1, sticky=tk.EW, pady=4, padx=(5, 0))
+        sel = self.loans_tree.selection()
+        if sel:
+            loan = self.controller.get_loan_by_id(self.loans_tree.item(sel[0])['values'][0])
+            for v in emp_cb['values']:
+                if loan and v.startswith(f"{loan.get('employee_id')} - "):
+                    emp_cb.set(v)
+
+        ttk.Label(main, text="Monto:").grid(row=1, column=0, sticky=tk.W, pady=4)
+        amount_entry = ttk.Entry(main)
+        amount_entry.grid(row=1, column=1, sticky=tk.EW, pady=4, padx=(5, 0))
+
+        ttk.Label(main, text="Reparto:").grid(row=2, column=0, sticky=tk.W, pady=4)
+        strategy_cb = ttk.Combobox(main, state="readonly", values=tuple(STRATEGY_TO_CODE.keys()), width=26)
+        strategy_cb.set(ALLOCATION_STRATEGIES["oldest"])
+        strategy_cb.grid(row=2, column=1, sticky=tk.EW, pady=4, padx=(5, 0))
+
+        ttk.Label(main, text="Fecha Pago:").grid(row=3, column=0, sticky=tk.W, pady=4)
+        date_entry = DateEntry(main, date_pattern='yyyy-mm-dd')
+        date_entry.set_date(datetime.now())
+        date_entry.grid(row=3, column=1, sticky=tk.EW, pady=4, padx=(5, 0))
+
+        reg_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(main, text="Registrar en Caja", variable=reg_var).grid(row=4, column=0, columnspan=2, sticky=tk.W)
+
+        ttk.Label(main, text="Método:").grid(row=5, column=0, sticky=tk.W, pady=4)
+        method_cb = ttk.Combobox(main, state="readonly", values=tuple(PAY_TO_CODE.keys()), width=18)
+        method_cb.set("Efectivo")
+        method_cb.grid(row=5, column=1, sticky=tk.EW, pady=4, padx=(5, 0))
+
+        preview = ttk.Treeview(main, columns=('loan', 'balance', 'applied', 'after'), show='headings', height=6)
+        for c, txt in (('loan', 'Préstamo'), ('balance', 'Saldo'), ('applied', 'Abono'), ('after', 'Queda')):
+            preview.heading(c, text=txt)
+            preview.column(c, width=100, anchor=tk.CENTER)
+        preview.grid(row=6, column=0, columnspan=2, sticky=tk.NSEW, pady=(8, 0))
+
+        def _inputs():
+            emp_id = self._get_selected_employee_id_from_combo(emp_cb)
+            if not emp_id:
+                raise Exception("Seleccione un empleado")
+            return emp_id, float(amount_entry.get()), STRATEGY_TO_CODE[strategy_cb.get()]
+
+        def do_preview():
+            try:
+                preview.delete(*preview.get_children())
+                for x in self.controller.plan_allocation(*_inputs()):
+                    preview.insert('', 'end', values=(
+                        f"#{x['loan_id']}", f"${x['balance']:,.2f}", f"${x['applied']:,.2f}",
+                        f"${x['balance'] - x['applied']:,.2f}"))
+            except ValueError:
+                messagebox.showerror("Error", "Monto inválido", parent=win)
+            except Exception as e:
+                messagebox.showerror("Error", str(e), parent=win)
+
+        def do_register():
+            try:
+                emp_id, amount, strategy = _inputs()
+                res = self.controller.allocate_payment(
+                    emp_id, amount, strategy, payment_date=date_entry.get_date().strftime('%Y-%m-%d'),
+                    register_in_cash=reg_var.get(), payment_method=PAY_TO_CODE[method_cb.get()])
+                lines = "\n".join(f"Préstamo #{x['loan_id']}: ${x['applied']:,.2f} (queda ${x['new_balance']:,.2f})"
+                                  for x in res["applied"])
+                messagebox.showinfo("Pago", f"Abono de ${res['total_applied']:,.2f} registrado:\n\n{lines}", parent=win)
+                win.destroy()
+                self.load_loans()
+                self.update_alerts()
+            except ValueError:
+                messagebox.showerror("Error", "Monto inválido", parent=win)
+            except Exception as e:
+                messagebox.showerror("Error", str(e), parent=win)
+
+        btns = ttk.Frame(main)
+        btns.grid(row=7, column=0, columnspan=2, pady=10)
+        ttk.Button(btns, text="Vista previa", command=do_preview).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btns, text="Registrar", command=do_register).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btns, text="Cancelar", command=win.destroy).pack(side=tk.LEFT, padx=5)
+
+        main.columnconfigure(1, weight=1)
+        main.rowconfigure(6, weight=1)
+
     # -----------------------------
     # NÓMINA
     # -----------------------------
@@ -458,11 +669,126 @@ class LoansView:
         else:
             self.alerts_text.insert(tk.END, "PRÉSTAMOS VENCIDOS:\n\n")
             for L in o:
-                days = (datetime.now().date() - datetime.strptime(L['due_date'], '%Y-%m-%d').date()).days
                 name = L.get("employee_display") or "—"
-                self.alerts_text.insert(tk.END, f"{name}: ${float(L['amount']):.2f} - {days} días de retraso\n")
+                self.alerts_text.insert(tk.END, f"{name}: ${float(L['balance']):.2f} - "
+                                                f"{int(L['days_overdue'])} días de retraso\n")
         self.alerts_text.config(state=tk.DISABLED)
 
+    # -----------------------------
+    # ANTIGÜEDAD DE CARTERA
+    # -----------------------------
+    def show_aging_report(self):
+        """Saldo pendiente por empleado según días de atraso, con exportación y gráfico"""
+        try:
+            rows = self.controller.get_aging_report()
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudo calcular la antigüedad: {e}")
+            return
+
+        def _money(val):
+            return f"${float(val or 0):,.2f}"
+
+        win = tk.Toplevel(self.parent)
+        win.title(f"Antigüedad de préstamos al {datetime.now().strftime('%Y-%m-%d')}")
+        win.geometry("860x440")
+        win.transient(self.parent)
+
+        main = ttk.Frame(win, padding=10)
+        main.pack(fill=tk.BOTH, expand=True)
+
+        cols = ('employee', 'loans') + tuple(k for k, _ in AGING_BUCKETS) + ('total', 'oldest')
+        tree = ttk.Treeview(main, columns=cols, show='headings', height=14)
+        tree.heading('employee', text='Empleado')
+        tree.column('employee', width=190, anchor=tk.W)
+        tree.heading('loans', text='Préstamos')
+        tree.column('loans', width=70, anchor=tk.CENTER)
+        for key, label in AGING_BUCKETS:
+            tree.heading(key, text=label)
+            tree.column(key, width=90, anchor=tk.E)
+        tree.heading('total', text='Total')
+        tree.column('total', width=100, anchor=tk.E)
+        tree.heading('oldest', text='Máx. días')
+        tree.column('oldest', width=70, anchor=tk.CENTER)
+
+        totals = {k: 0.0 for k, _ in AGING_BUCKETS}
+        totals['total'] = 0.0
+        for r in rows:
+            for k in totals:
+                totals[k] += float(r[k])
+            tree.insert('', 'end', values=(
+                r['employee'], r['loans'], *[_money(r[k]) for k, _ in AGING_BUCKETS],
+                _money(r['total']), r['oldest_days']))
+        if rows:
+            tree.insert('', 'end', tags=('total',), values=(
+                'TOTAL', sum(int(r['loans']) for r in rows),
+                *[_money(totals[k]) for k, _ in AGING_BUCKETS], _money(totals['total']), ''))
+            tree.tag_configure('total', font=('TkDefaultFont', 9, 'bold'))
+        tree.pack(fill=tk.BOTH, expand=True)
+
+        btns = ttk.Frame(main)
+        btns.pack(fill=tk.X, pady=(8, 0))
+
+        def export():
+            from tkinter import filedialog
+            path = filedialog.asksaveasfilename(
+                parent=win, defaultextension=".csv",
+                filetypes=[("CSV", ".csv"), ("CSV comprimido", ".csv.gz"), ("Excel", ".xlsx")],
+                title="Exportar antigüedad",
+                initialfile=f"antiguedad_prestamos_{datetime.now().strftime('%Y%m%d')}.csv")
+            if not path:
+                return
+            try:
+                n = self.controller.export_aging_report(path)
+                messagebox.showinfo("Éxito", f"Se exportaron {n} empleado(s)", parent=win)
+            except Exception as e:
+                messagebox.showerror("Error", f"No se pudo exportar: {e}", parent=win)
+
+        ttk.Button(btns, text="Exportar", command=export).pack(side=tk.LEFT, padx=(0, 8))
+        ttk.Button(btns, text="Gráfico", command=lambda: self._show_aging_chart(rows)).pack(side=tk.LEFT, padx=(0, 8))
+        ttk.Button(btns, text="Cerrar", command=win.destroy).pack(side=tk.LEFT)
+
+    def _show_aging_chart(self, rows):
+        if not rows:
+            messagebox.showinfo("Antigüedad", "No hay préstamos con saldo pendiente")
+            return
+        try:
+            import matplotlib.pyplot as plt
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        except ImportError:
+            messagebox.showerror("Error", "Para ver los gráficos necesita instalar matplotlib:\n\npip install matplotlib")
+            return
+
+        win = tk.Toplevel(self.parent)
+        win.title("Antigüedad de préstamos")
+        win.geometry("820x560")
+
+        top = rows[:15]  # los saldos más grandes
+        names = [r['employee'] for r in reversed(top)]
+        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(11, 6), gridspec_kw={'width_ratios': [1, 2]})
+
+        bucket_totals = [sum(float(r[k]) for r in rows) for k, _ in AGING_BUCKETS]
+        ax1.bar([label for _, label in AGING_BUCKETS], bucket_totals, color=AGING_COLORS)
+        ax1.set_title('Cartera por antigüedad')
+        ax1.set_ylabel('Saldo ($)')
+        ax1.tick_params(axis='x', rotation=45)
+        ax1.grid(True, axis='y', alpha=0.3)
+
+        left = [0.0] * len(top)
+        for (key, label), color in zip(AGING_BUCKETS, AGING_COLORS):
+            vals = [float(r[key]) for r in reversed(top)]
+            ax2.barh(names, vals, left=left, label=label, color=color)
+            left = [a + b for a, b in zip(left, vals)]
+        ax2.set_title('Por empleado')
+        ax2.set_xlabel('Saldo ($)')
+        ax2.legend(fontsize=8)
+        ax2.grid(True, axis='x', alpha=0.3)
+        fig.tight_layout()
+
+        canvas = FigureCanvasTkAgg(fig, master=win)
+        canvas.draw()
+        canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        ttk.Button(win, text="Cerrar", command=win.destroy).pack(pady=6)
+
     # -----------------------------
     # REPORTE (con PDF)
     # -----------------------------
@@ -623,16 +949,27 @@ class LoansView:
             return data, {"amount": total_amount, "paid": total_paid, "balance": total_balance}
 
         def generate_and_export_pdf():
-            """Genera el PDF con los datos actuales del filtro."""
-            # Cargar/actualizar preview y tomar los datos
+            """Genera el PDF con los datos actuales del filtro (en segundo plano)."""
+            if not reportlab_available():
+                messagebox.showerror(
+                    "Falta dependencia",
+                    "Para generar PDF necesitas instalar reportlab:\n\npip install reportlab"
+                )
+                return
+
+            start_str = start_date.get_date().strftime('%Y-%m-%d')
+            end_str = end_date.get_date().strftime('%Y-%m-%d')
+            status_internal = _status_map_to_internal(status_filter.get())
+
             try:
-                data, totals = _load_preview()
+                n_rows = self.controller.count_loans_report(start_str, end_str, status_internal)
             except Exception as e:
                 messagebox.showerror("Reporte de Préstamos", f"Error obteniendo datos: {e}")
                 return
 
             # Si no hay datos, no generamos
-            if not data:
+            if not n_rows:
+                status_lbl.config(text="No hay préstamos para el período seleccionado.")
                 return
 
             # Elegir ruta de guardado
@@ -647,98 +984,54 @@ class LoansView:
             if not save_path:
                 return
 
-            # Intentar importar reportlab
-            try:
-                from reportlab.lib.pagesizes import A4, landscape
-                from reportlab.lib import colors
-                from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-                from reportlab.lib.styles import getSampleStyleSheet
-            except ImportError:
-                messagebox.showerror(
-                    "Falta dependencia",
-                    "Para generar PDF necesitas instalar reportlab:\n\npip install reportlab"
-                )
-                return
+            st_map = {None: "Todos", "active": "Activo", "paid": "Pagado", "overdue": "Vencido"}
+            status_str = st_map.get(status_internal, "Todos")
 
-            try:
-                # Documento
-                doc = SimpleDocTemplate(
-                    save_path,
-                    pagesize=landscape(A4),
-                    leftMargin=18, rightMargin=18, topMargin=18, bottomMargin=22
-                )
-
-                styles = getSampleStyleSheet()
-                title = Paragraph("<b>Reporte de Préstamos a Empleados</b>", styles['Title'])
-
-                # Subtítulo: periodo y estado
-                st_map = {None: "Todos", "active": "Activo", "paid": "Pagado", "overdue": "Vencido"}
-                start_str = start_date.get_date().strftime('%Y-%m-%d')
-                end_str = end_date.get_date().strftime('%Y-%m-%d')
-                status_internal = _status_map_to_internal(status_filter.get())
-                status_str = st_map.get(status_internal, "Todos")
-
-                meta = Paragraph(
-                    f"Período: <b>{start_str}</b> a <b>{end_str}</b> &nbsp;&nbsp;|&nbsp;&nbsp; "
-                    f"Estado: <b>{status_str}</b> &nbsp;&nbsp;|&nbsp;&nbsp; "
-                    f"Generado: {datetime.now().strftime('%Y-%m-%d %H:%M')}",
-                    styles['Normal']
-                )
+            # Totales acumulados mientras se recorren los bloques
+            totals = {"amount": 0.0, "paid": 0.0, "balance": 0.0}
 
-                # Tabla
-                table_data = [
-                    ["Empleado", "Monto", "Fecha Préstamo", "Fecha Vencimiento", "Estado", "Pagado", "Saldo"]
+            def _row(loan):
+                amount = float(loan.get('amount') or 0)
+                paid = float(loan.get('total_paid') or 0)
+                balance = float(loan.get('balance') or 0)
+                totals["amount"] += amount
+                totals["paid"] += paid
+                totals["balance"] += balance
+                return [
+                    loan.get('employee_display') or loan.get('employee_name') or '—',
+                    _format_money(amount),
+                    loan.get('date_issued') or '',
+                    loan.get('due_date') or '',
+                    _translate_status_en_to_es(loan.get('status')),
+                    _format_money(paid),
+                    _format_money(balance)
                 ]
-                for loan in data:
-                    employee = loan.get('employee_display') or loan.get('employee_name') or '—'
-                    amount = float(loan.get('amount') or 0)
-                    paid = float(loan.get('total_paid') or 0)
-                    balance = float(loan.get('balance') or 0)
-                    issued = loan.get('date_issued') or ''
-                    due = loan.get('due_date') or ''
-                    st_es = _translate_status_en_to_es(loan.get('status'))
-                    table_data.append([
-                        employee, _format_money(amount), issued, due, st_es,
-                        _format_money(paid), _format_money(balance)
-                    ])
-
-                # Totales
-                table_data.append([
-                    "Totales", _format_money(totals["amount"]), "", "", "",
-                    _format_money(totals["paid"]), _format_money(totals["balance"])
-                ])
-
-                tbl = Table(table_data, repeatRows=1)
-                tbl.setStyle(TableStyle([
-                    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f0f0f0')),
-                    ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-                    ('ALIGN', (1, 1), (1, -2), 'RIGHT'),   # Monto
-                    ('ALIGN', (5, 1), (6, -2), 'RIGHT'),   # Pagado, Saldo
-                    ('ALIGN', (2, 1), (3, -2), 'CENTER'),  # Fechas
-                    ('ALIGN', (4, 1), (4, -2), 'CENTER'),  # Estado
-                    ('GRID', (0, 0), (-1, -1), 0.25, colors.HexColor('#cccccc')),
-                    ('ROWBACKGROUNDS', (0, 1), (-1, -2), [colors.white, colors.HexColor('#fbfbfb')]),
-                    ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-                    ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#e8f5e9')),
-                ]))
-
-                story = [title, Spacer(0, 8), meta, Spacer(0, 10), tbl]
-
-                # Footer con número de página
-                def _footer(canvas, doc):
-                    canvas.saveState()
-                    footer = f"Página {doc.page}"
-                    canvas.setFont("Helvetica", 9)
-                    canvas.drawRightString(doc.pagesize[0] - 18, 12, footer)
-                    canvas.restoreState()
-
-                doc.build(story, onFirstPage=_footer, onLaterPages=_footer)
-
-                messagebox.showinfo("Reporte de Préstamos", f"PDF generado correctamente:\n{save_path}")
 
-            except Exception as e:
-                messagebox.showerror("Reporte de Préstamos", f"No se pudo generar el PDF:\n{e}")
+            def job(progress, cancel_event):
+                return write_table_pdf(
+                    save_path,
+                    title="Reporte de Préstamos a Empleados",
+                    subtitle=(f"Período: <b>{start_str}</b> a <b>{end_str}</b> &nbsp;&nbsp;|&nbsp;&nbsp; "
+                              f"Estado: <b>{status_str}</b>"),
+                    headers=["Empleado", "Monto", "Fecha Préstamo", "Fecha Vencimiento",
+                             "Estado", "Pagado", "Saldo"],
+                    chunks=self.controller.iter_loans_report(start_str, end_str, status_internal),
+                    row_mapper=_row,
+                    col_weights=[24, 12, 13, 13, 10, 12, 12],
+                    align={1: 'RIGHT', 2: 'CENTER', 3: 'CENTER', 4: 'CENTER', 5: 'RIGHT', 6: 'RIGHT'},
+                    wrap_cols=(0,),
+                    totals_row=lambda: ["Totales", _format_money(totals["amount"]), "", "", "",
+                                        _format_money(totals["paid"]), _format_money(totals["balance"])],
+                    total_rows=n_rows,
+                    progress=progress,
+                    cancel_event=cancel_event,
+                )
+
+            run_in_background(
+                report_window, "Reporte de Préstamos", job,
+                on_success=lambda _n: messagebox.showinfo(
+                    "Reporte de Préstamos", f"PDF generado correctamente:\n{save_path}", parent=report_window)
+            )
 
         # Generar una vista previa inicial
         try:
@@ -769,7 +1062,7 @@ class LoansView:
         # Dialogo
         win = tk.Toplevel(self.parent)
         win.title(f"Editar Préstamo #{loan_id}")
-        win.geometry("420x360")
+        win.geometry("420x470")
         win.transient(self.parent)
         win.grab_set()
 
@@ -832,15 +1125,31 @@ class LoansView:
         interest_e.insert(0, str(loan.get('interest_rate') or "0"))
         interest_e.grid(row=4, column=1, sticky=tk.EW, pady=4, padx=(6, 0))
 
+        # Plan de cuotas
+        ttk.Label(frm, text="Amortización:").grid(row=5, column=0, sticky=tk.W, pady=4)
+        scheme_cb = ttk.Combobox(frm, state="readonly", values=tuple(SCHEME_TO_CODE.keys()), width=26)
+        scheme_cb.set(SCHEMES.get(loan.get('scheme') or 'flat', SCHEMES['flat']))
+        scheme_cb.grid(row=5, column=1, sticky=tk.EW, pady=4, padx=(6, 0))
+
+        ttk.Label(frm, text="Cuotas:").grid(row=6, column=0, sticky=tk.W, pady=4)
+        installments_sb = ttk.Spinbox(frm, from_=1, to=120, width=6)
+        installments_sb.set(int(loan.get('installments') or 1))
+        installments_sb.grid(row=6, column=1, sticky=tk.W, pady=4, padx=(6, 0))
+
+        ttk.Label(frm, text="Interés anual (%):").grid(row=7, column=0, sticky=tk.W, pady=4)
+        accrual_e = ttk.Entry(frm)
+        accrual_e.insert(0, str(loan.get('accrual_rate') or "0"))
+        accrual_e.grid(row=7, column=1, sticky=tk.EW, pady=4, padx=(6, 0))
+
         # Notas
-        ttk.Label(frm, text="Notas:").grid(row=5, column=0, sticky=tk.W, pady=4)
+        ttk.Label(frm, text="Notas:").grid(row=8, column=0, sticky=tk.W, pady=4)
         notes_e = ttk.Entry(frm)
         notes_e.insert(0, (loan.get('notes') or ""))
-        notes_e.grid(row=5, column=1, sticky=tk.EW, pady=4, padx=(6, 0))
+        notes_e.grid(row=8, column=1, sticky=tk.EW, pady=4, padx=(6, 0))
 
         # Botones
         btns = ttk.Frame(frm)
-        btns.grid(row=6, column=0, columnspan=2, pady=12)
+        btns.grid(row=9, column=0, columnspan=2, pady=12)
 
         def _save():
             try:
@@ -875,7 +1184,10 @@ class LoansView:
                     date_issued=issued,
                     due_date=due,
                     interest_rate=interest,
-                    notes=notes
+                    notes=notes,
+                    scheme=SCHEME_TO_CODE[scheme_cb.get()],
+                    installments=int(installments_sb.get() or "1"),
+                    accrual_rate=float(accrual_e.get() or "0")
                 )
                 messagebox.showinfo("Éxito", "Préstamo actualizado correctamente")
                 win.destroy()
@@ -6,13 +6,36 @@ Controlador de Nómina (reporte mensual)
 Compatibilidad:
 - Deducciones tomadas de loan_payments con bandera is_payroll_deduction=1.
 - Si la bandera aún no existe/se pobló, fallback por notas que comienzan con 'Deducción por nómina'.
-- Caja: usa las mismas categorías/descripciones que genera LoansController:
-    * Ingreso por deducción:   type='income',  category='Pago préstamo empleado (nómina)',
-                               description LIKE 'Deducción nómina - {Nombre}%'
-    * Egreso por pago sueldo:  type='expense', category='Nómina',
-                               description LIKE 'Pago salario - {Nombre}%'
+- Caja: categorías normalizadas (cash_register.category_id) y el empleado del movimiento
+  (cash_register.employee_id) que registran LoansController / PayrollController al pagar:
+    * Ingreso por deducción:   categoría nomina_deduccion_prestamo
+    * Egreso por pago sueldo:  categoría nomina_pago
+  Los movimientos anteriores a la columna se asignan una vez por la descripción
+  (ver CashRegisterController.migrate_employee_ids).
+- El reporte usa un número fijo de consultas agrupadas, sin importar la cantidad de empleados.
+
+Historial (payroll_history):
+- Todos los pagos (individuales y corridas) quedan registrados con el salario de ese momento
+- backfill_history() completa los meses pagados antes de existir el historial
+- get_month_report y get_history_report / get_annual_report filtran el historial por el período
+  pagado (payroll_history.period), el mismo que usan las corridas para no pagar dos veces
+
+Nómina del mes (run_payroll):
+- Una corrida por período ('YYYY-MM') en payroll_runs; cada empleado pagado queda en
+  payroll_history con period y run_id
+- Un solo pago por empleado y período (índice único (period, employee_id)): la corrida omite a
+  quien ya cobró ese mes por cualquier vía y los pagos individuales rechazan un mes ya pagado
+- Se calcula todo sobre una sola lectura (empleados + préstamos con saldo) y se graban
+  deducciones, Caja e historial en una sola transacción
+- Repetir la corrida del período solo paga a los empleados que faltan (idempotente / reanudable)
 """
+import calendar
+import time
+from datetime import datetime
+
 from modules.loans.controller import LoansController
+from modules.payroll.payslips import generate_payslips
+from utils.report_export import ExportCancelled
 
 class PayrollController:
     def __init__(self, database, auth_manager):
@@ -29,16 +52,95 @@ class PayrollController:
             )
         except Exception:
             pass
-        try:
-            self.db.execute_query(
-                "CREATE INDEX IF NOT EXISTS idx_lp_is_payroll ON loan_payments(is_payroll_deduction)"
+        # loan_payments(is_payroll_deduction) ya lo indexa LoansController (idx_lp_payroll)
+        self.db.execute_query("DROP INDEX IF EXISTS idx_lp_is_payroll")
+        # rango de fechas del reporte mensual (todos los empleados a la vez)
+        self.db.execute_query("CREATE INDEX IF NOT EXISTS idx_lp_date ON loan_payments(payment_date)")
+
+        # Reportes históricos: pagos de un empleado por período (los reportes por mes usan
+        # idx_ph_period_employee)
+        self.db.execute_query(
+            "CREATE INDEX IF NOT EXISTS idx_ph_employee_period ON payroll_history(employee_id, period)")
+        # una sola vez por base: completar el historial de los meses pagados antes de payroll_history
+        self.db.run_once("payroll_history_backfill", self.backfill_history)
+
+        # Corridas mensuales (payroll_history la crea LoansController)
+        self.db.execute_query("""
+            CREATE TABLE IF NOT EXISTS payroll_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                period TEXT NOT NULL UNIQUE,          -- 'YYYY-MM'
+                pay_date TEXT NOT NULL,
+                payment_method TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'partial', -- 'partial' | 'completed'
+                employees INTEGER NOT NULL DEFAULT 0,
+                gross_salary REAL NOT NULL DEFAULT 0,
+                total_deducted REAL NOT NULL DEFAULT 0,
+                net_paid REAL NOT NULL DEFAULT 0,
+                user_id INTEGER,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                updated_at TEXT,
+                FOREIGN KEY (user_id) REFERENCES users (id)
             )
-        except Exception:
-            pass
+        """)
 
     def _yyyymm(self, year: int, month: int) -> str:
         return f"{year:04d}-{month:02d}"
 
+    def backfill_history(self, through=None):
+        """
+        Completa payroll_history con los meses pagados (hasta through, 'YYYY-MM-DD') que aún no
+        tienen registro: un pago por empleado y mes a partir de los egresos de sueldo en Caja
+        (nomina_pago) y de las deducciones de nómina de sus préstamos. El bruto es lo pagado
+        más lo deducido, no el salario actual. Sentencias por conjunto; se puede repetir.
+        Devuelve la cantidad de registros agregados.
+        """
+        through = through or "9999-12-31"
+        with self.db.transaction() as cur:
+            cur.execute("SELECT COUNT(*) AS n FROM payroll_history")
+            before = cur.fetchone()["n"]
+            cur.execute("""
+                WITH cash AS (
+                    SELECT c.employee_id, SUBSTR(c.date, 1, 7) AS period, MAX(c.date) AS last_date,
+                           SUM(c.amount) AS net, MAX(c.payment_method) AS method
+                      FROM cash_register c
+                     WHERE c.category_id IN (SELECT category_id FROM cash_category_aliases WHERE alias = 'nomina_pago')
+                       AND c.type = 'expense' AND c.employee_id IS NOT NULL AND c.date <= :through
+                  GROUP BY c.employee_id, SUBSTR(c.date, 1, 7)
+                ),
+                ded AS (
+                    SELECT l.employee_id, SUBSTR(lp.payment_date, 1, 7) AS period,
+                           MAX(lp.payment_date) AS last_date, SUM(lp.amount) AS amount
+                      FROM loan_payments lp
+                      JOIN loans l ON l.id = lp.loan_id
+                     WHERE (lp.is_payroll_deduction = 1 OR lp.notes LIKE 'Deducción por nómina%')
+                       AND l.employee_id IS NOT NULL AND lp.payment_date <= :through
+                  GROUP BY l.employee_id, SUBSTR(lp.payment_date, 1, 7)
+                ),
+                months AS (SELECT employee_id, period FROM cash UNION SELECT employee_id, period FROM ded)
+                INSERT INTO payroll_history (employee_id, pay_date, gross_salary, total_deducted, net_paid,
+                                             payment_method, registered_in_cash, period)
+                SELECT m.employee_id,
+                       MAX(COALESCE(c.last_date, ''), COALESCE(d.last_date, '')),
+                       ROUND(COALESCE(c.net, 0) + COALESCE(d.amount, 0), 2),
+                       ROUND(COALESCE(d.amount, 0), 2),
+                       ROUND(COALESCE(c.net, 0), 2),
+                       COALESCE(c.method, 'cash'),
+                       c.employee_id IS NOT NULL,
+                       m.period
+                  FROM months m
+                  JOIN employees e ON e.id = m.employee_id
+             LEFT JOIN cash c ON c.employee_id = m.employee_id AND c.period = m.period
+             LEFT JOIN ded d ON d.employee_id = m.employee_id AND d.period = m.period
+                 WHERE NOT EXISTS (SELECT 1 FROM payroll_history h
+                                    WHERE h.employee_id = m.employee_id AND h.period = m.period)
+              ORDER BY m.period, m.employee_id
+            """, {"through": through})
+            cur.execute("SELECT COUNT(*) AS n FROM payroll_history")
+            added = cur.fetchone()["n"] - before
+        if added:
+            print(f"[Payroll] Historial de nómina completado: {added} pago(s) de meses anteriores")
+        return added
+
     def list_employees(self, only_active=True):
         q = "SELECT * FROM employees"
         if only_active:
@@ -48,7 +150,67 @@ class PayrollController:
         return [dict(r) for r in rows] if rows else []
 
     def get_month_report(self, year: int, month: int):
+        """
+        Reporte del mes con un número fijo de consultas agrupadas por employee_id
+        (empleados, historial, deducciones y Caja), sin importar la cantidad de empleados.
+        Los empleados pagados muestran lo registrado en payroll_history (el salario de ese
+        momento); los pendientes, el salario actual. Los movimientos de Caja y las deducciones
+        hechos el día de un pago de nómina cuentan en el período de ese pago (una nómina de
+        marzo pagada el 2 de abril es de marzo); el resto, en el mes de su fecha.
+        """
         ym = self._yyyymm(year, month)
+        first_day = f"{ym}-01"
+        last_day = f"{ym}-{calendar.monthrange(year, month)[1]:02d}"
+        params = {"first": first_day, "last": last_day, "ym": ym}
+
+        # --- Deducción por préstamos (por nómina) del mes, por empleado ---
+        # Preferimos bandera is_payroll_deduction=1; si no está poblada, fallback por nota
+        deductions = {
+            r["employee_id"]: r for r in self.db.execute_query("""
+                SELECT l.employee_id, COALESCE(SUM(lp.amount), 0) AS s, COUNT(DISTINCT lp.loan_id) AS n
+                  FROM loan_payments lp
+                  JOIN loans l ON l.id = lp.loan_id
+                 WHERE (lp.payment_date BETWEEN :first AND :last
+                        OR lp.payment_date IN (SELECT pay_date FROM payroll_history WHERE period = :ym))
+                   AND (lp.is_payroll_deduction = 1 OR lp.notes LIKE 'Deducción por nómina%')
+                   AND COALESCE((SELECT h.period FROM payroll_history h
+                                  WHERE h.employee_id = l.employee_id AND h.pay_date = lp.payment_date
+                                  LIMIT 1), :ym) = :ym
+              GROUP BY l.employee_id
+            """, params) or []
+        }
+
+        # --- Caja del mes: neto pagado (egreso) e ingreso por deducción, por empleado ---
+        # un recorrido por el índice (category_id, date) de cada categoría de nómina
+        cash = {
+            r["employee_id"]: r for r in self.db.execute_query("""
+                SELECT c.employee_id,
+                       SUM(CASE WHEN a.alias = 'nomina_pago' AND c.type = 'expense' THEN c.amount ELSE 0 END) AS paid,
+                       SUM(CASE WHEN a.alias = 'nomina_deduccion_prestamo' AND c.type = 'income'
+                                THEN c.amount ELSE 0 END) AS ded_income
+                  FROM cash_category_aliases a
+                  JOIN cash_register c ON c.category_id = a.category_id
+                                      AND (c.date BETWEEN :first AND :last
+                                           OR c.date IN (SELECT pay_date FROM payroll_history WHERE period = :ym))
+                 WHERE a.alias IN ('nomina_pago', 'nomina_deduccion_prestamo')
+                   AND c.employee_id IS NOT NULL
+                   AND COALESCE((SELECT h.period FROM payroll_history h
+                                  WHERE h.employee_id = c.employee_id AND h.pay_date = c.date
+                                  LIMIT 1), :ym) = :ym
+              GROUP BY c.employee_id
+            """, params) or []
+        }
+
+        # --- Pagos registrados del mes (payroll_history), por empleado ---
+        history = {
+            r["employee_id"]: r for r in self.db.execute_query("""
+                SELECT employee_id, SUM(gross_salary) AS gross, SUM(total_deducted) AS deducted,
+                       SUM(net_paid) AS net, COUNT(*) AS payments
+                  FROM payroll_history
+                 WHERE period = ?
+              GROUP BY employee_id
+            """, (ym,)) or []
+        }
 
         # Todos los empleados (activos e inactivos) para reportes históricos
         emps = self.db.execute_query("SELECT * FROM employees ORDER BY last_name, first_name") or []
@@ -59,54 +221,22 @@ class PayrollController:
             emp = dict(r)
             emp_id = emp["id"]
             name = f"{emp['first_name']} {emp['last_name']}".strip()
-            gross = float(emp.get("salary") or 0)
-
-            # --- Deducción por préstamos (por nómina) en ese mes ---
-            # Preferimos bandera is_payroll_deduction=1; si no está poblada, fallback por nota
-            q_ded = """
-                SELECT COALESCE(SUM(lp.amount),0) AS s, COUNT(DISTINCT lp.loan_id) AS n
-                  FROM loan_payments lp
-                  JOIN loans l ON l.id = lp.loan_id
-                 WHERE l.employee_id = ?
-                   AND strftime('%Y-%m', lp.payment_date) = ?
-                   AND (lp.is_payroll_deduction = 1 OR lp.notes LIKE 'Deducción por nómina%')
-            """
-            row_ded = self.db.execute_query(q_ded, (emp_id, ym))
-            deducted = float(row_ded[0]["s"]) if row_ded else 0.0
-            loans_count = int(row_ded[0]["n"]) if row_ded else 0
+            ded = deductions.get(emp_id)
+            loans_count = int(ded["n"]) if ded else 0
+            h = history.get(emp_id)
+            if h:
+                gross = float(h["gross"] or 0)
+                deducted = float(h["deducted"] or 0)
+            else:
+                gross = float(emp.get("salary") or 0)
+                deducted = float(ded["s"]) if ded else 0.0
 
             # Neto calculado
             net_calc = max(gross - deducted, 0.0)
 
-            # --- Neto pagado (egreso) en Caja ese mes ---
-            # Compatibles con LoansController.process_payroll_payment:
-            #   Egreso:  type='expense', category='Nómina', desc 'Pago salario - {name} ...'
-            q_cash_net = """
-                SELECT COALESCE(SUM(amount),0) s
-                  FROM cash_register
-                 WHERE type='expense'
-                   AND category='Nómina'
-                   AND strftime('%Y-%m', date)=?
-                   AND description LIKE ?
-            """
-            desc_like = f"Pago salario - {name}%"
-            r_net = self.db.execute_query(q_cash_net, (ym, desc_like)) or [{'s':0}]
-            net_cash = float(r_net[0]['s'] or 0)
-
-            # --- Ingreso por deducción (validación) ---
-            #   Ingreso: type='income', category='Pago préstamo empleado (nómina)',
-            #   desc 'Deducción nómina - {name} ...'
-            q_cash_ded = """
-                SELECT COALESCE(SUM(amount),0) s
-                  FROM cash_register
-                 WHERE type='income'
-                   AND category='Pago préstamo empleado (nómina)'
-                   AND strftime('%Y-%m', date)=?
-                   AND description LIKE ?
-            """
-            desc_like2 = f"Deducción nómina - {name}%"
-            r_ded_income = self.db.execute_query(q_cash_ded, (ym, desc_like2)) or [{'s':0}]
-            cash_ded_income = float(r_ded_income[0]['s'] or 0)
+            c = cash.get(emp_id)
+            net_cash = float(c["paid"] or 0) if c else 0.0
+            cash_ded_income = float(c["ded_income"] or 0) if c else 0.0
 
             diff = net_cash - net_calc
 
@@ -120,6 +250,8 @@ class PayrollController:
                 "cash_ded_income": round(cash_ded_income,2),
                 "loans_count": loans_count,
                 "diff": round(diff,2),
+                "paid": bool(h),
+                "net_paid": round(float(h["net"] or 0), 2) if h else 0.0,
             })
 
             totals["gross"] += gross
@@ -132,12 +264,308 @@ class PayrollController:
             totals[k] = round(totals[k], 2)
         return out, totals
     
+    def get_history_report(self, start_period, end_period=None, employee_id=None):
+        """
+        Nómina pagada entre dos períodos ('YYYY-MM', incluidos) leída de payroll_history con
+        una sola consulta agrupada por empleado y mes. Devuelve (filas, meses, totales); cada
+        fila trae los totales del rango y 'months' = {período: neto pagado}.
+        """
+        y1, m1 = self._parse_period(start_period)
+        y2, m2 = self._parse_period(end_period or start_period)
+        if (y2, m2) < (y1, m1):
+            raise ValueError("El período final es anterior al inicial")
+        months = [self._yyyymm(y, m) for y, m in
+                  ((y1 + (m1 - 1 + k) // 12, (m1 - 1 + k) % 12 + 1) for k in range((y2 - y1) * 12 + m2 - m1 + 1))]
+
+        q = """
+            SELECT h.employee_id, e.first_name, e.last_name, h.period,
+                   SUM(h.gross_salary) AS gross, SUM(h.total_deducted) AS deducted,
+                   SUM(h.net_paid) AS net, COUNT(*) AS payments
+              FROM payroll_history h
+         LEFT JOIN employees e ON e.id = h.employee_id
+             WHERE h.period BETWEEN ? AND ?
+        """
+        params = [months[0], months[-1]]
+        if employee_id:
+            q += " AND h.employee_id = ?"
+            params.append(employee_id)
+        q += " GROUP BY h.employee_id, h.period ORDER BY e.last_name, e.first_name, period"
+
+        by_emp = {}
+        totals = {"gross": 0.0, "deduct": 0.0, "net": 0.0, "payments": 0}
+        for r in self.db.execute_query(q, params) or []:
+            row = by_emp.setdefault(r["employee_id"], {
+                "employee_id": r["employee_id"],
+                "name": f"{r['first_name'] or ''} {r['last_name'] or ''}".strip() or "—",
+                "gross": 0.0, "deduct": 0.0, "net": 0.0, "payments": 0, "months": {},
+            })
+            row["months"][r["period"]] = round(float(r["net"] or 0), 2)
+            row["gross"] += float(r["gross"] or 0)
+            row["deduct"] += float(r["deducted"] or 0)
+            row["net"] += float(r["net"] or 0)
+            row["payments"] += int(r["payments"])
+        rows = list(by_emp.values())
+        for row in rows:
+            for k in ("gross", "deduct", "net"):
+                totals[k] += row[k]
+                row[k] = round(row[k], 2)
+            totals["payments"] += row["payments"]
+        for k in ("gross", "deduct", "net"):
+            totals[k] = round(totals[k], 2)
+        return rows, months, totals
+
+    def get_annual_report(self, year: int, employee_id=None):
+        """Nómina pagada del año (enero a diciembre) desde payroll_history."""
+        return self.get_history_report(f"{year:04d}-01", f"{year:04d}-12", employee_id)
+
+    # -------------------- Recibos de pago --------------------
+    def get_payslip_data(self, period, employee_ids=None):
+        """
+        Datos de los recibos del período en una sola consulta: un recibo por empleado pagado
+        en el período (payroll_history.period) con el detalle de las deducciones por préstamo
+        hechas en las fechas de esos pagos (una nómina de marzo pagada en abril trae las de abril).
+        """
+        year, month = self._parse_period(period)
+        period = self._yyyymm(year, month)
+        params = {"period": period}
+        emp_filter = ""
+        if employee_ids is not None:
+            params.update({f"e{i}": int(v) for i, v in enumerate(employee_ids)})
+            emp_filter = f"AND h.employee_id IN ({', '.join(':e' + str(i) for i in range(len(employee_ids))) or 'NULL'})"
+        rows = self.db.execute_query(f"""
+            WITH ded AS (
+                SELECT l.employee_id, GROUP_CONCAT(lp.loan_id || ':' || lp.amount, ';') AS detail
+                  FROM (SELECT DISTINCT employee_id, pay_date FROM payroll_history WHERE period = :period) p
+                  JOIN loans l ON l.employee_id = p.employee_id
+                  JOIN loan_payments lp ON lp.loan_id = l.id AND lp.payment_date = p.pay_date
+                 WHERE lp.is_payroll_deduction = 1
+              GROUP BY l.employee_id
+            )
+            SELECT h.employee_id, e.first_name, e.last_name, MAX(h.pay_date) AS pay_date,
+                   MAX(h.payment_method) AS payment_method, SUM(h.gross_salary) AS gross,
+                   SUM(h.total_deducted) AS deducted, SUM(h.net_paid) AS net, d.detail
+              FROM payroll_history h
+              JOIN employees e ON e.id = h.employee_id
+         LEFT JOIN ded d ON d.employee_id = h.employee_id
+             WHERE h.period = :period {emp_filter}
+          GROUP BY h.employee_id
+          ORDER BY e.last_name, e.first_name
+        """, params)
+        out = []
+        for r in rows or []:
+            deductions = {}
+            for part in (r["detail"] or "").split(";"):
+                if part:
+                    loan_id, amount = part.split(":")
+                    deductions[int(loan_id)] = round(deductions.get(int(loan_id), 0.0) + float(amount), 2)
+            out.append({
+                "employee_id": r["employee_id"],
+                "name": f"{r['first_name']} {r['last_name']}".strip(),
+                "period": period,
+                "pay_date": r["pay_date"],
+                "payment_method": r["payment_method"],
+                "gross": round(float(r["gross"] or 0), 2),
+                "deducted": round(float(r["deducted"] or 0), 2),
+                "net": round(float(r["net"] or 0), 2),
+                "deductions": sorted(deductions.items()),
+            })
+        return out
+
+    def export_payslips(self, period, out_dir, merged_path=None, employee_ids=None, workers=None,
+                        progress=None, cancel_event=None):
+        """
+        Genera los recibos de pago del período en out_dir (un PDF por empleado, en paralelo)
+        y opcionalmente un archivo combinado. Devuelve {'files', 'merged', 'paths', 'ms'}.
+        """
+        slips = self.get_payslip_data(period, employee_ids)
+        if not slips:
+            raise Exception(f"No hay pagos de nómina registrados en {period}")
+        t0 = time.perf_counter()
+        written = generate_payslips(slips, out_dir, merged_path=merged_path, workers=workers,
+                                    progress=progress, cancel_event=cancel_event)
+        ms = (time.perf_counter() - t0) * 1000.0
+        print(f"[Payroll] Recibos {period}: {len(slips)} PDF en {ms:.0f} ms")
+        return {"files": len(slips), "merged": merged_path, "paths": written, "ms": ms}
+
+    # -------------------- Nómina del mes (corrida por lote) --------------------
+    @staticmethod
+    def _parse_period(period):
+        """'YYYY-MM' -> (año, mes); ValueError si el formato no es válido."""
+        try:
+            d = datetime.strptime(str(period).strip(), "%Y-%m")
+        except ValueError:
+            raise ValueError(f"Período inválido: {period} (use AAAA-MM)")
+        return d.year, d.month
+
+    def _payroll_snapshot(self, read, period, employee_ids=None, with_loan_deduction=True):
+        """
+        Empleados pendientes del período (activos con salario, sin ningún pago registrado en
+        payroll_history para el período: corridas, pagos individuales o backfill) y el reparto de su salario entre los préstamos con saldo (más antiguo primero).
+        Dos lecturas con read(sql, params) -> filas, sin importar la cantidad de empleados.
+        """
+        where = ["e.salary > 0", """NOT EXISTS (SELECT 1 FROM payroll_history h
+                                         WHERE h.period = :period AND h.employee_id = e.id)"""]
+        params = {"period": period}
+        if employee_ids is None:
+            where.append("e.is_active = 1")
+        else:
+            ids = [int(i) for i in employee_ids]
+            if not ids:
+                return []
+            params.update({f"e{i}": v for i, v in enumerate(ids)})
+            where.append(f"e.id IN ({', '.join(':e' + str(i) for i in range(len(ids)))})")
+        pending = f"SELECT e.id FROM employees e WHERE {' AND '.join(where)}"
+
+        rows = read(f"""
+            SELECT e.id, e.first_name, e.last_name, e.salary
+              FROM employees e
+             WHERE e.id IN ({pending})
+          ORDER BY e.last_name, e.first_name
+        """, params)
+        lines = [{"employee_id": r["id"],
+                  "name": f"{r['first_name']} {r['last_name']}".strip(),
+                  "gross": round(float(r["salary"] or 0), 2),
+                  "deducted": 0.0, "applied": []} for r in rows or []]
+
+        if with_loan_deduction and lines:
+            by_emp = {x["employee_id"]: x for x in lines}
+            rows = read(f"""
+                SELECT id, employee_id, balance FROM loans
+                 WHERE balance > 0 AND employee_id IN ({pending})
+              ORDER BY employee_id, date_issued, id
+            """, params)
+            for r in rows or []:
+                x = by_emp[r["employee_id"]]
+                pay = round(min(x["gross"] - x["deducted"], float(r["balance"])), 2)
+                if pay > 0:
+                    x["applied"].append({"loan_id": r["id"], "applied": pay})
+                    x["deducted"] = round(x["deducted"] + pay, 2)
+
+        for x in lines:
+            x["net"] = round(max(x["gross"] - x["deducted"], 0.0), 2)
+        return lines
+
+    def plan_payroll(self, period, employee_ids=None, with_loan_deduction=True):
+        """
+        Vista previa de run_payroll: líneas por empleado pendiente del período. Solo lecturas,
+        sin transacción (no bloquea a otros mientras se confirma); run_payroll vuelve a leer.
+        """
+        self._parse_period(period)
+        return self._payroll_snapshot(self.db.execute_query, period, employee_ids, with_loan_deduction)
+
+    def run_payroll(self, period, employee_ids=None, pay_date=None, payment_method="cash",
+                    register_in_cash=True, with_loan_deduction=True, progress=None, cancel_event=None,
+                    chunk_size=200):
+        """
+        Paga la nómina del período ('YYYY-MM') a los empleados activos (o a employee_ids).
+        Lee una sola vez empleados y préstamos y graba deducciones, movimientos de Caja e
+        historial en una sola transacción (cancelar o un error no deja nada a medias).
+        Los empleados con un pago registrado en el período se omiten, así que volver a
+        ejecutarla completa lo pendiente. progress(hechos, total) avanza por bloques.
+        Devuelve {'run_id', 'period', 'paid', 'gross', 'deducted', 'net', 'status', 'ms'}.
+        """
+        if not self.auth.has_permission('admin'):
+            raise Exception("Solo los administradores pueden procesar nómina")
+        year, month = self._parse_period(period)
+        period = self._yyyymm(year, month)
+        pay_date = pay_date or f"{period}-{calendar.monthrange(year, month)[1]:02d}"
+        user = self.auth.current_user
+        t0 = time.perf_counter()
+
+        with self.db.transaction() as cur:
+            lines = self._payroll_snapshot(lambda q, p: cur.execute(q, p).fetchall(), period, employee_ids,
+                                           with_loan_deduction)
+            total = len(lines)
+            if not lines:
+                cur.execute("SELECT id, status FROM payroll_runs WHERE period = ?", (period,))
+                run = cur.fetchone()
+                print(f"[Payroll] Nómina {period}: no hay empleados pendientes")
+                return {"run_id": run["id"] if run else None, "period": period, "paid": 0,
+                        "status": run["status"] if run else None, "gross": 0.0, "deducted": 0.0,
+                        "net": 0.0, "ms": (time.perf_counter() - t0) * 1000.0}
+            if progress:
+                progress(0, total)
+
+            cur.execute("""
+                INSERT INTO payroll_runs (period, pay_date, payment_method, user_id, updated_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(period) DO UPDATE SET updated_at = CURRENT_TIMESTAMP
+            """, (period, pay_date, payment_method, user))
+            cur.execute("SELECT id FROM payroll_runs WHERE period = ?", (period,))
+            run_id = cur.fetchone()["id"]
+
+            today = datetime.now().strftime('%Y-%m-%d')
+            for start in range(0, total, chunk_size):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ExportCancelled()
+                chunk = lines[start:start + chunk_size]
+                cur.executemany("""
+                    INSERT INTO loan_payments (loan_id, payment_date, amount, notes, user_id, is_payroll_deduction)
+                    VALUES (?, ?, ?, 'Deducción de nómina', ?, 1)
+                """, [(a["loan_id"], pay_date, a["applied"], user) for x in chunk for a in x["applied"]])
+                self.loans.refresh_loan_statuses([a["loan_id"] for x in chunk for a in x["applied"]], today)
+                if register_in_cash:
+                    cash_rows = []
+                    for x in chunk:
+                        if x["deducted"] > 0:
+                            cash_rows.append((pay_date, "income", f"Deducción préstamo vía nómina: {x['name']}",
+                                              x["deducted"], payment_method, "nomina_deduccion_prestamo",
+                                              x["employee_id"]))
+                        if x["net"] > 0:
+                            cash_rows.append((pay_date, "expense", f"Pago de salario: {x['name']}",
+                                              x["net"], payment_method, "nomina_pago", x["employee_id"]))
+                    self.loans.cash.add_transactions(cash_rows)
+                cur.executemany("""
+                    INSERT INTO payroll_history (employee_id, pay_date, gross_salary, total_deducted, net_paid,
+                                                 payment_method, registered_in_cash, user_id, period, run_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, [(x["employee_id"], pay_date, x["gross"], x["deducted"], x["net"], payment_method,
+                       1 if register_in_cash else 0, user, period, run_id) for x in chunk])
+                if progress:
+                    progress(start + len(chunk), total)
+
+            # totales de la corrida (incluye lo pagado en ejecuciones anteriores del período)
+            cur.execute("""
+                UPDATE payroll_runs
+                   SET employees = (SELECT COUNT(*) FROM payroll_history WHERE run_id = :run),
+                       gross_salary = (SELECT COALESCE(ROUND(SUM(gross_salary), 2), 0)
+                                         FROM payroll_history WHERE run_id = :run),
+                       total_deducted = (SELECT COALESCE(ROUND(SUM(total_deducted), 2), 0)
+                                           FROM payroll_history WHERE run_id = :run),
+                       net_paid = (SELECT COALESCE(ROUND(SUM(net_paid), 2), 0)
+                                     FROM payroll_history WHERE run_id = :run),
+                       status = CASE WHEN EXISTS (
+                                    SELECT 1 FROM employees e
+                                     WHERE e.is_active = 1 AND e.salary > 0
+                                       AND NOT EXISTS (SELECT 1 FROM payroll_history h
+                                                        WHERE h.period = :period AND h.employee_id = e.id))
+                                     THEN 'partial' ELSE 'completed' END,
+                       updated_at = CURRENT_TIMESTAMP
+                 WHERE id = :run
+            """, {"run": run_id, "period": period})
+            cur.execute("SELECT status FROM payroll_runs WHERE id = ?", (run_id,))
+            status = cur.fetchone()["status"]
+
+        ms = (time.perf_counter() - t0) * 1000.0
+        res = {"run_id": run_id, "period": period, "paid": total, "status": status,
+               "gross": round(sum(x["gross"] for x in lines), 2),
+               "deducted": round(sum(x["deducted"] for x in lines), 2),
+               "net": round(sum(x["net"] for x in lines), 2), "ms": ms}
+        print(f"[Payroll] Nómina {period}: {total} empleado(s) pagado(s), neto ${res['net']:,.2f}, "
+              f"corrida {status}, {ms:.1f} ms")
+        return res
+
+    def get_payroll_runs(self):
+        rows = self.db.execute_query("SELECT * FROM payroll_runs ORDER BY period DESC")
+        return [dict(r) for r in rows] if rows else []
+
     def process_salary_payment(self, employee_id: int, date: str,
                                payment_method: str = "cash",
                                register_in_cash: bool = True,
                                with_loan_deduction: bool = True):
         """Paga salario desde Nómina. Si with_loan_deduction=True,
-        descuenta automáticamente saldos de préstamos del empleado."""
+        descuenta automáticamente saldos de préstamos del empleado.
+        Deducciones, Caja y payroll_history se graban en una sola transacción."""
         if not self.auth.has_permission('admin'):
             raise Exception("Solo los administradores pueden procesar nómina")
 
@@ -147,51 +575,42 @@ class PayrollController:
         gross = float(emp["salary"] or 0)
         if gross <= 0:
             raise Exception("El salario configurado para el empleado es 0")
-
         total_deducted = 0.0
         breakdown = []
 
-        if with_loan_deduction:
-            # mismos criterios que LoansController.process_payroll_payment (deducción marcada)
-            loans = self.loans.get_loans(employee_id=employee_id)
-            loans_with_balance = []
-            for L in loans:
-                s = self.loans.get_loan_summary(L['id'])
-                if s and s['balance'] > 0:
-                    loans_with_balance.append((L, s['balance']))
-            loans_with_balance.sort(key=lambda t: t[0]['date_issued'])
-
-            remaining = gross
-            for loan, bal in loans_with_balance:
-                if remaining <= 0:
-                    break
-                pay = min(remaining, bal)
-                self.loans.add_payment(
-                    loan_id=loan['id'], payment_date=date, amount=pay,
-                    notes="Deducción de nómina", register_in_cash=False,
-                    payment_method=payment_method, is_payroll_deduction=True
-                )
-                remaining -= pay
-                total_deducted += pay
-                breakdown.append({"loan_id": loan['id'], "applied": round(pay, 2)})
-
-        net = max(gross - total_deducted, 0.0)
-
-        if register_in_cash:
-            emp_name = self.loans.format_employee_name(emp)
-            if total_deducted > 0:
-                # ingreso por deducción
-                from modules.cash_register.controller import CashRegisterController
-                cash = CashRegisterController(self.db, self.auth)
-                cash.add_transaction(date, "income",
-                                     f"Deducción préstamo vía nómina: {emp_name}",
-                                     round(total_deducted, 2), payment_method, "nomina_deduccion_prestamo")
-            if net > 0:
-                from modules.cash_register.controller import CashRegisterController
-                cash = CashRegisterController(self.db, self.auth)
-                cash.add_transaction(date, "expense",
-                                     f"Pago de salario: {emp_name}",
-                                     round(net, 2), payment_method, "nomina_pago")
+        with self.db.transaction():
+            self.loans.ensure_period_unpaid(employee_id, date[:7])
+            if with_loan_deduction:
+                # mismos criterios que LoansController.process_payroll_payment (más antiguo primero)
+                rows = self.db.execute_query(
+                    "SELECT COALESCE(SUM(balance), 0) AS open FROM loans WHERE employee_id=? AND balance > 0",
+                    (employee_id,))
+                to_deduct = round(min(gross, float(rows[0]["open"]) if rows else 0.0), 2)
+                if to_deduct > 0:
+                    res = self.loans.allocate_payment(employee_id, to_deduct, "oldest", payment_date=date,
+                                                      notes="Deducción de nómina", register_in_cash=False,
+                                                      payment_method=payment_method, is_payroll_deduction=True)
+                    total_deducted = res["total_applied"]
+                    breakdown = [{"loan_id": x["loan_id"], "applied": x["applied"]} for x in res["applied"]]
+
+            net = max(gross - total_deducted, 0.0)
+
+            if register_in_cash:
+                emp_name = self.loans.format_employee_name(emp)
+                cash = self.loans.cash
+                if total_deducted > 0:
+                    # ingreso por deducción
+                    cash.add_transaction(date, "income",
+                                         f"Deducción préstamo vía nómina: {emp_name}",
+                                         round(total_deducted, 2), payment_method, "nomina_deduccion_prestamo",
+                                         employee_id=employee_id)
+                if net > 0:
+                    cash.add_transaction(date, "expense",
+                                         f"Pago de salario: {emp_name}",
+                                         round(net, 2), payment_method, "nomina_pago",
+                                         employee_id=employee_id)
+            self.loans.record_payroll_history(employee_id, date, gross, total_deducted, net,
+                                              payment_method, register_in_cash)
 
         return {
             "employee": self.loans.format_employee_name(emp),
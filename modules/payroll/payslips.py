@@ -0,0 +1,125 @@
+# modules/payroll/payslips.py
+"""
+Recibos de pago de salario en PDF (uno por empleado y, opcionalmente, un archivo combinado)
+- Los datos llegan ya leídos (PayrollController.get_payslip_data, una sola consulta) como
+  dicts simples, así se pueden enviar a otros procesos
+- Cada PDF se arma en un proceso del pool (ProcessPoolExecutor): reportlab no libera el GIL,
+  con procesos se usan todos los núcleos; el archivo combinado se genera en paralelo con el resto
+- Sin ventanas ni base de datos aquí: los procesos de trabajo solo importan este módulo,
+  utils.cancel y reportlab
+"""
+import os
+import re
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils.cancel import ExportCancelled
+
+METHOD_LABELS = {"cash": "Efectivo", "transfer": "Transferencia"}
+
+
+def payslip_filename(slip):
+    """recibo_AAAA-MM_<id>_<nombre>.pdf (solo caracteres seguros para el sistema de archivos)."""
+    name = unicodedata.normalize("NFKD", slip["name"]).encode("ascii", "ignore").decode()
+    name = re.sub(r"[^A-Za-z0-9]+", "_", name).strip("_") or "empleado"
+    return f"recibo_{slip['period']}_{slip['employee_id']}_{name}.pdf"
+
+
+def _money(v):
+    return f"${float(v or 0):,.2f}"
+
+
+def render_payslips(path, slips, title="Recibo de pago de salario"):
+    """Escribe en path un recibo por página para cada slip. Devuelve path."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
+    from reportlab.lib.styles import getSampleStyleSheet
+    from xml.sax.saxutils import escape
+
+    doc = SimpleDocTemplate(path, pagesize=A4, leftMargin=36, rightMargin=36, topMargin=36, bottomMargin=36,
+                            title=title)
+    styles = getSampleStyleSheet()
+    story = []
+    for i, s in enumerate(slips):
+        if i:
+            story.append(PageBreak())
+        story.append(Paragraph(f"<b>{escape(title)}</b>", styles["Title"]))
+        story.append(Paragraph(
+            f"Empleado: <b>{escape(s['name'])}</b> &nbsp;&nbsp;|&nbsp;&nbsp; ID: {s['employee_id']}",
+            styles["Normal"]))
+        story.append(Paragraph(
+            f"Período: <b>{s['period']}</b> &nbsp;&nbsp;|&nbsp;&nbsp; Fecha de pago: {s['pay_date']}"
+            f" &nbsp;&nbsp;|&nbsp;&nbsp; Forma de pago: "
+            f"{METHOD_LABELS.get(s['payment_method'], s['payment_method'])}",
+            styles["Normal"]))
+        story.append(Spacer(0, 14))
+
+        rows = [["Concepto", "Monto"], ["Salario bruto", _money(s["gross"])]]
+        for loan_id, amount in s.get("deductions") or []:
+            rows.append([f"Deducción préstamo #{loan_id}", "-" + _money(amount)])
+        rows.append(["Total deducciones", "-" + _money(s["deducted"])])
+        rows.append(["Neto pagado", _money(s["net"])])
+        tbl = Table(rows, colWidths=[doc.width * 0.65, doc.width * 0.35])
+        tbl.setStyle(TableStyle([
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f0f0f0')),
+            ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+            ('GRID', (0, 0), (-1, -1), 0.25, colors.HexColor('#cccccc')),
+            ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+            ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#e3f2fd')),
+        ]))
+        story.append(tbl)
+        story.append(Spacer(0, 60))
+        story.append(Paragraph("______________________________", styles["Normal"]))
+        story.append(Paragraph("Recibí conforme", styles["Normal"]))
+    doc.build(story)
+    return path
+
+
+def generate_payslips(slips, out_dir, merged_path=None, workers=None, progress=None, cancel_event=None):
+    """
+    Un PDF por recibo en out_dir (y todos juntos en merged_path si se indica), repartidos
+    en un pool de procesos (workers=None: uno por núcleo). progress(hechos, total) tras cada
+    archivo; cancel_event detiene el lote y borra los archivos que generó esta llamada
+    (los que ya existían con el mismo nombre y no llegaron a reescribirse quedan intactos).
+    Devuelve la lista de rutas escritas (el combinado al final).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(os.path.join(out_dir, payslip_filename(s)), [s]) for s in slips]
+    if merged_path:
+        jobs.insert(0, (merged_path, list(slips)))  # el más largo primero: corre junto con los demás
+    total = len(jobs)
+    written = []
+    if progress:
+        progress(0, total)
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    futures = []
+    try:
+        for path, group in jobs:
+            futures.append(pool.submit(render_payslips, path, group))
+        for done, f in enumerate(as_completed(futures), start=1):
+            written.append(f.result())
+            if progress:
+                progress(done, total)
+            if cancel_event is not None and cancel_event.is_set():
+                raise ExportCancelled()
+    except BaseException:
+        pool.shutdown(wait=True, cancel_futures=True)
+        # además de los ya recibidos, los que terminaron mientras se cerraba el pool
+        for f in futures:
+            if f.done() and not f.cancelled() and f.exception() is None and f.result() not in written:
+                written.append(f.result())
+        for path in written:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        raise
+    pool.shutdown(wait=True)
+
+    if merged_path:
+        written.remove(merged_path)
+        written.append(merged_path)
+    return written
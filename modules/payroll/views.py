@@ -3,13 +3,18 @@ Vista de Nómina mensual
 - Seleccionar año/mes
 - Ver por empleado: salario bruto, deducción préstamos, neto (calc.), neto en Caja, diferencia, #préstamos
 - Exportar PDF
+- Resumen anual (neto pagado por mes, desde el historial de nómina)
+- Recibos de pago en PDF por empleado (generados en paralelo, en segundo plano)
+- Pagar salario a un empleado o la nómina del mes a todos los activos (en segundo plano)
 """
 
+import os
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from tkcalendar import DateEntry
 from datetime import datetime
 from modules.payroll.controller import PayrollController
+from utils.report_export import run_in_background, reportlab_available
 
 PAY_TO_CODE = {"Efectivo": "cash", "Transferencia": "transfer"}
 
@@ -52,6 +57,8 @@ class PayrollReportView:
         ttk.Button(top, text="Generar", command=self.refresh_report).pack(side=tk.LEFT)
         ttk.Button(top, text="Actualizar", command=self.refresh_report).pack(side=tk.LEFT, padx=(6,0))
         ttk.Button(top, text="Exportar PDF", command=self.export_pdf).pack(side=tk.LEFT, padx=(6,0))
+        ttk.Button(top, text="Resumen anual", command=self.show_annual_report).pack(side=tk.LEFT, padx=(6,0))
+        ttk.Button(top, text="Recibos de pago", command=self.export_payslips).pack(side=tk.LEFT, padx=(6,0))
 
         pay_frame = ttk.LabelFrame(container, text="Pago de salario", padding=8)
         pay_frame.pack(fill=tk.X, pady=(0, 8))
@@ -79,7 +86,13 @@ class PayrollReportView:
             .grid(row=1, column=2, columnspan=2, sticky=tk.W)
 
         ttk.Button(pay_frame, text="Pagar salario", command=self._do_pay_salary)\
+            .grid(row=1, column=4, sticky=tk.E, padx=(8, 0))
+        ttk.Button(pay_frame, text="Pagar nómina del mes", command=self._do_run_payroll)\
             .grid(row=1, column=5, sticky=tk.E, padx=(8, 0))
+        ttk.Label(pay_frame, foreground="#666666",
+                  text="La nómina se paga una sola vez por empleado y mes (pago individual o del mes completo). "
+                       "Los adelantos o pagos quincenales se registran como préstamo y se descuentan en la nómina.")\
+            .grid(row=2, column=0, columnspan=6, sticky=tk.W, pady=(4, 0))
 
         for c in (1,3,5):
             pay_frame.columnconfigure(c, weight=1)
@@ -325,3 +338,123 @@ class PayrollReportView:
         except Exception as e:
             messagebox.showerror("Nómina", str(e))
 
+    def _do_run_payroll(self):
+        """Paga la nómina del mes seleccionado a todos los empleados activos pendientes."""
+        year, month = self._parse_year_month()
+        period = f"{year}-{month:02d}"
+        date = self.pay_date.get_date().strftime('%Y-%m-%d')
+        method = PAY_TO_CODE[self.pay_method.get()]
+        reg = self.chk_register_cash.get()
+        with_ded = self.chk_with_deduction.get()
+        try:
+            lines = self.controller.plan_payroll(period, with_loan_deduction=with_ded)
+        except Exception as e:
+            messagebox.showerror("Nómina", str(e))
+            return
+        if not lines:
+            messagebox.showinfo("Nómina", f"No hay empleados pendientes de pago en {period}.")
+            return
+        gross = sum(x["gross"] for x in lines)
+        deducted = sum(x["deducted"] for x in lines)
+        net = sum(x["net"] for x in lines)
+        if not messagebox.askyesno(
+                "Nómina",
+                f"Pagar la nómina de {period} con fecha {date}:\n\n"
+                f"Empleados: {len(lines)}\n"
+                f"Salario bruto: ${gross:,.2f}\n"
+                f"Deducido a préstamos: ${deducted:,.2f}\n"
+                f"Neto a pagar: ${net:,.2f}\n\n¿Continuar?"):
+            return
+
+        def job(progress, cancel_event):
+            return self.controller.run_payroll(
+                period, pay_date=date, payment_method=method, register_in_cash=reg,
+                with_loan_deduction=with_ded, progress=progress, cancel_event=cancel_event)
+
+        def done(res):
+            messagebox.showinfo(
+                "Nómina",
+                f"Nómina {res['period']}: {res['paid']} empleado(s) pagado(s)\n"
+                f"Deducido a préstamos: ${res['deducted']:,.2f}\n"
+                f"Pagado (neto): ${res['net']:,.2f}")
+            self.refresh_report()
+
+        run_in_background(self.parent, "Nómina", job, on_success=done,
+                          error_text="No se pudo procesar la nómina",
+                          cancel_text="Pago de nómina cancelado: no se grabó ningún pago.")
+
+    def show_annual_report(self):
+        """Nómina pagada del año por empleado y mes (payroll_history)."""
+        year, _ = self._parse_year_month()
+        win = tk.Toplevel(self.parent)
+        win.title(f"Resumen anual de nómina {year}")
+        win.geometry("1100x480")
+
+        month_names = ("Ene", "Feb", "Mar", "Abr", "May", "Jun", "Jul", "Ago", "Sep", "Oct", "Nov", "Dic")
+        columns = ("name",) + tuple(f"m{i}" for i in range(1, 13)) + ("gross", "deduct", "net")
+        tree = ttk.Treeview(win, columns=columns, show="headings")
+        tree.heading("name", text="Empleado")
+        tree.column("name", width=180, anchor=tk.W)
+        for i, label in enumerate(month_names, start=1):
+            tree.heading(f"m{i}", text=label)
+            tree.column(f"m{i}", width=62, anchor=tk.E)
+        for c, label in (("gross", "Bruto"), ("deduct", "Deducido"), ("net", "Neto pagado")):
+            tree.heading(c, text=label)
+            tree.column(c, width=95, anchor=tk.E)
+        ysb = ttk.Scrollbar(win, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=ysb.set)
+        ysb.pack(side=tk.RIGHT, fill=tk.Y)
+        tree.pack(fill=tk.BOTH, expand=True, padx=8, pady=(8, 0))
+        total_lbl = ttk.Label(win, text="", font=('Segoe UI', 9, 'bold'))
+        total_lbl.pack(anchor=tk.E, padx=8, pady=6)
+
+        try:
+            rows, months, totals = self.controller.get_annual_report(year)
+        except Exception as e:
+            messagebox.showerror("Nómina", f"No se pudo generar el resumen:\n{e}", parent=win)
+            return
+        if not rows:
+            tree.insert("", tk.END, values=("— Sin pagos registrados —",) + ("",) * 15)
+        for r in rows:
+            per_month = tuple(f"{r['months'][m]:,.2f}" if m in r["months"] else "" for m in months)
+            tree.insert("", tk.END, values=(r["name"],) + per_month + (
+                f"${r['gross']:,.2f}", f"${r['deduct']:,.2f}", f"${r['net']:,.2f}"))
+        total_lbl.config(text=f"Totales {year}: Bruto=${totals['gross']:,.2f} | "
+                              f"Deducciones=${totals['deduct']:,.2f} | Neto=${totals['net']:,.2f} | "
+                              f"Pagos: {totals['payments']}")
+
+    def export_payslips(self):
+        """Recibos de pago del mes seleccionado: un PDF por empleado pagado y uno combinado opcional."""
+        if not reportlab_available():
+            messagebox.showerror("Falta dependencia", "Para generar PDF necesitas instalar reportlab:\n\npip install reportlab")
+            return
+        year, month = self._parse_year_month()
+        period = f"{year}-{month:02d}"
+        try:
+            count = len(self.controller.get_payslip_data(period))
+        except Exception as e:
+            messagebox.showerror("Nómina", str(e))
+            return
+        if not count:
+            messagebox.showwarning("Nómina", f"No hay pagos de nómina registrados en {period}.")
+            return
+        out_dir = filedialog.askdirectory(title=f"Carpeta para los recibos de {period}")
+        if not out_dir:
+            return
+        merged = messagebox.askyesno(
+            "Nómina", f"Se generarán {count} recibo(s).\n\n¿Generar también un archivo con todos los recibos?")
+        merged_path = os.path.join(out_dir, f"recibos_{period}.pdf") if merged else None
+
+        def job(progress, cancel_event):
+            return self.controller.export_payslips(period, out_dir, merged_path=merged_path,
+                                                   progress=progress, cancel_event=cancel_event)
+
+        def done(res):
+            msg = f"{res['files']} recibo(s) generado(s) en:\n{out_dir}"
+            if res["merged"]:
+                msg += f"\n\nArchivo combinado:\n{res['merged']}"
+            messagebox.showinfo("Nómina", msg)
+
+        run_in_background(self.parent, "Recibos de pago", job, on_success=done,
+                          error_text="No se pudieron generar los recibos",
+                          cancel_text="Generación de recibos cancelada.")
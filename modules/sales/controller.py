@@ -5,12 +5,14 @@ Módulo de Ventas
 - Descuenta costales
 - Registra ingreso en Caja (opcional)
 - Lista/Reporta ventas
+- Idempotencia por clave (ventas reenviadas desde la cola local, ver journal.py)
 """
 
 from datetime import datetime
 from typing import Optional, List, Dict, Tuple
 from modules.loans.controller import LoansController
 from modules.inventory.controller import InventoryController  # Reutilizamos validaciones y helpers
+from utils.export import export_rows
 
 
 class SalesController:
@@ -19,12 +21,27 @@ class SalesController:
         self.auth = auth_manager
         self.cash = cash_controller
         self.inv = InventoryController(database, auth_manager)
+        self._ensure_schema()
+
+    def _ensure_schema(self):
+        """Tabla de claves de idempotencia ya aplicadas (se escribe en la misma transacción que la venta)."""
+        self.db.execute_query("""
+            CREATE TABLE IF NOT EXISTS sales_journal_applied (
+                idempotency_key TEXT PRIMARY KEY,
+                sale_id INTEGER NOT NULL,
+                applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
 
     # -------------------------
     # Consultas de apoyo
     # -------------------------
-    def get_last_sale_price(self, potato_type: str, quality: str):
-        return self.inv.get_reference_price(potato_type, quality)
+    def get_last_sale_price(self, potato_type: str, quality: str, customer: str = ""):
+        """Precio sugerido: último del cliente > referencia > última venta > última compra."""
+        return self.inv.suggest_sale_price(potato_type, quality, customer)
+
+    def get_price_hints(self, potato_type: str, quality: str, customer: str = ""):
+        return self.inv.get_price_hints(potato_type, quality, customer)
 
     def get_stock(self, potato_type: str, quality: str) -> int:
         return self.inv.get_current_stock(potato_type, quality)
@@ -46,10 +63,15 @@ class SalesController:
         customer: str,
         notes: str = "",
         register_cash: bool = True,
+        idempotency_key: Optional[str] = None,
     ) -> int:
+        """
+        Registra la venta (salida de inventario + costales + Caja) en una sola transacción.
+        Si se indica idempotency_key y ya fue aplicada, devuelve la venta existente sin duplicarla.
+        """
         if not self.auth.current_user:
             raise Exception("Usuario no autenticado")
-        
+
         # 1) Validaciones
         potato_type, quality = self.inv.validate_type_quality(potato_type, quality)
         if quantity <= 0:
@@ -57,35 +79,54 @@ class SalesController:
         if sale_unit_price < 0:
             raise ValueError("El precio unitario no puede ser negativo")
 
-        stock = self.get_stock(potato_type, quality)
-        if stock < quantity:
-            raise ValueError(
-                f"Stock insuficiente de {potato_type} {quality}. Disponible: {stock}, solicitado: {quantity}"
-            )
+        try:
+            with self.db.transaction():
+                if idempotency_key:
+                    done = self.db.execute_query(
+                        "SELECT sale_id FROM sales_journal_applied WHERE idempotency_key=?", (idempotency_key,)
+                    )
+                    if done:
+                        return int(done[0]["sale_id"])
 
-        sacks = self.get_sacks()
-        if sacks < quantity:
-            raise ValueError(
-                f"No hay suficientes costales. En stock: {sacks}, requeridos: {quantity}"
-            )
+                stock = self.get_stock(potato_type, quality)
+                if stock < quantity:
+                    raise ValueError(
+                        f"Stock insuficiente de {potato_type} {quality}. Disponible: {stock}, solicitado: {quantity}"
+                    )
 
-        # 2) Registrar salida (esto descuenta stock y costales)
-        sale_id = self.inv.add_inventory_record(
-            date=date,
-            potato_type=potato_type,
-            quality=quality,
-            operation="exit",
-            quantity=quantity,
-            unit_price=sale_unit_price,
-            supplier_customer=customer,
-            notes=notes,
-        )
+                sacks = self.get_sacks()
+                if sacks < quantity:
+                    raise ValueError(
+                        f"No hay suficientes costales. En stock: {sacks}, requeridos: {quantity}"
+                    )
+
+                # 2) Registrar salida (esto descuenta stock y costales)
+                sale_id = self.inv.add_inventory_record(
+                    date=date,
+                    potato_type=potato_type,
+                    quality=quality,
+                    operation="exit",
+                    quantity=quantity,
+                    unit_price=sale_unit_price,
+                    supplier_customer=customer,
+                    notes=notes,
+                )
 
-        # 3) Caja (opcional)
-        if register_cash:
-            total = round(quantity * sale_unit_price, 2)
-            desc = f"Venta {potato_type} {quality} ({quantity} bultos)"
-            self.cash.add_transaction(date, "income", desc, total, payment_method, "venta")
+                # 3) Caja (opcional)
+                if register_cash:
+                    total = round(quantity * sale_unit_price, 2)
+                    desc = f"Venta {potato_type} {quality} ({quantity} bultos)"
+                    self.cash.add_transaction(date, "income", desc, total, payment_method, "venta")
+
+                if idempotency_key:
+                    self.db.execute_query(
+                        "INSERT INTO sales_journal_applied (idempotency_key, sale_id) VALUES (?, ?)",
+                        (idempotency_key, sale_id),
+                    )
+        except Exception:
+            # la salida se revirtió: descartar el precio que ya se anotó en memoria
+            self.inv.hints.invalidate()
+            raise
 
         return sale_id
 
@@ -103,6 +144,23 @@ class SalesController:
         Devuelve ventas (po. inventario con operation='exit') con:
         - payment_method (si se registró en caja con desc y monto coincidente)
         """
+        sql, params = self._sales_query(start_date, end_date, potato_type, quality)
+        rows = self.db.execute_query(sql, params)
+        return [dict(r) for r in rows] if rows else []
+
+    def iter_sales(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        potato_type: Optional[str] = None,
+        quality: Optional[str] = None,
+        chunk_size: int = 500,
+    ):
+        """Mismo resultado que list_sales, entregado por bloques (para exportaciones grandes)."""
+        sql, params = self._sales_query(start_date, end_date, potato_type, quality)
+        return self.db.stream_query(sql, params, chunk_size)
+
+    def _sales_query(self, start_date, end_date, potato_type, quality):
         q = [
             "SELECT pi.*, u.username,",
             "  (SELECT cr.payment_method FROM cash_register cr",
@@ -132,8 +190,7 @@ class SalesController:
             params.append(quality)
 
         q.append("ORDER BY pi.date DESC, pi.created_at DESC")
-        rows = self.db.execute_query(" ".join(q), tuple(params) if params else None)
-        return [dict(r) for r in rows] if rows else []
+        return " ".join(q), (tuple(params) if params else None)
 
     def get_sales_totals(
         self,
@@ -144,7 +201,7 @@ class SalesController:
     ) -> Dict[str, float]:
         """Totales rápidos del mismo filtro que list_sales."""
         q = [
-            "SELECT COALESCE(SUM(quantity),0) AS qty, COALESCE(SUM(total_value),0) AS total",
+            "SELECT COUNT(*) AS n, COALESCE(SUM(quantity),0) AS qty, COALESCE(SUM(total_value),0) AS total",
             "FROM potato_inventory WHERE operation='exit'"
             "  AND COALESCE(supplier_customer,'') <> 'ajuste'"
         ]
@@ -158,8 +215,34 @@ class SalesController:
         if quality:
             q.append("AND LOWER(quality) = LOWER(?)"); params.append(quality)
         rows = self.db.execute_query(" ".join(q), tuple(params) if params else None)
-        r = dict(rows[0]) if rows else {"qty":0, "total":0.0}
-        return {"quantity": float(r.get("qty") or 0), "amount": float(r.get("total") or 0.0)}
+        r = dict(rows[0]) if rows else {"n": 0, "qty":0, "total":0.0}
+        return {"count": int(r.get("n") or 0),
+                "quantity": float(r.get("qty") or 0), "amount": float(r.get("total") or 0.0)}
+
+    def export_sales(
+        self,
+        path: str,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        potato_type: Optional[str] = None,
+        quality: Optional[str] = None,
+        progress=None,
+        cancel_event=None,
+    ) -> int:
+        """Ventas del filtro a CSV / CSV.GZ / XLSX (según la extensión de path), por bloques."""
+        total = self.get_sales_totals(start_date, end_date, potato_type, quality)["count"]
+        return export_rows(
+            path,
+            ["ID", "Fecha", "Tipo", "Calidad", "Bultos", "Precio unitario", "Total",
+             "Cliente", "Método de pago", "Notas", "Usuario"],
+            self.iter_sales(start_date, end_date, potato_type, quality, chunk_size=1000),
+            row_mapper=lambda r: [r["id"], r["date"], r["potato_type"], r["quality"], int(r["quantity"]),
+                                  float(r["unit_price"]), float(r["total_value"]),
+                                  r.get("supplier_customer") or "", r.get("payment_method") or "",
+                                  r.get("notes") or "", r.get("username") or ""],
+            sheet_title="Ventas",
+            total_rows=total, progress=progress, cancel_event=cancel_event,
+        )
 
     def get_sales_report(
         self,
@@ -0,0 +1,205 @@
+"""
+Cola local (write-ahead) de ventas para cuando la base está bloqueada
+- Cada venta se anota en un archivo JSONL de solo-anexar (con fsync) junto a su clave de idempotencia
+- Un hilo de reproducción las aplica en orden con reintentos y espera creciente
+- Los conflictos (p.ej. stock insuficiente) se informan a la UI mediante una cola
+La clave de idempotencia se guarda en la tabla sales_journal_applied dentro de la
+misma transacción de la venta, así una entrada nunca se aplica dos veces.
+"""
+
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from typing import Dict, List
+
+
+def new_idempotency_key() -> str:
+    return uuid.uuid4().hex
+
+
+def is_locked_error(exc: Exception) -> bool:
+    """True si el error es de base ocupada/bloqueada (reintentable)."""
+    if not isinstance(exc, sqlite3.OperationalError):
+        return False
+    msg = str(exc).lower()
+    return "locked" in msg or "busy" in msg
+
+
+class SalesJournal:
+    """
+    Archivo JSONL local. Líneas:
+      {"op": "sale", "key": ..., "sale": {...}, "queued_at": ...}
+      {"op": "applied" | "conflict", "key": ..., "sale_id" | "error": ..., "at": ...}
+    Una venta está pendiente mientras no tenga línea 'applied' ni 'conflict'.
+    Lo pendiente se mantiene en memoria (se lee el archivo una vez y se actualiza en cada
+    anotación); solo se vuelve a leer si el archivo cambió fuera de esta instancia.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._pending: Dict[str, Dict] = {}  # clave -> línea 'sale', en orden de anotación
+        self._size = None  # tamaño del archivo tras nuestra última lectura/escritura
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    @classmethod
+    def for_database(cls, database) -> "SalesJournal":
+        """Diario local del usuario, uno por archivo de base de datos."""
+        db_path = os.path.abspath(database.db_name)
+        tag = hashlib.sha1(db_path.encode("utf-8")).hexdigest()[:10]
+        folder = os.path.join(os.path.expanduser("~"), ".papasoft")
+        return cls(os.path.join(folder, f"sales_journal_{tag}.jsonl"))
+
+    # ------------------------------
+    # Escritura
+    # ------------------------------
+    def _append(self, record: Dict):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._sync()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._size = os.path.getsize(self.path)
+            if record["op"] == "sale":
+                self._pending[record["key"]] = record
+            else:
+                self._pending.pop(record["key"], None)
+
+    def append_sale(self, key: str, sale: Dict) -> str:
+        """Anota una venta pendiente; sale contiene los argumentos de SalesController.create_sale."""
+        self._append({"op": "sale", "key": key, "sale": sale,
+                      "queued_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+        return key
+
+    def mark_applied(self, key: str, sale_id: int):
+        self._append({"op": "applied", "key": key, "sale_id": int(sale_id),
+                      "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+
+    def mark_conflict(self, key: str, error: str):
+        self._append({"op": "conflict", "key": key, "error": str(error),
+                      "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+
+    # ------------------------------
+    # Lectura
+    # ------------------------------
+    def _read(self) -> List[Dict]:
+        if not os.path.exists(self.path):
+            return []
+        out = []
+        with self._lock:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        out.append(json.loads(line))
+                    except ValueError:
+                        # última línea truncada por un corte: se ignora
+                        print(f"[SalesJournal] Línea inválida ignorada en {self.path}")
+        return out
+
+    def _sync(self):
+        """Relee el archivo solo la primera vez o si otra sesión lo modificó (cambió su tamaño)."""
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size == self._size:
+            return
+        records = self._read()
+        resolved = {r["key"] for r in records if r.get("op") in ("applied", "conflict")}
+        self._pending = {r["key"]: r for r in records if r.get("op") == "sale" and r["key"] not in resolved}
+        self._size = size
+
+    def pending(self) -> List[Dict]:
+        """Ventas sin resolver, en el orden en que se anotaron."""
+        with self._lock:
+            self._sync()
+            return list(self._pending.values())
+
+    def compact(self):
+        """Reescribe el archivo dejando solo lo pendiente (si ya no queda nada, lo vacía)."""
+        tmp = self.path + ".tmp"
+        with self._lock:  # bloqueo durante la reescritura: no perder anotaciones concurrentes
+            self._sync()
+            with open(tmp, "w", encoding="utf-8") as f:
+                for r in self._pending.values():
+                    f.write(json.dumps(r, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            self._size = os.path.getsize(self.path)
+
+
+class SalesJournalReplayer(threading.Thread):
+    """
+    Aplica las ventas pendientes del diario en orden. Si la base sigue bloqueada
+    espera (1s, 2s, 4s … hasta max_backoff) y reintenta desde la misma entrada.
+    Publica eventos en self.events:
+      ("applied", key, sale_id) | ("conflict", key, sale, mensaje)
+    """
+
+    def __init__(self, controller, journal: SalesJournal, max_backoff: float = 60.0):
+        super().__init__(daemon=True, name="SalesJournalReplayer")
+        self.controller = controller
+        self.journal = journal
+        self.max_backoff = float(max_backoff)
+        self.events: "queue.Queue" = queue.Queue()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._backoff = 0.0
+
+    def wake(self):
+        """Pide un intento inmediato (p.ej. tras anotar una venta nueva)."""
+        self._backoff = 0.0
+        self._wake.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                self.replay_pending()
+            except Exception as e:
+                print(f"[SalesJournalReplayer] Error inesperado: {e}")
+                self._backoff = max(1.0, self._backoff)
+            # sin pendientes: revisar cada 30s por si quedó algo de otra sesión
+            self._wake.wait(self._backoff or 30.0)
+            self._wake.clear()
+
+    def replay_pending(self) -> int:
+        """Intenta aplicar todo lo pendiente; devuelve cuántas ventas se aplicaron."""
+        applied = resolved = 0
+        try:
+            for rec in self.journal.pending():
+                if self._stopping.is_set():
+                    break
+                key, sale = rec["key"], rec["sale"]
+                try:
+                    sale_id = self.controller.create_sale(idempotency_key=key, **sale)
+                except Exception as e:
+                    if is_locked_error(e):
+                        # conservar el orden: se reintenta desde esta misma entrada
+                        self._backoff = min(self.max_backoff, (self._backoff * 2) or 1.0)
+                        return applied
+                    self.journal.mark_conflict(key, str(e))
+                    self.events.put(("conflict", key, sale, str(e)))
+                    resolved += 1
+                    continue
+                self.journal.mark_applied(key, sale_id)
+                self.events.put(("applied", key, sale_id))
+                applied += 1
+                resolved += 1
+            self._backoff = 0.0
+        finally:
+            # el archivo queda solo con lo pendiente tras cada pasada que resolvió algo
+            if resolved:
+                self.journal.compact()
+        return applied
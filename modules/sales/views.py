@@ -3,15 +3,21 @@ Vista de Ventas (Tkinter + ttk)
 - Registrar venta (impacta inventario, costales y Caja)
 - Historial con filtros (fecha, tipo, calidad)
 - Totales y Exportar PDF
+- Cola local de ventas si la base está bloqueada (se reenvían solas en segundo plano)
 """
 
+import queue
+import sqlite3
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from tkcalendar import DateEntry
 from datetime import datetime, timedelta
 
 from modules.sales.controller import SalesController
+from modules.sales.journal import (SalesJournal, SalesJournalReplayer,
+                                   new_idempotency_key, is_locked_error)
 from modules.inventory.controller import VALID_COMBOS
+from utils.report_export import write_table_pdf, run_in_background, reportlab_available
 
 PAY_TO_CODE = {"Efectivo": "cash", "Transferencia": "transfer"}
 CODE_TO_PAY = {"cash": "Efectivo", "transfer": "Transferencia"}
@@ -24,11 +30,19 @@ class SalesView:
         self.auth = auth_manager
         self.controller = SalesController(database, auth_manager, cash_controller)
 
+        # Cola local + hilo que reenvía las ventas pendientes (también las de sesiones anteriores)
+        self.journal = SalesJournal.for_database(database)
+        self.replayer = SalesJournalReplayer(self.controller, self.journal)
+
         self._build_ui()
         self._auto_fill_price()
         self._refresh_stock_labels()
         self._load_sales()  # al abrir, ver últimos 30 días
 
+        self.replayer.start()
+        self._update_queue_label()
+        self.parent.after(1000, self._poll_journal_events)
+
     # ---------------------------
     # UI
     # ---------------------------
@@ -76,6 +90,10 @@ class SalesView:
         self.unit_price_entry.grid(row=row, column=1, sticky=tk.EW, pady=2, padx=(5, 0))
         row += 1
 
+        self.price_hint_lbl = ttk.Label(left, text="", foreground="#666", font=('Segoe UI', 8))
+        self.price_hint_lbl.grid(row=row, column=0, columnspan=2, sticky=tk.W)
+        row += 1
+
         self.manual_price = tk.BooleanVar(value=False)
         ttk.Checkbutton(
             left, text="Editar precio manualmente", variable=self.manual_price,
@@ -98,6 +116,11 @@ class SalesView:
         ttk.Label(left, text="Cliente:").grid(row=row, column=0, sticky=tk.W, pady=2)
         self.customer_entry = ttk.Entry(left)
         self.customer_entry.grid(row=row, column=1, sticky=tk.EW, pady=2, padx=(5, 0))
+        # el precio sugerido depende también del cliente (último precio que pagó): se
+        # consulta al terminar de escribirlo (salir del campo o Enter), no en cada tecla
+        self._hint_customer = None
+        self.customer_entry.bind("<FocusOut>", lambda _e: self._on_customer_selected())
+        self.customer_entry.bind("<Return>", lambda _e: self._on_customer_selected())
         row += 1
 
         ttk.Label(left, text="Notas:").grid(row=row, column=0, sticky=tk.W, pady=2)
@@ -110,6 +133,10 @@ class SalesView:
         ttk.Button(btnf, text="Registrar venta", command=self._create_sale).pack(side=tk.LEFT)
         row += 1
 
+        self.queue_lbl = ttk.Label(left, text="", foreground="#b36b00")
+        self.queue_lbl.grid(row=row, column=0, columnspan=2, sticky=tk.W)
+        row += 1
+
         for c in (0, 1):
             left.grid_columnconfigure(c, weight=1)
 
@@ -221,12 +248,24 @@ class SalesView:
         else:
             self.unit_price_entry.config(state="normal")
 
+    def _on_customer_selected(self):
+        if self.customer_entry.get().strip() != self._hint_customer:
+            self._auto_fill_price()
+
     def _auto_fill_price(self):
-        if self.manual_price.get():
-            return
         t = self.type_cb.get().strip().lower()
         q = self.quality_cb.get().strip().lower()
-        price = self.controller.get_last_sale_price(t, q)
+        customer = self.customer_entry.get().strip() if hasattr(self, "customer_entry") else ""
+        self._hint_customer = customer
+        try:
+            hints = self.controller.get_price_hints(t, q, customer)
+        except Exception:
+            hints = {}
+        self._show_price_hints(hints)
+        # precio editado a mano: no se reemplaza
+        if self.manual_price.get():
+            return
+        price = hints.get("suggested_sale")
 
         self.unit_price_entry.config(state="normal")
         self.unit_price_entry.delete(0, tk.END)
@@ -236,6 +275,16 @@ class SalesView:
             self.unit_price_entry.insert(0, "")
         self._apply_price_state(disable_when_auto=True)
 
+    def _show_price_hints(self, hints):
+        def fmt(v):
+            return f"${v:,.2f}" if v is not None else "—"
+        parts = [f"Últ. venta {fmt(hints.get('last_sale'))}",
+                 f"Prom. 30d {fmt(hints.get('avg_sale'))}",
+                 f"Últ. compra {fmt(hints.get('last_purchase'))}"]
+        if hints.get("customer_last") is not None:
+            parts.append(f"Cliente {fmt(hints.get('customer_last'))}")
+        self.price_hint_lbl.config(text=" | ".join(parts))
+
     def _on_manual_price_toggle(self):
         if self.manual_price.get():
             self._apply_price_state(disable_when_auto=False)
@@ -299,7 +348,7 @@ class SalesView:
             notes = self.notes_entry.get().strip()
             register_cash = self.add_to_cash.get()
 
-            self.controller.create_sale(
+            sale = dict(
                 date=date,
                 potato_type=t,
                 quality=q,
@@ -310,6 +359,27 @@ class SalesView:
                 notes=notes,
                 register_cash=register_cash,
             )
+            key = new_idempotency_key()
+            # si ya hay ventas en cola, esta va detrás de ellas para respetar el orden
+            queued = bool(self.journal.pending())
+            if not queued:
+                try:
+                    self.controller.create_sale(idempotency_key=key, **sale)
+                except sqlite3.OperationalError as oe:
+                    if not is_locked_error(oe):
+                        raise
+                    queued = True
+            if queued:
+                self.journal.append_sale(key, sale)
+                self.replayer.wake()
+                self._update_queue_label()
+                messagebox.showwarning(
+                    "Venta en cola",
+                    "La base de datos está ocupada. La venta quedó guardada localmente\n"
+                    "y se registrará automáticamente en cuanto sea posible."
+                )
+                self._reset_form()
+                return
 
             messagebox.showinfo("Venta", "Venta registrada correctamente.")
             self._refresh_stock_labels()
@@ -375,12 +445,7 @@ class SalesView:
             messagebox.showerror("Historial de ventas", str(e))
 
     def _export_pdf(self):
-        try:
-            from reportlab.lib.pagesizes import A4, landscape
-            from reportlab.lib import colors
-            from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-            from reportlab.lib.styles import getSampleStyleSheet
-        except ImportError:
+        if not reportlab_available():
             messagebox.showerror(
                 "Falta dependencia",
                 "Para generar PDF necesitas instalar reportlab:\n\npip install reportlab"
@@ -389,12 +454,12 @@ class SalesView:
 
         start, end, t, q = self._get_filters()
         try:
-            data, totals = self.controller.get_sales_report(start, end, t, q)
+            totals = self.controller.get_sales_totals(start, end, t, q)
         except Exception as e:
             messagebox.showerror("Reporte de Ventas", f"Error obteniendo datos: {e}")
             return
 
-        if not data:
+        if not totals["count"]:
             messagebox.showwarning("Reporte de Ventas", "No hay ventas en el período seleccionado.")
             return
 
@@ -408,68 +473,85 @@ class SalesView:
         if not path:
             return
 
-        try:
-            doc = SimpleDocTemplate(
-                path, pagesize=landscape(A4),
-                leftMargin=18, rightMargin=18, topMargin=18, bottomMargin=22
+        def _row(r):
+            pay = r.get('payment_method')
+            return [
+                r['date'],
+                r['potato_type'],
+                r['quality'],
+                str(int(r['quantity'])),
+                f"${float(r['unit_price']):,.2f}",
+                f"${float(r['total_value']):,.2f}",
+                r.get('supplier_customer') or '',
+                CODE_TO_PAY.get(pay, '—') if pay else '—',
+                r.get('username') or '',
+                r.get('notes') or ''
+            ]
+
+        def job(progress, cancel_event):
+            return write_table_pdf(
+                path,
+                title="Reporte de Ventas",
+                subtitle=f"Período: <b>{start}</b> a <b>{end}</b>",
+                headers=["Fecha", "Tipo", "Calidad", "Bultos",
+                         "Precio U.", "Total", "Cliente", "Pago", "Usuario", "Notas"],
+                chunks=self.controller.iter_sales(start, end, t, q),
+                row_mapper=_row,
+                col_weights=[9, 7, 7, 6, 9, 10, 12, 8, 9, 23],
+                align={3: 'CENTER', 4: 'RIGHT', 5: 'RIGHT', 7: 'CENTER', 8: 'CENTER'},
+                wrap_cols=(6, 9),
+                totals_row=["Totales", "", "", str(int(totals['quantity'])),
+                            "", f"${float(totals['amount']):,.2f}", "", "", "", ""],
+                total_rows=totals["count"],
+                progress=progress,
+                cancel_event=cancel_event,
             )
-            styles = getSampleStyleSheet()
-            title = Paragraph("<b>Reporte de Ventas</b>", styles['Title'])
 
-            meta = Paragraph(
-                f"Período: <b>{start}</b> a <b>{end}</b> &nbsp;&nbsp;|&nbsp;&nbsp; "
-                f"Generado: {datetime.now().strftime('%Y-%m-%d %H:%M')}",
-                styles['Normal']
-            )
+        run_in_background(
+            self.parent, "Reporte de Ventas", job,
+            on_success=lambda _n: messagebox.showinfo("Reporte de Ventas", f"PDF generado correctamente:\n{path}")
+        )
 
-            table_data = [["Fecha", "Tipo", "Calidad", "Bultos",
-                           "Precio U.", "Total", "Cliente", "Pago", "Usuario", "Notas"]]
-            for r in data:
-                pay = r.get('payment_method')
-                pay_disp = CODE_TO_PAY.get(pay, '—') if pay else '—'
-                table_data.append([
-                    r['date'],
-                    r['potato_type'],
-                    r['quality'],
-                    str(int(r['quantity'])),
-                    f"${float(r['unit_price']):,.2f}",
-                    f"${float(r['total_value']):,.2f}",
-                    r.get('supplier_customer') or '',
-                    pay_disp,
-                    r.get('username') or '',
-                    r.get('notes') or ''
-                ])
-
-            table_data.append([
-                "Totales", "", "", str(int(totals['quantity'])),
-                "", f"${float(totals['amount']):,.2f}", "", "", "", ""
-            ])
-
-            tbl = Table(table_data, repeatRows=1)
-            tbl.setStyle(TableStyle([
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f0f0f0')),
-                ('ALIGN', (3, 1), (3, -2), 'CENTER'),  # Bultos
-                ('ALIGN', (4, 1), (5, -2), 'RIGHT'),   # Precios
-                ('ALIGN', (7, 1), (8, -2), 'CENTER'),  # Pago / Usuario
-                ('GRID', (0, 0), (-1, -1), 0.25, colors.HexColor('#cccccc')),
-                ('ROWBACKGROUNDS', (0, 1), (-1, -2), [colors.white, colors.HexColor('#fbfbfb')]),
-                ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-                ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#e8f5e9')),
-            ]))
-
-            story = [title, Spacer(0, 8), meta, Spacer(0, 10), tbl]
-
-            def _footer(canvas, doc):
-                canvas.saveState()
-                canvas.setFont("Helvetica", 9)
-                canvas.drawRightString(doc.pagesize[0] - 18, 12, f"Página {doc.page}")
-                canvas.restoreState()
-
-            doc.build(story, onFirstPage=_footer, onLaterPages=_footer)
-            messagebox.showinfo("Reporte de Ventas", f"PDF generado correctamente:\n{path}")
-        except Exception as e:
-            messagebox.showerror("Reporte de Ventas", f"No se pudo generar el PDF:\n{e}")
+    # ---------------------------
+    # Cola local de ventas
+    # ---------------------------
+    def _update_queue_label(self):
+        try:
+            n = len(self.journal.pending())
+        except Exception:
+            n = 0
+        self.queue_lbl.config(text=f"Ventas en cola (pendientes de registrar): {n}" if n else "")
+
+    def _poll_journal_events(self):
+        """Revisa (en el hilo de Tk) lo que informó el hilo de reenvío."""
+        changed = False
+        try:
+            while True:
+                ev = self.replayer.events.get_nowait()
+                if ev[0] == "applied":
+                    changed = True
+                elif ev[0] == "conflict":
+                    _kind, _key, sale, msg = ev
+                    messagebox.showerror(
+                        "Venta en cola no registrada",
+                        f"No se pudo registrar la venta del {sale.get('date')} "
+                        f"({sale.get('potato_type')} {sale.get('quality')}, {sale.get('quantity')} bultos, "
+                        f"cliente: {sale.get('customer') or '—'}):\n\n{msg}"
+                    )
+        except queue.Empty:
+            pass
+        if changed:
+            self._refresh_stock_labels()
+            self._load_sales()
+            try:
+                self.parent.event_generate("<<SaleCreated>>", when="tail")
+            except Exception:
+                pass
+        self._update_queue_label()
+        try:
+            self.parent.after(1000, self._poll_journal_events)
+        except tk.TclError:
+            pass  # ventana cerrada
 
     # públicos (para refresco general desde MainWindow)
     def refresh_all(self):
@@ -35,8 +35,8 @@ class MainWindow:
         # Sistema de notificaciones
         self.notification_center = NotificationCenter(self.root)
         self.notification_system = NotificationSystem(database, self.notification_center)
-
-
+        # los intereses y estados de préstamos del día los calcula el hilo de notificaciones
+        # (no el hilo de Tk): al terminar se refresca la pestaña de préstamos
 
         self.setup_window()
         
@@ -66,6 +66,7 @@ class MainWindow:
         
         # Iniciar sistema de notificaciones
         self.notification_system.start()
+        self.root.after(500, self._refresh_after_daily_jobs)
         
         # Configurar cierre seguro
         self.root.protocol("WM_DELETE_WINDOW", self.safe_exit)
@@ -115,6 +116,15 @@ class MainWindow:
         
         # Separador
         ttk.Separator(toolbar, orient=tk.VERTICAL).pack(side=tk.LEFT, padx=5, fill=tk.Y)
+
+        # Búsqueda global (caja, inventario y préstamos)
+        self.search_var = tk.StringVar()
+        ttk.Button(toolbar, text="Buscar", command=self.show_search).pack(side=tk.RIGHT, padx=2, pady=2)
+        search_entry = ttk.Entry(toolbar, textvariable=self.search_var, width=30)
+        search_entry.pack(side=tk.RIGHT, padx=2, pady=2)
+        search_entry.bind("<Return>", lambda e: self.show_search())
+        ttk.Label(toolbar, text="Buscar:").pack(side=tk.RIGHT, padx=2)
+        self.root.bind("<Control-f>", lambda e: (search_entry.focus_set(), search_entry.select_range(0, tk.END)))
     
     def setup_notebook(self):
         """Configurar el notebook con pestañas para cada módulo (con scroll)."""
@@ -130,6 +140,10 @@ class MainWindow:
             from modules.sales.views import SalesView
         except Exception:
             SalesView = None
+        try:
+            from modules.credit_sales.views import CreditSalesView
+        except Exception:
+            CreditSalesView = None
         try:
             from modules.loans.views import LoansView
         except Exception:
@@ -169,6 +183,7 @@ class MainWindow:
                 _add_tab("Ventas", SalesView, "sales_view", self.cash_controller)
             except Exception:
                 _add_tab("Ventas", SalesView, "sales_view")
+        _add_tab("Ventas a Crédito", CreditSalesView, "credit_sales_view", getattr(self, "cash_controller", None))
         _add_tab("Inventario de Papa", InventoryView, "inventory_view")
         _add_tab("Préstamos a Empleados", LoansView, "loans_view")
         _add_tab("Empleados", EmployeesView, "employees_view")
@@ -205,6 +220,13 @@ class MainWindow:
             print("No se pudo refrescar tras venta:", ex)
 
     
+    def _refresh_after_daily_jobs(self):
+        """Espera (con after, sin bloquear Tk) a que terminen las tareas diarias y refresca Préstamos."""
+        if not self.notification_system.daily_jobs_done.is_set():
+            self.root.after(500, self._refresh_after_daily_jobs)
+            return
+        self._refresh_view_safely(getattr(self, "loans_view", None))
+
     def _refresh_view_safely(self, view):
         """Intenta llamar el método de refresco que exista en la vista."""
         if not view:
@@ -225,7 +247,10 @@ class MainWindow:
         """Se dispara al cambiar de pestaña: refresca solo ese módulo."""
         try:
             tab_text = event.widget.tab(event.widget.select(), "text").lower()
-            if "venta" in tab_text and hasattr(self, "sales_view"):
+            if "crédito" in tab_text:
+                if hasattr(self, "credit_sales_view"):
+                    self._refresh_view_safely(self.credit_sales_view)
+            elif "venta" in tab_text and hasattr(self, "sales_view"):
                 self._refresh_view_safely(self.sales_view)
             elif "caja" in tab_text and hasattr(self, "cash_view"):
                 self._refresh_view_safely(self.cash_view)
@@ -271,9 +296,17 @@ class MainWindow:
         
         self.status_time = ttk.Label(status_frame, text="")
         self.status_time.pack(side=tk.RIGHT, padx=10)
+
+        # Caja del día (contadores mantenidos por triggers)
+        self.status_cash = ttk.Label(status_frame, text="", cursor="hand2")
+        self.status_cash.pack(side=tk.RIGHT, padx=10)
+        self.status_cash.bind("<Button-1>", lambda e: self._select_tab("caja"))
+        self._cash_version = None
+        self._cash_day = None
         
         self.update_clock()
         self.update_notification_count()
+        self.update_cash_status()
     
     def update_clock(self):
         """Actualizar el reloj en la barra de estado"""
@@ -281,6 +314,37 @@ class MainWindow:
         self.status_time.config(text=now)
         self.root.after(1000, self.update_clock)
     
+    def update_cash_status(self, interval_ms=2000):
+        """
+        Revisa cada pocos segundos la versión del libro de caja (una fila); solo si cambió
+        (o cambió el día) relee los contadores de hoy y refresca la barra y el módulo de Caja.
+        """
+        try:
+            if getattr(self, "cash_controller", None) is None:
+                from modules.cash_register.controller import CashRegisterController
+                self.cash_controller = CashRegisterController(self.db, self.auth_manager)
+            version = self.cash_controller.get_ledger_version()
+            today = datetime.now().strftime('%Y-%m-%d')
+            if version != self._cash_version or today != self._cash_day:
+                first = self._cash_version is None
+                self._cash_version, self._cash_day = version, today
+                c = self.cash_controller.get_live_counters(today)
+                self.status_cash.config(
+                    text=f"Caja hoy: +${c['income']:,.2f}  -${c['expense']:,.2f}  = ${c['balance']:,.2f} "
+                         f"({c['count']} mov.)",
+                    foreground="#0b6b0b" if c['balance'] >= 0 else "#8b0000")
+                if not first and hasattr(self, "cash_view") and hasattr(self.cash_view, "on_ledger_changed"):
+                    self.cash_view.on_ledger_changed()
+        except Exception as e:
+            print(f"No se pudo actualizar la caja en la barra de estado: {e}")
+        self.root.after(interval_ms, self.update_cash_status)
+
+    def _select_tab(self, text):
+        for tab in self.notebook.tabs():
+            if text in self.notebook.tab(tab, "text").lower():
+                self.notebook.select(tab)
+                return
+
     def update_notification_count(self):
         """Actualizar contador de notificaciones"""
         count = self.notification_center.get_unread_count()
@@ -335,6 +399,114 @@ class MainWindow:
         except Exception as e:
             messagebox.showerror("Error", f"No se pudieron actualizar los módulos: {str(e)}")
     
+    def show_search(self):
+        """Ventana de resultados de la búsqueda global (se actualiza mientras se escribe)"""
+        if getattr(self, "search_index", None) is None:
+            from utils.search import SearchIndex
+            self.search_index = SearchIndex(self.db)
+        if not self.search_index.available:
+            messagebox.showwarning("Búsqueda", "La búsqueda de texto completo no está disponible en esta instalación de SQLite")
+            return
+
+        win = getattr(self, "search_window", None)
+        if win is not None and win.winfo_exists():
+            win.lift()
+            self._run_search()
+            return
+
+        win = tk.Toplevel(self.root)
+        win.title("Búsqueda global - PapaSoft")
+        win.geometry("820x420")
+        win.transient(self.root)
+        self.search_window = win
+
+        top = ttk.Frame(win, padding=8)
+        top.pack(fill=tk.X)
+        ttk.Label(top, text="Buscar:").pack(side=tk.LEFT)
+        entry = ttk.Entry(top, textvariable=self.search_var, width=50)
+        entry.pack(side=tk.LEFT, padx=5)
+        entry.focus_set()
+        self.search_status = ttk.Label(top, text="")
+        self.search_status.pack(side=tk.RIGHT)
+
+        cols = ('module', 'date', 'text', 'detail', 'amount')
+        tree = ttk.Treeview(win, columns=cols, show='headings')
+        for col, text, width in zip(cols, ("Módulo", "Fecha", "Coincidencia", "Detalle", "Monto"),
+                                    (110, 90, 360, 140, 90)):
+            tree.heading(col, text=text)
+            tree.column(col, width=width, anchor=tk.E if col == 'amount' else tk.W)
+        scroll = ttk.Scrollbar(win, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=scroll.set)
+        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(8, 0), pady=(0, 8))
+        scroll.pack(side=tk.RIGHT, fill=tk.Y, pady=(0, 8))
+        self.search_tree = tree
+        self._search_hits = {}
+        self._search_job = None
+
+        def on_key(_e):
+            # esperar a que el usuario deje de escribir un momento
+            if self._search_job:
+                win.after_cancel(self._search_job)
+            self._search_job = win.after(250, self._run_search)
+
+        entry.bind("<KeyRelease>", on_key)
+        tree.bind("<Double-1>", lambda e: self._open_search_hit())
+        tree.bind("<Return>", lambda e: self._open_search_hit())
+        self._run_search()
+
+    def _run_search(self):
+        self._search_job = None
+        tree = self.search_tree
+        tree.delete(*tree.get_children())
+        self._search_hits = {}
+        text = self.search_var.get().strip()
+        if not text:
+            self.search_status.config(text="")
+            return
+        try:
+            hits, ms = self.search_index.search(text, limit=200)
+        except Exception as e:
+            self.search_status.config(text=f"Error: {e}")
+            return
+        labels = {"cash": "Caja", "inventory": "Inventario", "loans": "Préstamos"}
+        for i, h in enumerate(hits):
+            iid = f"{h['module']}:{h['id']}"
+            tree.insert('', 'end', iid=iid, values=(
+                labels.get(h['module'], h['module']), h['date'], h['title'], h['detail'],
+                f"${(h['amount'] or 0):,.2f}"
+            ))
+            self._search_hits[iid] = h
+        self.search_status.config(text=f"{len(hits)} resultados en {ms:.1f} ms")
+
+    def _open_search_hit(self):
+        """Lleva a la pestaña del módulo del resultado seleccionado"""
+        sel = self.search_tree.selection()
+        if not sel:
+            return
+        hit = self._search_hits.get(sel[0])
+        if not hit:
+            return
+        wanted = {"cash": "caja", "inventory": "inventario", "loans": "préstamo"}[hit['module']]
+        for tab in self.notebook.tabs():
+            if wanted in self.notebook.tab(tab, "text").lower():
+                self.notebook.select(tab)
+                break
+        if hit['module'] == 'cash' and hasattr(self, "cash_view"):
+            # mostrar el día del movimiento en la grilla de caja (después del refresco por cambio de pestaña)
+            def focus_day():
+                view = self.cash_view
+                try:
+                    day = datetime.strptime(hit['date'], '%Y-%m-%d')
+                    view.start_date.set_date(day)
+                    view.end_date.set_date(day)
+                    view.filter_type.set('')
+                    view.filter_payment.set('')
+                    view.apply_filters()
+                except Exception as e:
+                    print(f"No se pudo ubicar el movimiento en caja: {e}")
+            self.root.after_idle(focus_day)
+        self.root.lift()
+
     def show_notifications(self):
         """Mostrar centro de notificaciones"""
         self.notification_center.show_notification_center()
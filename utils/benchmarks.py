@@ -0,0 +1,202 @@
+"""
+Pruebas de rendimiento sobre una base de datos sintética (temporal, no toca papasoft.db)
+
+    python -m utils.benchmarks prestamos --loans 50000 --payments 1000000
+    python -m utils.benchmarks nomina --empleados 1600
+
+prestamos: genera el volumen pedido por etapas (1/4, 1/2 y completo), mide el reporte
+de préstamos en cada una y muestra el tiempo por préstamo: con crecimiento lineal
+ese tiempo se mantiene estable entre etapas.
+nomina: reporte mensual de nómina con la plantilla duplicándose en cada etapa; cuenta
+las consultas SQL ejecutadas, que no deben crecer con la cantidad de empleados.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+
+def _bulk_load_loans(db, loans_ctrl, n_loans, n_payments, first_id):
+    """
+    Agrega préstamos [first_id, first_id + n_loans) y n_payments pagos repartidos entre ellos.
+    Se cargan con INSERT ... SELECT sin triggers (como una importación) y después se
+    recalculan los saldos y las cuotas en sentencias de conjunto.
+    """
+    triggers = loans_ctrl._balance_triggers()
+    with db.transaction() as cur:
+        for name in triggers:
+            cur.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cur.execute("""
+            WITH RECURSIVE seq(i) AS (SELECT ? UNION ALL SELECT i + 1 FROM seq WHERE i < ?)
+            INSERT INTO loans (id, employee_name, amount, date_issued, due_date, interest_rate, status)
+            SELECT i, 'Empleado ' || (i % 500), 100 + (i % 50) * 20,
+                   date('2020-01-01', '+' || (i % 1500) || ' days'),
+                   date('2020-01-01', '+' || (i % 1500 + 90) || ' days'),
+                   (i % 4) * 2.5, 'active'
+              FROM seq
+        """, (first_id, first_id + n_loans - 1))
+        cur.execute("""
+            WITH RECURSIVE seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i < ?)
+            INSERT INTO loan_payments (loan_id, payment_date, amount, notes)
+            SELECT ? + (i % ?), date('2020-01-01', '+' || (i % 1600) || ' days'), 5 + (i % 7), ''
+              FROM seq
+        """, (n_payments - 1, first_id, n_loans))
+        for name, sql in triggers.items():
+            cur.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {sql}")
+    loans_ctrl.backfill_installments()
+    loans_ctrl.rebuild_loan_balances()
+    loans_ctrl.sweep_loan_statuses()
+    db.execute_query("ANALYZE")
+
+
+def bench_loans(n_loans, n_payments, stages=3, repeat=3):
+    from database.database import Database
+    from modules.loans.controller import LoansController
+
+    tmp = tempfile.mkdtemp(prefix="papasoft_bench_")
+    db = Database(os.path.join(tmp, "bench.db"))
+    try:
+        ctrl = LoansController(db, None)
+        results = []
+        loaded_loans = loaded_payments = 0
+        for k in range(stages):
+            frac = 2 ** (k - stages + 1)  # ... 1/4, 1/2, 1
+            target_loans, target_payments = int(n_loans * frac), int(n_payments * frac)
+            t0 = time.perf_counter()
+            _bulk_load_loans(db, ctrl, target_loans - loaded_loans, target_payments - loaded_payments,
+                             loaded_loans + 1)
+            load_s = time.perf_counter() - t0
+            loaded_loans, loaded_payments = target_loans, target_payments
+
+            best = None
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                rows = ctrl.get_loans_report()
+                elapsed = time.perf_counter() - t0
+                best = elapsed if best is None else min(best, elapsed)
+            assert len(rows) == loaded_loans
+            results.append((loaded_loans, loaded_payments, best, load_s))
+            print(f"{loaded_loans:>9,} préstamos {loaded_payments:>11,} pagos | reporte {best * 1000:9.1f} ms"
+                  f" | {best * 1e6 / loaded_loans:7.2f} µs/préstamo | carga {load_s:6.1f} s")
+
+        plan = db.execute_query("EXPLAIN QUERY PLAN " + ctrl._loans_report_query(None, None, None)[0])
+        print("\nPlan del reporte:")
+        for r in plan:
+            print("  " + r["detail"])
+        if len(results) > 1:
+            first, last = results[0], results[-1]
+            growth = (last[2] / first[2]) / (last[0] / first[0])
+            print(f"\nCrecimiento del tiempo / crecimiento de datos: {growth:.2f} (≈1 es lineal)")
+        return results
+    finally:
+        db.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _bulk_load_payroll(db, cash_ctrl, n_employees, first_id, months=12):
+    """
+    Agrega empleados [first_id, first_id + n_employees) con un préstamo cada uno y, por cada
+    mes de 2024, una deducción por nómina y sus dos movimientos de Caja (deducción y sueldo).
+    """
+    pago = cash_ctrl.get_category_id("nomina_pago")
+    deduccion = cash_ctrl.get_category_id("nomina_deduccion_prestamo")
+    last_id = first_id + n_employees - 1
+    with db.transaction() as cur:
+        cur.execute("""
+            WITH RECURSIVE seq(i) AS (SELECT ? UNION ALL SELECT i + 1 FROM seq WHERE i < ?)
+            INSERT INTO employees (id, first_name, last_name, salary)
+            SELECT i, 'Nombre' || i, 'Apellido' || i, 800 + (i % 20) * 50 FROM seq
+        """, (first_id, last_id))
+        cur.execute("""
+            WITH RECURSIVE seq(i) AS (SELECT ? UNION ALL SELECT i + 1 FROM seq WHERE i < ?)
+            INSERT INTO loans (employee_id, employee_name, amount, date_issued, due_date, interest_rate, status)
+            SELECT i, 'Nombre' || i || ' Apellido' || i, 2000, '2024-01-01', '2024-12-31', 0, 'active' FROM seq
+        """, (first_id, last_id))
+        cur.execute("""
+            WITH RECURSIVE m(k) AS (SELECT 0 UNION ALL SELECT k + 1 FROM m WHERE k < ?)
+            INSERT INTO loan_payments (loan_id, payment_date, amount, notes, is_payroll_deduction)
+            SELECT l.id, date('2024-01-28', '+' || m.k || ' months'), 100, 'Deducción de nómina', 1
+              FROM loans l, m
+             WHERE l.employee_id BETWEEN ? AND ?
+        """, (months - 1, first_id, last_id))
+        cur.execute("""
+            WITH RECURSIVE m(k) AS (SELECT 0 UNION ALL SELECT k + 1 FROM m WHERE k < ?)
+            INSERT INTO cash_register (date, type, description, amount, payment_method, category,
+                                       category_id, employee_id)
+            SELECT date('2024-01-28', '+' || m.k || ' months'), t.type,
+                   t.prefix || e.first_name || ' ' || e.last_name,
+                   CASE t.type WHEN 'income' THEN 100 ELSE e.salary - 100 END,
+                   'cash', t.category, t.category_id, e.id
+              FROM employees e, m,
+                   (SELECT 'income' AS type, 'Deducción préstamo vía nómina: ' AS prefix,
+                           'nomina_deduccion_prestamo' AS category, ? AS category_id
+                    UNION ALL
+                    SELECT 'expense', 'Pago de salario: ', 'nomina_pago', ?) t
+             WHERE e.id BETWEEN ? AND ?
+        """, (months - 1, deduccion, pago, first_id, last_id))
+    db.execute_query("ANALYZE")
+
+
+def bench_payroll(n_employees, stages=4, repeat=3):
+    from database.database import Database
+    from modules.payroll.controller import PayrollController
+
+    tmp = tempfile.mkdtemp(prefix="papasoft_bench_")
+    db = Database(os.path.join(tmp, "bench.db"))
+    try:
+        ctrl = PayrollController(db, None)
+        statements = []
+        # sentencias de primer nivel (los pasos de triggers llegan como comentarios '--')
+        db.connect().set_trace_callback(lambda sql: statements.append(sql)
+                                        if not sql.lstrip().startswith("--") else None)
+        results = []
+        loaded = 0
+        for k in range(stages):
+            target = max(1, int(n_employees * 2 ** (k - stages + 1)))  # ... 1/4, 1/2, 1
+            _bulk_load_payroll(db, ctrl.loans.cash, target - loaded, loaded + 1)
+            loaded = target
+
+            best = None
+            for _ in range(repeat):
+                statements.clear()
+                t0 = time.perf_counter()
+                rows, totals = ctrl.get_month_report(2024, 6)
+                elapsed = time.perf_counter() - t0
+                best = elapsed if best is None else min(best, elapsed)
+            queries = len(statements)
+            assert len(rows) == loaded and totals["deduct"] == round(100 * loaded, 2)
+            results.append((loaded, queries, best))
+            print(f"{loaded:>7,} empleados | {queries:3d} consultas | reporte {best * 1000:8.1f} ms"
+                  f" | {best * 1e6 / loaded:7.2f} µs/empleado")
+
+        counts = {q for _, q, _ in results}
+        print("\nConsultas por reporte: " + (f"constantes ({counts.pop()})" if len(counts) == 1
+                                             else "varían con la plantilla: " + ", ".join(map(str, sorted(counts)))))
+        return results
+    finally:
+        db.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m utils.benchmarks",
+                                     description="Pruebas de rendimiento de PapaSoft sobre datos sintéticos.")
+    parser.add_argument("caso", choices=("prestamos", "nomina"),
+                        help="prestamos: reporte de préstamos con pagos | nomina: reporte mensual de nómina")
+    parser.add_argument("--loans", type=int, default=50000, help="Préstamos a generar (por defecto 50000)")
+    parser.add_argument("--payments", type=int, default=1000000, help="Pagos a generar (por defecto 1000000)")
+    parser.add_argument("--empleados", type=int, default=1600, help="Empleados a generar (por defecto 1600)")
+    parser.add_argument("--etapas", type=int, default=None,
+                        help="Etapas de crecimiento, cada una duplica (por defecto 3 en prestamos, 4 en nomina)")
+    args = parser.parse_args(argv)
+    if args.caso == "nomina":
+        bench_payroll(args.empleados, stages=max(1, args.etapas or 4))
+    else:
+        bench_loans(args.loans, args.payments, stages=max(1, args.etapas or 3))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
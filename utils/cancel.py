@@ -0,0 +1,8 @@
+"""
+Cancelación de trabajos largos (exportaciones, importaciones, corridas de nómina)
+- Sin dependencias de ventanas: la pueden importar los procesos de trabajo
+"""
+
+
+class ExportCancelled(Exception):
+    """El usuario canceló la exportación."""
@@ -0,0 +1,164 @@
+"""
+Exportación de datos tabulares a CSV, CSV comprimido (.csv.gz) o XLSX
+- Las filas llegan por bloques desde los controladores (Database.stream_query): memoria constante
+- Los valores se escriben con su tipo (números como números, no como "$1,234.00")
+- Se puede usar desde las vistas (en segundo plano, ver utils.report_export.run_in_background)
+  o desde la línea de comandos:
+
+    python -m utils.export caja 2024-01-01 2024-12-31 -o caja_2024.csv.gz
+    python -m utils.export flujo 2024-01-01 2024-12-31 --agrupar month -o flujo.xlsx
+"""
+import argparse
+import csv
+import gzip
+import os
+import sys
+
+from utils.cancel import ExportCancelled
+
+FORMATS = ("csv", "csv.gz", "xlsx")
+
+
+def detect_format(path):
+    """Formato según la extensión del archivo (por defecto CSV)."""
+    lower = path.lower()
+    if lower.endswith(".csv.gz") or lower.endswith(".gz"):
+        return "csv.gz"
+    if lower.endswith(".xlsx"):
+        return "xlsx"
+    return "csv"
+
+
+class _CsvSink:
+    def __init__(self, path, compressed):
+        if compressed:
+            self._f = gzip.open(path, "wt", encoding="utf-8", newline="")
+        else:
+            # utf-8 con BOM: Excel abre bien las tildes
+            self._f = open(path, "w", encoding="utf-8-sig", newline="")
+        self._w = csv.writer(self._f)
+
+    def write(self, row):
+        self._w.writerow(["" if v is None else v for v in row])
+
+    def close(self):
+        self._f.close()
+
+
+class _XlsxSink:
+    def __init__(self, path, sheet_title):
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            raise Exception("Para exportar a XLSX necesitas instalar openpyxl:\n\npip install openpyxl")
+        self._path = path
+        self._wb = Workbook(write_only=True)  # escribe fila por fila sin guardar la hoja en memoria
+        self._ws = self._wb.create_sheet(title=(sheet_title or "Datos")[:31])
+
+    def write(self, row):
+        self._ws.append(list(row))
+
+    def close(self):
+        self._wb.save(self._path)
+
+
+def export_rows(path, headers, chunks, row_mapper=None, fmt=None, sheet_title="Datos",
+                total_rows=None, progress=None, cancel_event=None):
+    """
+    Escribe headers + todas las filas de chunks en path. Devuelve la cantidad de filas.
+
+    - chunks: iterable de listas de filas (dict)
+    - row_mapper(fila) -> lista de valores tipados; sin mapper se usan las filas tal cual
+    - progress(hechas, total) tras cada bloque; cancel_event (threading.Event) cancela
+      y borra el archivo a medias
+    """
+    fmt = fmt or detect_format(path)
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato no soportado: {fmt}")
+    sink = _XlsxSink(path, sheet_title) if fmt == "xlsx" else _CsvSink(path, fmt == "csv.gz")
+
+    done = 0
+    finished = False
+    try:
+        sink.write(headers)
+        for chunk in chunks:
+            if cancel_event is not None and cancel_event.is_set():
+                raise ExportCancelled()
+            for r in chunk:
+                sink.write(row_mapper(r) if row_mapper else r)
+            done += len(chunk)
+            if progress:
+                progress(done, total_rows)
+        finished = True
+    finally:
+        try:
+            sink.close()
+        finally:
+            if not finished and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    return done
+
+
+# ------------------------------
+# Línea de comandos
+# ------------------------------
+DATASETS = ("caja", "flujo", "ventas", "prestamos")
+
+
+def _run_dataset(db, args):
+    # los controladores se usan solo para leer: no hace falta sesión de usuario
+    from modules.cash_register.controller import CashRegisterController
+    cash = CashRegisterController(db, None)
+
+    def progress(done, total):
+        print(f"\r{done:,} filas" + (f" de {total:,}" if total else ""), end="", file=sys.stderr)
+
+    if args.dataset == "caja":
+        return cash.export_transactions(args.output, args.desde, args.hasta, progress=progress)
+    if args.dataset == "flujo":
+        return cash.export_cash_flow(args.output, args.desde, args.hasta, args.agrupar, progress=progress)
+    if args.dataset == "ventas":
+        from modules.sales.controller import SalesController
+        return SalesController(db, None, cash).export_sales(args.output, args.desde, args.hasta,
+                                                            progress=progress)
+    from modules.loans.controller import LoansController
+    return LoansController(db, None).export_loans_report(args.output, args.desde, args.hasta,
+                                                         progress=progress)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m utils.export",
+        description="Exporta datos de PapaSoft a CSV, CSV.GZ o XLSX (según la extensión de salida).",
+    )
+    parser.add_argument("dataset", choices=DATASETS,
+                        help="caja: movimientos | flujo: flujo de caja | ventas | prestamos")
+    parser.add_argument("desde", help="Fecha inicial (YYYY-MM-DD)")
+    parser.add_argument("hasta", help="Fecha final (YYYY-MM-DD)")
+    parser.add_argument("-o", "--output", required=True, help="Archivo de salida (.csv, .csv.gz o .xlsx)")
+    parser.add_argument("--db", default="papasoft.db", help="Base de datos (por defecto papasoft.db)")
+    parser.add_argument("--agrupar", choices=("day", "week", "month"), default="day",
+                        help="Agrupación del flujo de caja")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f"No existe la base de datos: {args.db}")
+
+    from database.database import Database
+    db = Database(args.db)
+    try:
+        n = _run_dataset(db, args)
+    except Exception as e:
+        print(f"\nError: {e}", file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+    print(f"\n{n:,} filas exportadas a {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,6 +14,8 @@ class NotificationSystem:
         self.check_interval = check_interval
         self.running = False
         self.thread = None
+        self._last_daily_run = None
+        self.daily_jobs_done = threading.Event()  # primera corrida de run_daily_jobs terminada
     
     def start(self):
         """Iniciar el sistema de notificaciones"""
@@ -31,6 +33,7 @@ class NotificationSystem:
         """Bucle principal de verificación"""
         while self.running:
             try:
+                self.run_daily_jobs()
                 self.check_overdue_loans()
                 self.check_low_stock()
                 self.check_daily_cash_balance()
@@ -39,16 +42,29 @@ class NotificationSystem:
                 print(f"Error en sistema de notificaciones: {e}")
                 time.sleep(60)  # Esperar 1 minuto antes de reintentar
     
+    def run_daily_jobs(self):
+        """Tareas de mantenimiento: al iniciar y luego una vez por día"""
+        today = datetime.now().strftime('%Y-%m-%d')
+        if self._last_daily_run == today:
+            return
+        try:
+            from modules.loans.controller import LoansController
+            loans = LoansController(self.db, None)
+            loans.accrual.accrue(today)  # solo los días aún no devengados
+            loans.sweep_loan_statuses(today)
+            self._last_daily_run = today
+        except Exception as e:
+            print(f"Error en tareas diarias: {e}")
+        finally:
+            self.daily_jobs_done.set()
+
     def check_overdue_loans(self):
         """Verificar préstamos vencidos"""
         try:
             query = """
-                SELECT l.*, 
-                       (SELECT COALESCE(SUM(amount), 0) FROM loan_payments WHERE loan_id = l.id) as total_paid,
-                       (l.amount * (1 + l.interest_rate / 100)) - 
-                       (SELECT COALESCE(SUM(amount), 0) FROM loan_payments WHERE loan_id = l.id) as balance
+                SELECT l.*
                 FROM loans l
-                WHERE l.status = 'active' AND l.due_date < date('now')
+                WHERE l.status IN ('active', 'overdue') AND l.due_date < date('now') AND l.balance > 0
             """
             
             results = self.db.execute_query(query)
@@ -107,18 +123,15 @@ class NotificationSystem:
         try:
             today = datetime.now().strftime('%Y-%m-%d')
             
-            # Verificar si ya se hizo el cierre de caja hoy
-            query_check = "SELECT COUNT(*) FROM cash_register WHERE date = ? AND description LIKE '%CIERRE DE CAJA%'"
+            # Verificar si ya se hizo el cierre de caja hoy (índice único de cash_closures.date)
+            query_check = "SELECT 1 FROM cash_closures WHERE date = ? LIMIT 1"
             result = self.db.execute_query(query_check, (today,))
             
-            if result and result[0][0] == 0:
-                # Obtener balance del día
+            if not result:
+                # Balance provisional del día desde el libro de saldos diarios
                 query_balance = """
-                    SELECT 
-                        SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) as income,
-                        SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) as expense,
-                        SUM(CASE WHEN type = 'income' THEN amount ELSE -amount END) as balance
-                    FROM cash_register 
+                    SELECT COALESCE(SUM(income), 0) - COALESCE(SUM(expense), 0) AS balance
+                    FROM cash_daily_balances
                     WHERE date = ?
                 """
                 
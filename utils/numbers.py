@@ -0,0 +1,51 @@
+"""
+Lectura de montos escritos a mano o exportados por otros sistemas (importaciones de CSV/XLSX)
+- Acepta "$", espacios y negativos entre paréntesis: "(1.500,00)" -> -1500.0
+- Con punto y coma a la vez, el último separador es el decimal: "1.234,56" / "1,234.56"
+- Solo puntos: "30.000" o "1.500.000" (grupos de tres) son miles; "2.7" y "0.500" son decimales
+- Solo comas: una coma es decimal ("2,5"); "1,500,000" (varios grupos de tres) son miles
+- Cualquier otra forma (p. ej. "1.50.0") devuelve None en vez de adivinar
+"""
+import re
+
+_DOT_THOUSANDS = re.compile(r"^-?[1-9]\d{0,2}(\.\d{3})+$")
+_COMMA_THOUSANDS = re.compile(r"^-?[1-9]\d{0,2}(,\d{3}){2,}$")
+
+
+def parse_amount(raw):
+    """
+    Monto como float, o None si está vacío o no se puede leer sin ambigüedad.
+
+    >>> parse_amount("30.000"), parse_amount("1.234,56"), parse_amount("(1.500,00)")
+    (30000.0, 1234.56, -1500.0)
+    >>> parse_amount("0.500"), parse_amount("-0.250"), parse_amount("2,5")
+    (0.5, -0.25, 2.5)
+    >>> parse_amount("1,500,000"), parse_amount("1.50.0")
+    (1500000.0, None)
+    """
+    if raw is None or raw == "":
+        return None
+    if isinstance(raw, (int, float)):
+        return float(raw)
+    txt = str(raw).strip().replace("$", "").replace(" ", "")
+    negative = txt.startswith("(") and txt.endswith(")")
+    txt = txt.strip("()")
+    if "," in txt and "." in txt:
+        txt = txt.replace(".", "").replace(",", ".") if txt.rfind(",") > txt.rfind(".") else txt.replace(",", "")
+    elif "." in txt:
+        if _DOT_THOUSANDS.match(txt):
+            txt = txt.replace(".", "")
+        elif txt.count(".") > 1:
+            return None
+    elif "," in txt:
+        if _COMMA_THOUSANDS.match(txt):
+            txt = txt.replace(",", "")
+        elif txt.count(",") > 1:
+            return None
+        else:
+            txt = txt.replace(",", ".")
+    try:
+        value = float(txt)
+    except ValueError:
+        return None
+    return -value if negative else value
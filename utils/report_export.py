@@ -0,0 +1,244 @@
+"""
+Servicio compartido de exportación de reportes a PDF en segundo plano.
+- Los datos se leen por bloques desde el controlador (no se cargan completos en memoria)
+- Cada bloque es una tabla que reportlab reparte en páginas con doc.build(); el avance se informa
+  a medida que los bloques se ubican en las páginas
+- El trabajo corre en un hilo; el progreso se muestra en una ventana con barra y botón Cancelar
+"""
+import os
+import queue
+import threading
+import tkinter as tk
+from tkinter import ttk, messagebox
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from utils.cancel import ExportCancelled  # noqa: F401  (se reexporta para los módulos que ya la importan de aquí)
+
+
+def reportlab_available() -> bool:
+    try:
+        import reportlab  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def write_table_pdf(path, title, subtitle, headers, chunks, col_weights,
+                    row_mapper=None, totals_row=None, align=None, wrap_cols=(),
+                    landscape_page=True, extra_styles=None, summary_lines=None,
+                    total_rows=None, progress=None, cancel_event=None):
+    """
+    Genera un PDF con una tabla larga a partir de bloques de filas.
+
+    - chunks: iterable de listas de filas (p.ej. Database.stream_query)
+    - row_mapper: convierte cada fila (dict) en la lista de celdas a mostrar
+    - col_weights: anchos relativos de columna (fijos para que todas las tablas coincidan)
+    - totals_row / summary_lines: lista o callable evaluado al terminar (permite acumular totales en row_mapper)
+    - align: {indice_columna: 'RIGHT' | 'CENTER'}; wrap_cols: columnas con texto que se ajusta
+    - progress(done, total) se llama al ubicar cada bloque en el PDF; cancel_event (threading.Event)
+      detiene el trabajo tanto al leer los bloques como al paginar
+    """
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.lib import colors
+    from reportlab.platypus import (BaseDocTemplate, PageTemplate, Frame, Table,
+                                    TableStyle, Paragraph, Spacer, Flowable)
+    from reportlab.lib.styles import getSampleStyleSheet
+
+    pagesize = landscape(A4) if landscape_page else A4
+    doc = BaseDocTemplate(path, pagesize=pagesize,
+                          leftMargin=18, rightMargin=18, topMargin=18, bottomMargin=22,
+                          title=title)
+
+    def _footer(canvas, doc):
+        canvas.saveState()
+        canvas.setFont("Helvetica", 9)
+        canvas.drawRightString(doc.pagesize[0] - 18, 12, f"Página {doc.page}")
+        canvas.restoreState()
+
+    frame = Frame(doc.leftMargin, doc.bottomMargin, doc.width, doc.height, id='normal')
+    doc.addPageTemplates([PageTemplate(id='report', frames=[frame], onPage=_footer)])
+
+    styles = getSampleStyleSheet()
+    cell_style = styles['BodyText'].clone('ReportCell', fontSize=8, leading=10)
+
+    total_w = float(sum(col_weights)) or 1.0
+    col_widths = [doc.width * w / total_w for w in col_weights]
+    align = align or {}
+    wrap_cols = set(wrap_cols or ())
+
+    base_style = [
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f0f0f0')),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.HexColor('#cccccc')),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#fbfbfb')]),
+    ]
+    for col, how in align.items():
+        base_style.append(('ALIGN', (col, 1), (col, -1), how))
+    base_style.extend(extra_styles or [])
+
+    def _cells(values):
+        out = []
+        for i, v in enumerate(values):
+            txt = "" if v is None else str(v)
+            out.append(Paragraph(escape(txt), cell_style) if i in wrap_cols and txt else txt)
+        return out
+
+    def _check_cancel():
+        if cancel_event is not None and cancel_event.is_set():
+            raise ExportCancelled()
+
+    class _Mark(Flowable):
+        """Marca invisible tras cada bloque: al ubicarla en la página informa el avance y revisa la cancelación."""
+
+        def __init__(self, done):
+            super().__init__()
+            self.done = done
+
+        def wrap(self, avail_w, avail_h):
+            return 0, 0
+
+        def draw(self):
+            _check_cancel()
+            if progress:
+                progress(self.done, total_rows)
+
+    story = [
+        Paragraph(f"<b>{escape(title)}</b>", styles['Title']),
+        Spacer(0, 8),
+        Paragraph(subtitle, styles['Normal']),
+        Spacer(0, 10),
+    ]
+    done = 0
+    finished = False
+    try:
+        for chunk in chunks:
+            _check_cancel()
+            rows = [_cells(row_mapper(r) if row_mapper else r) for r in chunk]
+            if rows:
+                tbl = Table([list(headers)] + rows, colWidths=col_widths, repeatRows=1)
+                tbl.setStyle(TableStyle(base_style))
+                story.append(tbl)
+            done += len(chunk)
+            story.append(_Mark(done))
+
+        _check_cancel()
+        totals = totals_row() if callable(totals_row) else totals_row
+        if totals:
+            tbl = Table([list(headers), _cells(totals)], colWidths=col_widths)
+            tbl.setStyle(TableStyle(base_style + [
+                ('FONTNAME', (0, 1), (-1, 1), 'Helvetica-Bold'),
+                ('BACKGROUND', (0, 1), (-1, 1), colors.HexColor('#e8f5e9')),
+            ]))
+            story += [Spacer(0, 6), tbl]
+
+        lines = summary_lines() if callable(summary_lines) else summary_lines
+        if lines:
+            story += [Spacer(0, 8)] + [Paragraph(escape(l), styles['Normal']) for l in lines]
+
+        story.append(Paragraph(f"Generado: {datetime.now().strftime('%Y-%m-%d %H:%M')}", styles['Normal']))
+        doc.build(story)
+        finished = True
+    finally:
+        if not finished:
+            # cancelado o con error: no dejar un PDF a medias
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError:
+                pass
+    return done
+
+
+class ExportProgressDialog(tk.Toplevel):
+    """Ventana modal con barra de progreso y botón Cancelar."""
+
+    def __init__(self, parent, title):
+        super().__init__(parent)
+        self.title(title)
+        self.geometry("380x130")
+        self.resizable(False, False)
+        self.transient(parent)
+
+        self.cancel_event = threading.Event()
+
+        body = ttk.Frame(self, padding=12)
+        body.pack(fill=tk.BOTH, expand=True)
+
+        self.msg = ttk.Label(body, text="Preparando datos…")
+        self.msg.pack(anchor=tk.W)
+        self.bar = ttk.Progressbar(body, mode="indeterminate", length=340)
+        self.bar.pack(fill=tk.X, pady=8)
+        self.bar.start(12)
+        self.cancel_btn = ttk.Button(body, text="Cancelar", command=self.cancel)
+        self.cancel_btn.pack(anchor=tk.E)
+
+        self.protocol("WM_DELETE_WINDOW", self.cancel)
+        self.grab_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+        self.msg.config(text="Cancelando…")
+        self.cancel_btn.config(state="disabled")
+
+    def set_progress(self, done, total):
+        if total:
+            if str(self.bar.cget("mode")) != "determinate":
+                self.bar.stop()
+                self.bar.config(mode="determinate", maximum=total)
+            self.bar["value"] = min(done, total)
+            self.msg.config(text=f"Procesando {done:,} de {total:,} registros…")
+        else:
+            self.msg.config(text=f"Procesando {done:,} registros…")
+
+
+def run_in_background(parent, title, job, on_success=None, poll_ms=100,
+                      error_text="No se pudo generar el PDF", cancel_text="Exportación cancelada."):
+    """
+    Ejecuta job(progress, cancel_event) en un hilo de trabajo mostrando un
+    ExportProgressDialog. El hilo solo se comunica con Tk mediante una cola,
+    que se revisa con after(); on_success(resultado) se llama en el hilo de Tk.
+    """
+    dlg = ExportProgressDialog(parent, title)
+    events = queue.Queue()
+
+    def progress(done, total=None):
+        events.put(("progress", done, total))
+
+    def worker():
+        try:
+            result = job(progress, dlg.cancel_event)
+            events.put(("done", result))
+        except ExportCancelled:
+            events.put(("cancelled",))
+        except Exception as e:
+            events.put(("error", e))
+
+    threading.Thread(target=worker, daemon=True).start()
+
+    def poll():
+        try:
+            while True:
+                ev = events.get_nowait()
+                kind = ev[0]
+                if kind == "progress":
+                    dlg.set_progress(ev[1], ev[2])
+                    continue
+                dlg.grab_release()
+                dlg.destroy()
+                if kind == "done":
+                    if on_success:
+                        on_success(ev[1])
+                elif kind == "cancelled":
+                    messagebox.showinfo(title, cancel_text, parent=parent)
+                else:
+                    messagebox.showerror(title, f"{error_text}:\n{ev[1]}", parent=parent)
+                return
+        except queue.Empty:
+            pass
+        dlg.after(poll_ms, poll)
+
+    dlg.after(poll_ms, poll)
+    return dlg
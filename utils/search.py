@@ -0,0 +1,125 @@
+"""
+Búsqueda de texto completo (SQLite FTS5) sobre caja, inventario y préstamos
+- Índices FTS5 de contenido externo: solo guardan el índice, el texto sigue en la tabla original
+- Los triggers de cada tabla mantienen el índice al insertar, editar o borrar
+- search() devuelve resultados de todos los módulos ordenados por relevancia (bm25)
+"""
+import re
+import sqlite3
+import time
+
+# tabla FTS -> (tabla de origen, columnas indexadas)
+FTS_SOURCES = {
+    "cash_register_fts": ("cash_register", ("description", "category")),
+    "potato_inventory_fts": ("potato_inventory", ("supplier_customer", "notes")),
+    "loans_fts": ("loans", ("employee_name", "notes")),
+}
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def build_match(text):
+    """
+    Convierte lo que escribe el usuario en una expresión MATCH segura:
+    cada palabra como prefijo entre comillas y todas obligatorias: "juan"* "per"*.
+    Devuelve None si no hay palabras buscables.
+    """
+    tokens = _TOKEN_RE.findall(text or "")
+    if not tokens:
+        return None
+    return " ".join(f'"{t}"*' for t in tokens)
+
+
+class SearchIndex:
+    def __init__(self, database):
+        self.db = database
+        self.available = self._ensure_schema()
+
+    def _ensure_schema(self):
+        """Crea los índices y sus triggers; False si este SQLite no tiene FTS5."""
+        try:
+            for fts, (table, cols) in FTS_SOURCES.items():
+                exists = self.db.execute_query(
+                    "SELECT name FROM sqlite_master WHERE type='table' AND name=?", (fts,)
+                )
+                self.db.execute_query(f"""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                        {', '.join(cols)},
+                        content='{table}', content_rowid='id',
+                        tokenize='unicode61 remove_diacritics 2'
+                    )
+                """)
+                for name, sql in self._triggers(fts, table, cols).items():
+                    self.db.execute_query(f"CREATE TRIGGER IF NOT EXISTS {name} {sql}")
+                if not exists:
+                    self.rebuild(fts)
+            return True
+        except sqlite3.OperationalError as e:
+            print(f"[SearchIndex] Búsqueda de texto completo no disponible: {e}")
+            return False
+
+    @staticmethod
+    def _triggers(fts, table, cols):
+        col_list = ", ".join(cols)
+        new_vals = ", ".join(f"new.{c}" for c in cols)
+        old_vals = ", ".join(f"old.{c}" for c in cols)
+        insert = f"INSERT INTO {fts}(rowid, {col_list}) VALUES (new.id, {new_vals});"
+        delete = f"INSERT INTO {fts}({fts}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals});"
+        return {
+            f"trg_{fts}_ai": f"AFTER INSERT ON {table} BEGIN {insert} END",
+            f"trg_{fts}_ad": f"AFTER DELETE ON {table} BEGIN {delete} END",
+            f"trg_{fts}_au": f"AFTER UPDATE OF {col_list} ON {table} BEGIN {delete} {insert} END",
+        }
+
+    def rebuild(self, fts=None):
+        """Regenera uno o todos los índices desde las tablas de origen."""
+        for name in ([fts] if fts else FTS_SOURCES):
+            self.db.execute_query(f"INSERT INTO {name}({name}) VALUES ('rebuild')")
+
+    # ------------------------------
+    # Consultas
+    # ------------------------------
+    def search(self, text, limit=50):
+        """
+        Búsqueda global. Devuelve (resultados, milisegundos); cada resultado:
+        module ('cash' | 'inventory' | 'loans'), id, date, title, detail, amount, rank.
+        """
+        expr = build_match(text)
+        if not self.available or expr is None:
+            return [], 0.0
+        t0 = time.perf_counter()
+        query = """
+            SELECT * FROM (
+                SELECT 'cash' AS module, c.id, c.date,
+                       snippet(cash_register_fts, -1, '[', ']', '…', 12) AS title,
+                       COALESCE(c.category, '') AS detail,
+                       CASE WHEN c.type = 'expense' THEN -c.amount ELSE c.amount END AS amount,
+                       bm25(cash_register_fts) AS rank
+                  FROM cash_register_fts
+                  JOIN cash_register c ON c.id = cash_register_fts.rowid
+                 WHERE cash_register_fts MATCH ?
+                UNION ALL
+                SELECT 'inventory', p.id, p.date,
+                       snippet(potato_inventory_fts, -1, '[', ']', '…', 12),
+                       p.potato_type || ' ' || p.quality || ' x' || p.quantity,
+                       p.total_value,
+                       bm25(potato_inventory_fts)
+                  FROM potato_inventory_fts
+                  JOIN potato_inventory p ON p.id = potato_inventory_fts.rowid
+                 WHERE potato_inventory_fts MATCH ?
+                UNION ALL
+                SELECT 'loans', l.id, l.date_issued,
+                       snippet(loans_fts, -1, '[', ']', '…', 12),
+                       COALESCE(l.status, ''),
+                       l.amount,
+                       bm25(loans_fts)
+                  FROM loans_fts
+                  JOIN loans l ON l.id = loans_fts.rowid
+                 WHERE loans_fts MATCH ?
+            )
+            ORDER BY rank, date DESC
+            LIMIT ?
+        """
+        rows = self.db.execute_query(query, (expr, expr, expr, int(limit)))
+        elapsed = (time.perf_counter() - t0) * 1000.0
+        return [dict(r) for r in rows or []], elapsed
@@ -0,0 +1,192 @@
+# utils/virtual_tree.py
+import tkinter as tk
+from tkinter import ttk
+from collections import OrderedDict
+
+
+class VirtualTreeview(ttk.Frame):
+    """
+    Treeview "virtual": solo mantiene en pantalla las filas visibles.
+    Las filas se piden por bloques al proveedor de datos y se guardan en una
+    caché LRU. Cada bloque se pide por keyset (continuando desde la última clave
+    del bloque anterior, si está en caché) y, si no, por offset (saltos con la
+    barra de desplazamiento).
+
+    Parámetros:
+    - fetch_block(after, offset, limit) -> lista de filas (dict)
+        after: clave de la última fila del bloque anterior (o None para usar offset)
+    - count_rows() -> total de filas del filtro actual
+    - to_values(row) -> (values, tags) para insertar en el Treeview
+    - key_of(row) -> clave de orden de la fila (para keyset)
+    - iid_of(row) -> iid único de la fila (por defecto str(row['id']))
+    """
+
+    def __init__(self, parent, columns, fetch_block, count_rows, to_values, key_of,
+                 iid_of=None, block_size=200, max_blocks=30, **tree_kwargs):
+        super().__init__(parent)
+        self.fetch_block = fetch_block
+        self.count_rows = count_rows
+        self.to_values = to_values
+        self.key_of = key_of
+        self.iid_of = iid_of or (lambda r: str(r['id']))
+        self.block_size = int(block_size)
+        self.max_blocks = int(max_blocks)
+
+        self.tree = ttk.Treeview(self, columns=columns, show='headings', **tree_kwargs)
+        self.vsb = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.tree.grid(row=0, column=0, sticky="nsew")
+        self.vsb.grid(row=0, column=1, sticky="ns")
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+
+        self.total = 0
+        self.top = 0
+        self._blocks = OrderedDict()
+        self._rows_by_iid = {}
+
+        self.tree.bind("<Configure>", lambda _e: self._render())
+        self.tree.bind("<MouseWheel>", self._on_wheel)
+        self.tree.bind("<Button-4>", lambda _e: self.scroll_rows(-3))
+        self.tree.bind("<Button-5>", lambda _e: self.scroll_rows(3))
+        self.tree.bind("<Up>", lambda e: self._on_arrow(-1))
+        self.tree.bind("<Down>", lambda e: self._on_arrow(1))
+        self.tree.bind("<Prior>", lambda _e: (self.scroll_rows(-self._visible_count()), "break")[1])
+        self.tree.bind("<Next>", lambda _e: (self.scroll_rows(self._visible_count()), "break")[1])
+        self.tree.bind("<Home>", lambda _e: (self.scroll_to(0), "break")[1])
+        self.tree.bind("<End>", lambda _e: (self.scroll_to(self.total), "break")[1])
+
+    # ------------------------------
+    # API
+    # ------------------------------
+    def reload(self):
+        """Vuelve a contar y a leer desde el principio (tras cambiar filtros o datos)."""
+        self._blocks.clear()
+        self.total = int(self.count_rows() or 0)
+        self.top = 0
+        self._render()
+
+    def refresh(self):
+        """Relee los datos manteniendo la posición actual."""
+        self._blocks.clear()
+        self.total = int(self.count_rows() or 0)
+        self.top = max(0, min(self.top, self.total - self._visible_count()))
+        self._render()
+
+    def selection(self):
+        return self.tree.selection()
+
+    def get_row(self, iid):
+        """Fila (dict) completa de un item visible."""
+        return self._rows_by_iid.get(iid)
+
+    def scroll_rows(self, delta):
+        self.scroll_to(self.top + int(delta))
+
+    def scroll_to(self, index):
+        max_top = max(0, self.total - self._visible_count())
+        new_top = max(0, min(int(index), max_top))
+        if new_top != self.top:
+            self.top = new_top
+            self._render()
+
+    # ------------------------------
+    # Datos
+    # ------------------------------
+    def _block(self, b):
+        rows = self._blocks.get(b)
+        if rows is not None:
+            self._blocks.move_to_end(b)
+            return rows
+        prev = self._blocks.get(b - 1)
+        if prev and len(prev) == self.block_size:
+            rows = self.fetch_block(self.key_of(prev[-1]), None, self.block_size)
+        else:
+            rows = self.fetch_block(None, b * self.block_size, self.block_size)
+        self._blocks[b] = rows
+        while len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+        return rows
+
+    def _rows(self, start, count):
+        out = []
+        i = start
+        end = min(start + count, self.total)
+        while i < end:
+            b, off = divmod(i, self.block_size)
+            rows = self._block(b)
+            if off >= len(rows):
+                break  # los datos cambiaron mientras tanto
+            take = rows[off:off + (end - i)]
+            out.extend(take)
+            i += len(take)
+        return out
+
+    # ------------------------------
+    # Dibujo
+    # ------------------------------
+    def _visible_count(self):
+        style = ttk.Style()
+        row_h = int(style.lookup("Treeview", "rowheight") or 20)
+        h = self.tree.winfo_height()
+        if h <= 1:
+            return int(self.tree.cget("height") or 10)
+        return max(1, (h - 24) // row_h)  # 24 ≈ alto del encabezado
+
+    def _render(self):
+        n = self._visible_count()
+        selected = set(self.tree.selection())
+        rows = self._rows(self.top, n) if self.total else []
+
+        children = self.tree.get_children()
+        if children:
+            self.tree.delete(*children)
+        self._rows_by_iid = {}
+        for r in rows:
+            iid = self.iid_of(r)
+            values, tags = self.to_values(r)
+            self.tree.insert('', 'end', iid=iid, values=values, tags=tags)
+            self._rows_by_iid[iid] = r
+        keep = [i for i in selected if i in self._rows_by_iid]
+        if keep:
+            self.tree.selection_set(keep)
+
+        if self.total:
+            self.vsb.set(self.top / self.total, min(1.0, (self.top + n) / self.total))
+        else:
+            self.vsb.set(0.0, 1.0)
+
+    def _on_scrollbar(self, *args):
+        if not args:
+            return
+        if args[0] == "moveto":
+            self.scroll_to(int(float(args[1]) * self.total))
+        elif args[0] == "scroll":
+            step = int(args[1])
+            if len(args) > 2 and args[2] == "pages":
+                step *= self._visible_count()
+            self.scroll_rows(step)
+
+    def _on_wheel(self, event):
+        # Windows/Mac: delta múltiplo de 120 (o pequeño en Mac)
+        step = -1 if event.delta > 0 else 1
+        if abs(event.delta) >= 120:
+            step *= max(1, abs(event.delta) // 120) * 3
+        self.scroll_rows(step)
+        return "break"
+
+    def _on_arrow(self, direction):
+        children = self.tree.get_children()
+        if not children:
+            return None
+        focus = self.tree.focus()
+        at_edge = (direction < 0 and focus == children[0]) or (direction > 0 and focus == children[-1])
+        if not at_edge:
+            return None  # comportamiento normal del Treeview
+        old_top = self.top
+        self.scroll_rows(direction)
+        if self.top != old_top:
+            children = self.tree.get_children()
+            target = children[0] if direction < 0 else children[-1]
+            self.tree.selection_set(target)
+            self.tree.focus(target)
+        return "break"